@@ -1,20 +1,248 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-from datetime import datetime
+import numpy as np
+from datetime import datetime, timedelta, timezone
 import io
+import codecs
+import csv
+import functools
 import hashlib
 import os
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 
-# Firebase imports
-import firebase_admin
-from firebase_admin import credentials, auth, db
+# Configuração da página Streamlit (primeiro comando do Streamlit)
+st.set_page_config(page_title="Gestão Financeira", page_icon="💰", layout="wide")
+
+# Configuração das métricas de desempenho: seção [metrics] do secrets.toml
+# (enabled, admins, port, log) ou as variáveis APP_METRICS, APP_METRICS_ADMINS
+# e APP_METRICS_PORT. Vazia quando o app roda sem secrets.toml.
+def metrics_settings():
+    try:
+        settings = dict(st.secrets.get("metrics", {}))
+    except FileNotFoundError:
+        settings = {}
+    if "APP_METRICS" in os.environ:
+        settings["enabled"] = os.environ["APP_METRICS"].lower() in ("1", "true", "yes")
+    if "APP_METRICS_ADMINS" in os.environ:
+        settings["admins"] = [email.strip() for email in os.environ["APP_METRICS_ADMINS"].split(",") if email.strip()]
+    if "APP_METRICS_PORT" in os.environ:
+        settings["port"] = int(os.environ["APP_METRICS_PORT"])
+    return settings
+
+# Span que não mede nada, usado quando as métricas estão desligadas
+class NullSpan:
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN = NullSpan()
+
+# Mede o tempo de um trecho; "rows" pode ser preenchido dentro do bloco
+class Span:
+    __slots__ = ("metrics", "name", "rows", "started")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.rows = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.started, self.rows)
+        return False
+
+# Métricas do processo: tempo, chamadas e linhas de cada span e contadores com rótulo
+# (chamadas e bytes do Firebase). Desligadas, span() devolve um objeto vazio e os
+# métodos instrumentados chamam a função original direto.
+# Os spans da thread do script também entram no rastro da execução atual (rerun).
+class Metrics:
+    def __init__(self, enabled=False, admins=()):
+        self.enabled = enabled
+        self.admins = set(admins)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            # nome -> [chamadas, segundos, maior tempo, linhas]
+            self.spans = {}
+            # (métrica, rótulo) -> total
+            self.counters = Counter()
+
+    def span(self, name):
+        return Span(self, name) if self.enabled else NULL_SPAN
+
+    def record(self, name, seconds, rows=None):
+        with self.lock:
+            totals = self.spans.get(name)
+            if totals is None:
+                totals = self.spans[name] = [0, 0.0, 0.0, 0]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            totals[3] += rows or 0
+        trace = getattr(self.local, "trace", None)
+        if trace is not None:
+            trace.append({"span": name, "seconds": seconds, "rows": rows})
+
+    def count(self, metric, label, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[(metric, label)] += amount
+        counts = getattr(self.local, "counts", None)
+        if counts is not None:
+            counts[(metric, label)] += amount
+
+    # Rastro de uma execução do script: spans e contadores da thread atual
+    @contextmanager
+    def trace(self):
+        self.local.trace, self.local.counts = [], Counter()
+        try:
+            yield self.local.trace, self.local.counts
+        finally:
+            self.local.trace = self.local.counts = None
+
+    # Faz a função, executada em outra thread, registrar no rastro da execução atual
+    def propagate(self, function):
+        trace, counts = getattr(self.local, "trace", None), getattr(self.local, "counts", None)
+        if trace is None:
+            return function
+
+        def traced(*args, **kwargs):
+            self.local.trace, self.local.counts = trace, counts
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.local.trace = self.local.counts = None
+        return traced
+
+    def snapshot(self):
+        with self.lock:
+            return {name: list(totals) for name, totals in self.spans.items()}, Counter(self.counters)
+
+    # Formato de texto do Prometheus (version 0.0.4)
+    def prometheus_text(self):
+        spans, counters = self.snapshot()
+        lines = []
+        for metric, index, kind, help_text in (
+            ("gestor_span_calls_total", 0, "counter", "Execuções de cada trecho instrumentado"),
+            ("gestor_span_seconds_total", 1, "counter", "Tempo total de cada trecho, em segundos"),
+            ("gestor_span_seconds_max", 2, "gauge", "Maior tempo de cada trecho, em segundos"),
+            ("gestor_span_rows_total", 3, "counter", "Linhas processadas por cada trecho"),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            lines += [f'{metric}{{span="{name}"}} {totals[index]}' for name, totals in sorted(spans.items())]
+        for metric, label_name, help_text in (
+            ("gestor_firebase_calls_total", "operation", "Chamadas ao Firebase por operação"),
+            ("gestor_firebase_bytes_total", "direction", "Bytes trocados com o Firebase (JSON)"),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [
+                f'{metric}{{{label_name}="{label}"}} {total}'
+                for (name, label), total in sorted(counters.items()) if name == metric
+            ]
+        return "\n".join(lines) + "\n"
+
+METRICS_LOGGER = logging.getLogger("gestor_financeiro.metrics")
+
+# Endpoint /metrics no formato do Prometheus, servido por uma thread do processo
+def start_metrics_server(metrics, host, port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        # Porta já em uso, por exemplo por outro processo do app
+        METRICS_LOGGER.warning(f"Endpoint de métricas não iniciado em {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metricas", daemon=True).start()
+    return server
 
-# Acessar variáveis do TOML
-firebase_secrets = st.secrets["firebase"]
+# Métricas compartilhadas por todas as sessões do processo. O script é executado de novo
+# a cada rerun, então a instância fica no cache_resource e não em uma variável do módulo.
+@st.cache_resource
+def get_metrics():
+    settings = metrics_settings()
+    metrics = Metrics(enabled=bool(settings.get("enabled", False)), admins=settings.get("admins", ()))
+    if metrics.enabled:
+        if settings.get("log", True) and not METRICS_LOGGER.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            METRICS_LOGGER.addHandler(handler)
+            METRICS_LOGGER.setLevel(logging.INFO)
+            METRICS_LOGGER.propagate = False
+        if settings.get("port"):
+            start_metrics_server(metrics, settings.get("host", "127.0.0.1"), int(settings["port"]))
+    return metrics
 
-# Initialize Firebase (if not already initialized)
-if not firebase_admin._apps:
+METRICS = get_metrics()
+
+# Decorador que mede a função como um span; "rows" calcula as linhas a partir do resultado
+def instrumented(name, rows=None):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return function(*args, **kwargs)
+            with METRICS.span(name) as span:
+                result = function(*args, **kwargs)
+                if rows is not None:
+                    span.rows = rows(result)
+            return result
+        return wrapper
+    return decorate
+
+# Tamanho em bytes do JSON trafegado
+def payload_size(data):
+    return len(json.dumps(data, separators=(",", ":"), default=str).encode("utf-8"))
+
+# App do Firebase, criado uma única vez por processo e não a cada rerun do script.
+# O firebase_admin só é importado quando é usado, o que reduz o tempo de partida do app.
+@st.cache_resource
+def get_firebase_app():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    if firebase_admin._apps:
+        return firebase_admin.get_app()
+
+    # Acessar variáveis do TOML
+    firebase_secrets = st.secrets["firebase"]
     cred = credentials.Certificate({
     "type": firebase_secrets["type"],
     "project_id": firebase_secrets["project_id"],
@@ -28,17 +256,21 @@ if not firebase_admin._apps:
     "client_x509_cert_url": firebase_secrets["client_x509_cert_url"],
     "universe_domain": firebase_secrets["universe_domain"]
     })
-    
-    firebase_admin.initialize_app(cred, {
+
+    return firebase_admin.initialize_app(cred, {
         'databaseURL': firebase_secrets["databaseURL"]
     })
 
-# Configuração da página Streamlit (primeiro comando do Streamlit)
-st.set_page_config(page_title="Gestão Financeira", page_icon="💰", layout="wide")
+# Módulo de autenticação do Firebase, com o app já inicializado
+def firebase_auth():
+    from firebase_admin import auth
+    get_firebase_app()
+    return auth
 
 # Função para registrar um novo usuário
 def register_user(email, password):
     try:
+        auth = firebase_auth()
         user = auth.create_user(
             email=email,
             password=password
@@ -51,199 +283,2869 @@ def register_user(email, password):
 
 # Função para autenticar usuário
 def authenticate_user(email, password):
+    auth = firebase_auth()
     try:
         user = auth.get_user_by_email(email)
         # Aqui você pode adicionar lógica para verificar a senha.
         return user
-    except firebase_admin.auth.UserNotFoundError:
+    except auth.UserNotFoundError:
         st.error("Usuário não encontrado.")
         return None
 
-class Expense:
-    def __init__(self, id, establishment, category, value, date):
-        self.id = id
-        self.establishment = establishment
-        self.category = category
-        self.value = float(value)
-        self.date = date
-
-class MonthlySavings:
-    def __init__(self, id, saving_type, value, date):
-        self.id = id
-        self.saving_type = saving_type
-        self.value = float(value)
-        self.date = date
+# Opções oferecidas nos formulários; também pré-carregadas como categorias do extrato
+EXPENSE_CATEGORIES = ["Alimentação", "Transporte", "Custo Fixo", "Saúde", "Educação", "Lazer", "Restaurante", "Outros"]
+SAVINGS_TYPES = ["Salário", "Bônus", "Extra", "Décimo Terceiro", "FGTS"]
+
+# Colunas de cada extrato e seus tipos, na ordem em que aparecem nas tabelas.
+# 'category' vira Categorical no DataFrame; 'text' é internado e exibido como texto livre.
+# 'key' é a chave do registro no banco (oculta nas tabelas); o 'id' só numera as linhas.
+EXPENSE_SCHEMA = {"ID": "id", "Data": "date", "Estabelecimento": "text", "Categoria": "category", "Valor": "value", "Chave": "key"}
+SAVINGS_SCHEMA = {"ID": "id", "Tipo Entrada": "category", "Data": "date", "Valor": "value", "Chave": "key"}
+
+LEDGER_DTYPES = {"id": np.int64, "key": np.int64, "date": "datetime64[ns]", "value": np.float64}
+
+# Chaves de registros novos: 62 bits aleatórios com o bit 62 ligado, então nunca coincidem
+# com as chaves antigas (iguais ao ID) nem, na prática, entre sessões do mesmo usuário
+RECORD_KEY_FLAG = 1 << 62
+
+def new_record_keys(count):
+    random_bits = np.frombuffer(os.urandom(8 * count), dtype=np.int64) & (RECORD_KEY_FLAG - 1)
+    return random_bits | RECORD_KEY_FLAG
+
+# Chaves das ocorrências de regras recorrentes: derivadas da regra e do índice da ocorrência,
+# então duas sessões que lançam a mesma ocorrência gravam no mesmo caminho e a segunda
+# gravação só repete a primeira
+def occurrence_record_keys(rule_keys, indices):
+    digests = b"".join(
+        hashlib.blake2b(f"{rule_key}/{index}".encode(), digest_size=8).digest()
+        for rule_key, index in zip(rule_keys, indices)
+    )
+    return (np.frombuffer(digests, dtype=np.int64) & (RECORD_KEY_FLAG - 1)) | RECORD_KEY_FLAG
+
+# Menor tipo inteiro aceito pelo pandas para os códigos de um Categorical (evita cópia)
+def label_codes_dtype(label_count):
+    if label_count < 2 ** 7:
+        return np.int8
+    if label_count < 2 ** 15:
+        return np.int16
+    return np.int32
+
+def is_missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+class ColumnarLedger:
+    # Extrato armazenado em colunas numpy tipadas. A capacidade dobra quando enche,
+    # então inclusões custam O(1) amortizado, e as colunas podem ser vistas como
+    # DataFrame sem cópia. Textos são guardados como códigos inteiros internados.
+    def __init__(self, schema, row_type):
+        self.schema = schema
+        self.row_type = row_type
+        self.id_column = next(name for name, kind in schema.items() if kind == "id")
+        self.key_column = next(name for name, kind in schema.items() if kind == "key")
+        self.date_column = next(name for name, kind in schema.items() if kind == "date")
+        self._size = 0
+        # Contador de alterações: o índice ordenado por data só é refeito quando ele muda
+        self._revision = 0
+        self._date_index = None
+        self._date_index_revision = -1
+        self._capacity = 0
+        self._index = {}
+        self._columns = {}
+        self._labels = {}
+        self._label_codes = {}
+        self._label_arrays = {}
+        for name, kind in schema.items():
+            if kind in ("category", "text"):
+                self._labels[name] = []
+                self._label_codes[name] = {}
+                self._columns[name] = np.empty(0, dtype=np.int8)
+            else:
+                self._columns[name] = np.empty(0, dtype=LEDGER_DTYPES[kind])
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return (self.row_type(self, position) for position in range(self._size))
+
+    def row(self, position):
+        return self.row_type(self, position)
+
+    def _grow(self, min_capacity):
+        if min_capacity <= self._capacity:
+            return
+        capacity = max(min_capacity, 2 * self._capacity, 16)
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+        self._capacity = capacity
+
+    # Adiciona rótulos novos e promove o tipo dos códigos quando necessário
+    def intern(self, name, values):
+        labels, codes = self._labels[name], self._label_codes[name]
+        for value in values:
+            if value not in codes:
+                codes[value] = len(labels)
+                labels.append(value)
+                self._label_arrays.pop(name, None)
+        dtype = label_codes_dtype(len(labels))
+        if self._columns[name].dtype != dtype:
+            self._columns[name] = self._columns[name].astype(dtype)
+        return codes
+
+    def _encode(self, name, value):
+        if is_missing(value):
+            return -1
+        return self.intern(name, [value])[value]
+
+    def _encode_many(self, name, values):
+        local_codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+        codes = self.intern(name, uniques)
+        mapping = np.array([codes[value] for value in uniques] + [-1], dtype=np.int64)
+        return mapping[local_codes]
+
+    def _coerce(self, name, value):
+        kind = self.schema[name]
+        if kind in ("category", "text"):
+            return self._encode(name, value)
+        if kind == "date":
+            return pd.Timestamp(value).to_datetime64()
+        if kind in ("id", "key"):
+            return int(value)
+        return float(value)
+
+    def append(self, values):
+        self._grow(self._size + 1)
+        position = self._size
+        for name in self.schema:
+            self._columns[name][position] = self._coerce(name, values[name])
+        self._index[int(values[self.key_column])] = position
+        self._size += 1
+        self._revision += 1
+        return position
+
+    # Inclusão em bloco: cada coluna é convertida e copiada de uma só vez
+    def extend(self, columns):
+        count = len(columns[self.key_column])
+        if not count:
+            return
+        self._grow(self._size + count)
+        start, end = self._size, self._size + count
+        for name, kind in self.schema.items():
+            values = columns[name]
+            if kind in ("category", "text"):
+                values = self._encode_many(name, values)
+            elif kind == "date":
+                values = pd.to_datetime(values).to_numpy(dtype="datetime64[ns]")
+            self._columns[name][start:end] = values
+        self._index.update(zip(self._columns[self.key_column][start:end].tolist(), range(start, end)))
+        self._size = end
+        self._revision += 1
+
+    # Atribui vários campos de várias linhas de uma vez (posições vindas do índice)
+    def assign(self, positions, columns):
+        for name, values in columns.items():
+            kind = self.schema[name]
+            if kind in ("category", "text"):
+                values = self._encode_many(name, values)
+            elif kind == "date":
+                values = pd.to_datetime(values).to_numpy(dtype="datetime64[ns]")
+            self._columns[name][positions] = values
+        self._revision += 1
+
+    def get(self, position, name):
+        value = self._columns[name][position]
+        kind = self.schema[name]
+        if kind in ("category", "text"):
+            return self._labels[name][value] if value >= 0 else None
+        if kind == "date":
+            return None if np.isnat(value) else pd.Timestamp(value).date()
+        if kind in ("id", "key"):
+            return int(value)
+        return float(value)
+
+    # Atualiza vários campos de uma linha e informa se algo realmente mudou
+    def update(self, position, values):
+        changed = False
+        for name, value in values.items():
+            coerced = self._coerce(name, value)
+            if self._columns[name][position] != coerced:
+                self._columns[name][position] = coerced
+                changed = True
+        if changed:
+            self._revision += 1
+        return changed
+
+    # Remove linhas copiando as restantes para novos arrays, para que DataFrames
+    # obtidos antes da remoção continuem válidos
+    def delete_rows(self, positions):
+        keep = np.ones(self._size, dtype=bool)
+        keep[positions] = False
+        for name, column in self._columns.items():
+            compacted = np.empty(self._capacity, dtype=column.dtype)
+            remaining = column[:self._size][keep]
+            compacted[:len(remaining)] = remaining
+            self._columns[name] = compacted
+        self._size = int(keep.sum())
+        self._revision += 1
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        keys = self._columns[self.key_column][:self._size].tolist()
+        self._index = dict(zip(keys, range(self._size)))
+
+    # Posição de um registro pela chave em O(1), via índice chave -> linha
+    def find(self, key):
+        return self._index.get(int(key))
+
+    def find_many(self, keys):
+        positions = [self._index.get(int(key)) for key in keys]
+        return np.array([position for position in positions if position is not None], dtype=np.int64)
+
+    def labels(self, name):
+        return list(self._labels[name])
+
+    # Posições ordenadas por data e as datas nessa ordem (refeito só após alterações)
+    def date_index(self):
+        if self._date_index_revision != self._revision:
+            dates = self._columns[self.date_column][:self._size]
+            order = np.argsort(dates, kind="stable")
+            self._date_index = (order, dates[order])
+            self._date_index_revision = self._revision
+        return self._date_index
+
+    # Linhas com data entre start e end (inclusive) por busca binária: O(log N + k)
+    def positions_between(self, start=None, end=None):
+        order, dates = self.date_index()
+        lo = 0 if start is None else np.searchsorted(dates, np.datetime64(start, "ns"), "left")
+        hi = len(dates) if end is None else np.searchsorted(
+            dates, np.datetime64(end, "ns") + np.timedelta64(1, "D"), "left"
+        )
+        return order[lo:hi]
+
+    def date_bounds(self):
+        _, dates = self.date_index()
+        dates = dates[~np.isnat(dates)]
+        if not len(dates):
+            return None, None
+        return pd.Timestamp(dates[0]).date(), pd.Timestamp(dates[-1]).date()
+
+    # Mantém só as posições cujo rótulo está entre os valores pedidos
+    def filter_labels(self, positions, name, values):
+        codes = self._label_codes[name]
+        wanted = [codes[value] for value in values if value in codes]
+        return positions[np.isin(self._columns[name][positions], wanted)]
+
+    # Busca sem diferenciar maiúsculas nos textos: cada rótulo distinto é comparado uma
+    # única vez e as linhas são filtradas pelos códigos encontrados
+    def search_labels(self, positions, text):
+        text = text.casefold()
+        found = np.zeros(len(positions), dtype=bool)
+        for name, kind in self.schema.items():
+            if kind in ("category", "text"):
+                wanted = [code for code, label in enumerate(self._labels[name]) if text in str(label).casefold()]
+                found |= np.isin(self._columns[name][positions], wanted)
+        return positions[found]
+
+    # Posições ordenadas por uma coluna; textos seguem a ordem alfabética dos rótulos
+    def sort_positions(self, positions, name, descending=False):
+        values = self._columns[name][positions]
+        if self.schema[name] in ("category", "text"):
+            labels = self._labels[name]
+            alphabetical = sorted(range(len(labels)), key=lambda code: str(labels[code]).casefold())
+            # A posição extra recebe o código -1: valores ausentes ficam no fim
+            rank = np.empty(len(labels) + 1, dtype=np.int64)
+            rank[alphabetical] = np.arange(len(labels))
+            rank[-1] = len(labels)
+            values = rank[values]
+        order = np.argsort(values, kind="stable")
+        return positions[order[::-1] if descending else order]
+
+    def _label_array(self, name):
+        if name not in self._label_arrays:
+            # O None extra no final faz os códigos -1 (valor ausente) virarem None
+            self._label_arrays[name] = np.array(self._labels[name] + [None], dtype=object)
+        return self._label_arrays[name]
+
+    # Visão somente leitura de uma coluna (sem cópia para colunas numéricas e categorias)
+    def column(self, name):
+        values = self._columns[name][:self._size]
+        values.flags.writeable = False
+        kind = self.schema[name]
+        if kind == "category":
+            dtype = pd.CategoricalDtype(self._labels[name])
+            return pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+        if kind == "text":
+            return self._label_array(name).take(values)
+        return values
+
+    def to_frame(self):
+        return pd.DataFrame({name: self.column(name) for name in self.schema}, copy=False)
+
+    # Cópia apenas das linhas indicadas, com os mesmos tipos da visão completa
+    def take(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        columns = {}
+        for name, kind in self.schema.items():
+            values = self._columns[name][:self._size][positions]
+            if kind == "category":
+                values = pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(self._labels[name]), validate=False)
+            elif kind == "text":
+                values = self._label_array(name).take(values)
+            columns[name] = values
+        return pd.DataFrame(columns)
+
+    # Registros no formato gravado no Firebase, indexados pela chave (que fica no caminho)
+    def records(self, keys):
+        positions = self.find_many(keys)
+        frame = self.to_frame().iloc[positions]
+        frame["Data"] = frame["Data"].dt.strftime("%Y-%m-%d")
+        return {record.pop(self.key_column): record for record in frame.to_dict("records")}
+
+def to_cents(values):
+    return np.rint(np.asarray(values, dtype=float) * 100).astype(np.int64)
+
+# Abaixo deste número de linhas a soma por chave é feita em Python: o groupby do pandas
+# custa cerca de 1 ms por chamada, o que dominava as inclusões de uma linha só
+SMALL_GROUP_ROWS = 32
+
+# Soma dos centavos por chave (ou por combinação de chaves), ignorando chaves ausentes
+def group_sums(cents, *keys):
+    if len(cents) > SMALL_GROUP_ROWS:
+        grouped = cents.groupby(list(keys) if len(keys) > 1 else keys[0], observed=True, sort=False)
+        return grouped.sum().items()
+    totals = Counter()
+    for key, total in zip(zip(*keys) if len(keys) > 1 else keys[0], cents):
+        if not any(pd.isna(part) for part in (key if len(keys) > 1 else (key,))):
+            totals[key] += int(total)
+    return totals.items()
+
+# Soma os centavos por chave e acumula no contador (sinal negativo para remoções)
+def accumulate(counter, cents, keys):
+    for key, total in group_sums(cents, keys):
+        total = counter.get(key, 0) + int(total)
+        if total:
+            counter[key] = total
+        else:
+            counter.pop(key, None)
+
+ROLLUP_SCHEMA = 1
+ROLLUP_FIELDS = {"by_category": "Categorias", "by_establishment": "Estabelecimentos", "income_by_type": "Tipos Entrada"}
+
+EMPTY_ROLLUP_KEY = "_vazio"
+
+# Caracteres proibidos em chaves do Firebase são escapados como %XX. Uma chave vazia
+# cortaria o caminho ("Estabelecimentos/" trocaria o mapa inteiro por um número), então o
+# rótulo vazio vira EMPTY_ROLLUP_KEY e rótulos só com espaços têm os espaços escapados.
+def rollup_key(label):
+    label = str(label)
+    if label == "":
+        return EMPTY_ROLLUP_KEY
+    blank = not label.strip()
+    key = "".join(f"%{ord(char):02X}" if char in "%.$#[]/" or (blank and char in " \t\r\n") else char for char in label)
+    # Um rótulo igual à chave reservada é escapado para não virar o rótulo vazio
+    return "%5F" + key[1:] if key == EMPTY_ROLLUP_KEY else key
+
+def rollup_label(key):
+    return "" if key == EMPTY_ROLLUP_KEY else urllib.parse.unquote(key)
+
+# Chave AAAAMM de cada data (NaN para datas ausentes), calculada direto no numpy
+def month_keys(dates):
+    values = dates.to_numpy(dtype="datetime64[M]")
+    elapsed = values.astype(np.int64)
+    keys = (elapsed // 12 + 1970) * 100 + elapsed % 12 + 1
+    missing = np.isnat(values)
+    return pd.Series(np.where(missing, np.nan, keys) if missing.any() else keys, index=dates.index)
+
+# Período em meses inteiros (AAAAMM) ou None quando as datas cortam algum mês no meio
+def whole_months(start, end):
+    if start is not None and start.day != 1:
+        return None
+    if end is not None and (end + timedelta(days=1)).day != 1:
+        return None
+    return (
+        None if start is None else start.year * 100 + start.month,
+        None if end is None else end.year * 100 + end.month
+    )
+
+# Série mensal (ano e mês), em ordem cronológica e com os meses sem gastos zerados
+def month_frame(totals):
+    if totals.empty:
+        return pd.DataFrame({"Mês": pd.Series(dtype="datetime64[ns]"), "Valor": pd.Series(dtype=float)})
+    months = pd.period_range(totals.index.min(), totals.index.max(), freq="M")
+    totals = totals.reindex(months, fill_value=0)
+    return pd.DataFrame({"Mês": months.to_timestamp(), "Valor": totals.to_numpy()})
+
+# Totais mantidos incrementalmente a cada inclusão, edição e remoção. Tudo é somado
+# em centavos inteiros, então os totais não acumulam erro de ponto flutuante e batem
+# exatamente com um recálculo completo do extrato.
+# Além dos totais gerais há um resumo por mês (gastos por categoria e estabelecimento,
+# entradas por tipo), gravado em users/{uid}/rollups: o painel é montado só com eles.
+# Cada alteração também é anotada como incremento por campo do resumo ("deltas"): outras
+# sessões do mesmo usuário alteram os mesmos meses, então os resumos são gravados como
+# incrementos no servidor e não como documentos inteiros.
+class LedgerAggregates:
+    def __init__(self):
+        self.expense_total = 0
+        self.savings_total = 0
+        self.by_category = Counter()
+        self.by_establishment = Counter()
+        self.by_month = Counter()  # chave AAAAMM
+        self.income_by_type = Counter()
+        self.income_by_month = Counter()  # chave AAAAMM
+        self.months = {}  # AAAAMM -> {"by_category", "by_establishment", "income_by_type"}
+        # Incrementos ainda não gravados ("m_AAAAMM/campo[/rótulo]" -> centavos) e meses a
+        # regravar inteiros a partir do extrato
+        self.deltas = Counter()
+        self.dirty_months = set()
+
+    @classmethod
+    def from_ledgers(cls, expenses, savings):
+        aggregates = cls()
+        aggregates.add_expenses(expenses.to_frame())
+        aggregates.add_savings(savings.to_frame())
+        aggregates.deltas.clear()
+        return aggregates
+
+    # Monta os totais a partir dos resumos mensais gravados ({"m_AAAAMM": documento})
+    @classmethod
+    def from_documents(cls, documents):
+        aggregates = cls()
+        for key, document in (documents or {}).items():
+            if not isinstance(document, dict):
+                continue
+            month = int(key[len("m_"):])
+            # Incrementos deixam zeros nos rótulos e meses que ficaram vazios. Campos fora do
+            # formato (um número no lugar do mapa de rótulos, gravado por versões antigas com
+            # rótulo vazio) são ignorados: o resumo diverge do extrato e é regravado.
+            labels = {
+                name: {
+                    rollup_label(label): cents for label, cents in document[field].items()
+                    if isinstance(cents, (int, float)) and cents
+                } if isinstance(document.get(field), dict) else {}
+                for name, field in ROLLUP_FIELDS.items()
+            }
+            for field in ("Gastos", "Entradas"):
+                if not isinstance(document.get(field, 0), (int, float)):
+                    document = {**document, field: 0}
+            if not (document.get("Gastos") or document.get("Entradas") or any(labels.values())):
+                continue
+            summary = aggregates._month(month)
+            for name, counts in labels.items():
+                summary[name].update(counts)
+                getattr(aggregates, name).update(counts)
+            if document.get("Gastos"):
+                aggregates.by_month[month] = document["Gastos"]
+            if document.get("Entradas"):
+                aggregates.income_by_month[month] = document["Entradas"]
+            aggregates.expense_total += document.get("Gastos", 0)
+            aggregates.savings_total += document.get("Entradas", 0)
+        for name in ROLLUP_FIELDS:
+            counter = getattr(aggregates, name)
+            setattr(aggregates, name, Counter({label: cents for label, cents in counter.items() if cents}))
+        return aggregates
+
+    def _month(self, month):
+        return self.months.setdefault(month, {name: Counter() for name in ROLLUP_FIELDS})
+
+    # Acumula por (mês, chave) no resumo de cada mês e anota os incrementos para gravação.
+    # Devolve os meses alterados.
+    def _accumulate_months(self, name, cents, months, keys):
+        field = ROLLUP_FIELDS[name]
+        touched = set()
+        for (month, key), total in group_sums(cents, months, keys):
+            month = int(month)
+            counter = self._month(month)[name]
+            total = int(total)
+            self.deltas[f"m_{month}/{field}/{rollup_key(key)}"] += total
+            total += counter.get(key, 0)
+            if total:
+                counter[key] = total
+            else:
+                counter.pop(key, None)
+            touched.add(month)
+        return touched
+
+    # Total de cada mês ("Gastos" ou "Entradas"), com o incremento correspondente. O resumo
+    # do mês existe mesmo sem rótulos (lançamentos sem categoria ou estabelecimento).
+    def _accumulate_month_totals(self, counter, field, cents, months):
+        touched = set()
+        for month, total in group_sums(cents, months):
+            month, total = int(month), int(total)
+            self._month(month)
+            self.deltas[f"m_{month}/{field}"] += total
+            total += counter.get(month, 0)
+            if total:
+                counter[month] = total
+            else:
+                counter.pop(month, None)
+            touched.add(month)
+        return touched
+
+    # Meses sem rótulos e sem totais deixam de existir (e são apagados ao regravar)
+    def _drop_empty_months(self, months):
+        for month in months:
+            summary = self.months.get(month)
+            if summary is not None and not (self.by_month.get(month) or self.income_by_month.get(month) or any(summary.values())):
+                del self.months[month]
+
+    def add_expenses(self, frame, sign=1):
+        if frame.empty:
+            return
+        cents = pd.Series(to_cents(frame["Valor"]) * sign, index=frame.index)
+        months = month_keys(frame["Data"])
+        self.expense_total += int(cents.sum())
+        accumulate(self.by_category, cents, frame["Categoria"])
+        accumulate(self.by_establishment, cents, frame["Estabelecimento"])
+        touched = self._accumulate_month_totals(self.by_month, "Gastos", cents, months)
+        touched |= self._accumulate_months("by_category", cents, months, frame["Categoria"])
+        touched |= self._accumulate_months("by_establishment", cents, months, frame["Estabelecimento"])
+        self._drop_empty_months(touched)
+
+    def add_savings(self, frame, sign=1):
+        if frame.empty:
+            return
+        cents = pd.Series(to_cents(frame["Valor"]) * sign, index=frame.index)
+        months = month_keys(frame["Data"])
+        self.savings_total += int(cents.sum())
+        accumulate(self.income_by_type, cents, frame["Tipo Entrada"])
+        touched = self._accumulate_month_totals(self.income_by_month, "Entradas", cents, months)
+        touched |= self._accumulate_months("income_by_type", cents, months, frame["Tipo Entrada"])
+        self._drop_empty_months(touched)
+
+    # Documento gravado para o mês (valores em centavos), ou None se o mês ficou vazio
+    def month_document(self, month):
+        summary = self.months.get(month)
+        if summary is None:
+            return None
+        document = {
+            field: {rollup_key(label): int(cents) for label, cents in summary[name].items()}
+            for name, field in ROLLUP_FIELDS.items()
+        }
+        document["Gastos"] = int(self.by_month.get(month, 0))
+        document["Entradas"] = int(self.income_by_month.get(month, 0))
+        return document
+
+    # Caminhos do update multi-path para os resumos: meses regravados vão inteiros e os
+    # demais como incrementos ({".sv": {"increment": n}}), somados pelo servidor
+    def pending_updates(self):
+        updates = {
+            f"rollups/{path}": {".sv": {"increment": int(cents)}}
+            for path, cents in self.deltas.items()
+            if cents and int(path[len("m_"):path.index("/")]) not in self.dirty_months
+        }
+        for month in self.dirty_months:
+            updates[f"rollups/m_{month}"] = self.month_document(month)
+        return updates
+
+    def __eq__(self, other):
+        fields = ("expense_total", "savings_total", "by_category", "by_establishment", "by_month",
+                  "income_by_type", "income_by_month", "months")
+        return all(getattr(self, name) == getattr(other, name) for name in fields)
+
+    # Leituras usadas pelo painel; os mesmos nomes do FinanceManager, que delega para cá
+    # sempre que o resumo mensal responde à consulta
+    def get_total_expenses(self):
+        return self.expense_total / 100
+
+    def get_total_savings(self):
+        return self.savings_total / 100
+
+    # Os resumos respondem a períodos de meses inteiros; gastos por estabelecimento não
+    # são separados por categoria, então esse recorte precisa do extrato
+    def covers(self, start=None, end=None, categories=None, by="Categoria"):
+        return whole_months(start, end) is not None and not (categories and by == "Estabelecimento")
+
+    def _selected_months(self, start, end):
+        first, last = whole_months(start, end)
+        return sorted(
+            month for month in self.months
+            if (first is None or month >= first) and (last is None or month <= last)
+        )
+
+    def _sum_months(self, name, start, end, categories=None):
+        if start is None and end is None:
+            counter = Counter(getattr(self, name))
+        else:
+            counter = Counter()
+            for month in self._selected_months(start, end):
+                counter.update(self.months[month][name])
+        if categories:
+            counter = Counter({label: cents for label, cents in counter.items() if label in categories})
+        return Counter({label: cents for label, cents in counter.items() if cents})
+
+    @instrumented("rollups.by_category", rows=len)
+    def get_expenses_by_category(self, start=None, end=None, categories=None):
+        return aggregate_frame(self._sum_months("by_category", start, end, categories), "Categoria")
+
+    @instrumented("rollups.by_establishment", rows=len)
+    def get_expenses_by_establishment(self, start=None, end=None, categories=None):
+        data = aggregate_frame(self._sum_months("by_establishment", start, end), "Estabelecimento")
+        return data.sort_values("Valor", ascending=False)
+
+    @instrumented("rollups.by_month", rows=len)
+    def get_expenses_by_month(self, start=None, end=None, categories=None):
+        if categories:
+            monthly = {
+                month: sum(cents for label, cents in self.months[month]["by_category"].items() if label in categories)
+                for month in self._selected_months(start, end)
+            }
+        else:
+            first, last = whole_months(start, end)
+            monthly = {
+                month: cents for month, cents in self.by_month.items()
+                if (first is None or month >= first) and (last is None or month <= last)
+            }
+        monthly = {month: cents for month, cents in monthly.items() if cents}
+        periods = pd.PeriodIndex.from_fields(
+            year=[month // 100 for month in monthly], month=[month % 100 for month in monthly], freq="M"
+        )
+        totals = pd.Series(np.fromiter(monthly.values(), dtype=np.int64, count=len(monthly)) / 100, index=periods)
+        return month_frame(totals.sort_index())
+
+    def get_savings_by_type(self):
+        return aggregate_frame(self.income_by_type, "Tipo Entrada")
+
+    # Primeiro e último dia dos meses com gastos (limites do filtro de período)
+    def date_bounds(self):
+        if not self.by_month:
+            return None, None
+        first, last = min(self.by_month), max(self.by_month)
+        first_date = datetime(first // 100, first % 100, 1).date()
+        last_date = (pd.Timestamp(year=last // 100, month=last % 100, day=1) + pd.offsets.MonthEnd(0)).date()
+        return first_date, last_date
+
+    # Categorias oferecidas no filtro: as do formulário e as que aparecem no extrato
+    def category_labels(self):
+        return EXPENSE_CATEGORIES + sorted(label for label in self.by_category if label not in EXPENSE_CATEGORIES)
+
+# Tabela (chave, Valor em reais) a partir de um contador de centavos
+def aggregate_frame(counter, key_column):
+    return pd.DataFrame({key_column: list(counter.keys()), "Valor": np.fromiter(counter.values(), dtype=np.int64, count=len(counter)) / 100})
+
+# Converte uma tabela do st.data_editor para tipos comparáveis com o extrato
+def normalize_editor_frame(df, schema):
+    normalized = {}
+    for name, kind in schema.items():
+        column = df[name] if name in df else pd.Series(None, index=df.index, dtype=object)
+        if kind == "date":
+            column = pd.to_datetime(column).dt.normalize()
+        elif kind == "key":
+            # Inteiros do Python: chaves de 62 bits não cabem exatas em um float
+            column = pd.Series(
+                [None if pd.isna(key) or key == "" else int(key) for key in column], index=column.index, dtype=object
+            )
+        elif kind in ("id", "value"):
+            column = pd.to_numeric(column, errors="coerce").astype(float)
+        else:
+            column = column.astype(object).where(column.notna(), None)
+        normalized[name] = column
+    return pd.DataFrame(normalized).reset_index(drop=True)
+
+# Verifica no estado do st.data_editor se o usuário alterou algo desde a última execução
+def editor_has_changes(key):
+    state = st.session_state.get(key) or {}
+    return any(state.get(part) for part in ("edited_rows", "added_rows", "deleted_rows"))
+
+# Linha do extrato, só para leitura: guarda a referência ao extrato e a chave do registro,
+# sem __dict__ próprio. A posição é buscada no índice a cada leitura, então a linha continua
+# certa depois de remoções. Alterações passam pelo FinanceManager (edit_expense...), que
+# mantém totais, gravações pendentes e a versão do extrato.
+class LedgerRow:
+    __slots__ = ("_ledger", "_key")
+
+    def __init__(self, ledger, position):
+        self._ledger = ledger
+        self._key = int(ledger._columns[ledger.key_column][position])
+
+    def _position(self):
+        position = self._ledger.find(self._key)
+        if position is None:
+            raise LookupError(f"Registro {self._key} não existe mais no extrato")
+        return position
+
+def ledger_field(name):
+    return property(lambda row: row._ledger.get(row._position(), name))
+
+class Expense(LedgerRow):
+    __slots__ = ()
+    id = ledger_field("ID")
+    key = ledger_field("Chave")
+    date = ledger_field("Data")
+    establishment = ledger_field("Estabelecimento")
+    category = ledger_field("Categoria")
+    value = ledger_field("Valor")
+
+class MonthlySavings(LedgerRow):
+    __slots__ = ()
+    id = ledger_field("ID")
+    key = ledger_field("Chave")
+    saving_type = ledger_field("Tipo Entrada")
+    date = ledger_field("Data")
+    value = ledger_field("Valor")
+
+# Colunas obrigatórias do CSV de despesas e quantidade de linhas lidas por vez
+# "Categoria" é opcional: quando falta, vem do mapa aprendido do usuário ou das regras de estabelecimentos
+CSV_REQUIRED_COLUMNS = ["Estabelecimento", "Valor da Despesa", "Data"]
+CSV_CHUNK_SIZE = 50_000
+
+# Formatos de exportação: extensão e tipo MIME
+EXPORT_FORMATS = {"CSV": ("csv", "text/csv"), "Parquet": ("parquet", "application/vnd.apache.parquet")}
+EXPORT_CHUNK_SIZE = 50_000
+
+# Resultado de uma importação de CSV, com as linhas rejeitadas para o relatório de erros
+class ImportReport:
+    def __init__(self):
+        self.added = 0
+        self.deduplicated = 0
+        self.duplicate_file = False
+        self.failed = False
+        self.message = ""
+        self.rejected = []
+        self._errors_csv = None
+
+    def rejected_count(self):
+        return sum(len(chunk) for chunk in self.rejected)
+
+    def errors_csv(self):
+        if self._errors_csv is None:
+            self._errors_csv = pd.concat(self.rejected, ignore_index=True).to_csv(index=False).encode('utf-8')
+        return self._errors_csv
+
+# Importação de CSV lida e validada, mas ainda fora do extrato: a leitura pode rodar em
+# segundo plano e a aplicação acontece uma única vez
+class CsvImport:
+    def __init__(self):
+        self.report = ImportReport()
+        self.digest = None
+        self.chunks = []
+        self.applied = False
+
+# Hash SHA-256 do conteúdo do arquivo, lido em blocos
+def file_digest(csv_file, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    csv_file.seek(0)
+    for block in iter(lambda: csv_file.read(block_size), b""):
+        digest.update(block)
+    csv_file.seek(0)
+    return digest.hexdigest()
+
+# Impressão digital de cada linha: data, valor em centavos e estabelecimento. A categoria
+# fica de fora: ela muda com as edições e com o mapa aprendido, e a mesma compra voltaria
+# com outra categoria num extrato sobreposto.
+def row_fingerprints(dates, values, establishments):
+    frame = pd.DataFrame({
+        "Data": pd.to_datetime(dates).to_numpy(dtype="datetime64[ns]").view(np.int64),
+        "Centavos": np.rint(np.asarray(values, dtype=float) * 100).astype(np.int64),
+        "Estabelecimento": np.asarray(establishments, dtype=object),
+    })
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+# Identifica linhas importadas que já existem no extrato. Linhas iguais dentro do próprio
+# arquivo só são descartadas até o número de ocorrências já presentes no extrato, então
+# extratos sobrepostos não duplicam e compras repetidas legítimas não se perdem.
+# Cada variante de impressão (nome original, padronizado ou aprendido) conta suas
+# ocorrências à parte.
+class RowDeduplicator:
+    def __init__(self, ledger_fingerprints):
+        self.known = pd.Series(ledger_fingerprints, dtype=np.uint64).value_counts()
+        self.seen = {}
+
+    def duplicates(self, fingerprints, variant=None):
+        fingerprints = pd.Series(fingerprints, dtype=np.uint64)
+        seen = self.seen.get(variant, pd.Series(dtype=np.int64))
+        occurrence = fingerprints.groupby(fingerprints).cumcount().to_numpy()
+        occurrence += seen.reindex(fingerprints).fillna(0).to_numpy(dtype=np.int64)
+        existing = self.known.reindex(fingerprints).fillna(0).to_numpy(dtype=np.int64)
+        self.seen[variant] = seen.add(fingerprints.value_counts(), fill_value=0)
+        return occurrence < existing
+
+# Separador decimal indicado por um valor: "." ou "," seguido de 1 ou 2 dígitos no fim
+# ("25.90", "1.234,56", "10,5"). Valores como "1.234" ou "1234" não indicam nada.
+DECIMAL_HINT = re.compile(r"([.,])\d{1,2}$")
+
+# Separador decimal mais frequente entre os valores amostrados, ou None sem indícios
+# (ou empate)
+def sniff_decimal(values):
+    votes = Counter()
+    for value in values:
+        match = DECIMAL_HINT.search(re.sub(r"[R$\s]", "", value))
+        if match:
+            votes[match.group(1)] += 1
+    ranked = votes.most_common()
+    if not ranked or (len(ranked) > 1 and ranked[0][1] == ranked[1][1]):
+        return None
+    return ranked[0][0]
+
+# Detecta codificação, separador (',' ou ';' dos bancos brasileiros) e separador decimal
+# pelo início do arquivo. O decimal vale para o arquivo inteiro e vem dos valores da coluna
+# "Valor da Despesa" amostrados; sem indícios, é a vírgula com ';' e o ponto com ','.
+def sniff_csv_format(csv_file):
+    sample_size = 64 * 1024
+    head = csv_file.read(sample_size)
+    csv_file.seek(0)
+    try:
+        text = codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        text = head.decode('latin-1')
+        encoding = 'latin-1'
+    lines = text.lstrip('\ufeff').splitlines()
+    # A última linha da amostra pode estar cortada no meio
+    if len(head) == sample_size:
+        lines = lines[:-1]
+    header = lines[0] if lines else ""
+    separator = ';' if header.count(';') > header.count(',') else ','
+    rows = csv.reader(lines, delimiter=separator)
+    names = [name.strip() for name in next(rows, [])]
+    decimal = None
+    if "Valor da Despesa" in names:
+        column = names.index("Valor da Despesa")
+        decimal = sniff_decimal(row[column] for row in rows if len(row) > column)
+    if decimal is None:
+        decimal = ',' if separator == ';' else '.'
+    return encoding, separator, decimal
+
+# Converte os valores para float, coluna inteira de uma vez. Com decimal ',' ("1.234,56",
+# "R$ 10,00") o ponto separa milhares; com '.' ("1,234.56", "10.5") é a vírgula. Um separador
+# de milhar seguido de 1 ou 2 dígitos no fim ("25.90" em arquivo com vírgula decimal) contradiz
+# o arquivo: o valor fica inválido e vai para o relatório de erros em vez de ser lido 100x maior.
+def parse_brl_values(values, decimal=','):
+    text = values.astype(str).str.strip().str.replace(r'[R$\s]', '', regex=True)
+    thousands = '.' if decimal == ',' else ','
+    ambiguous = text.str.contains(rf"\{thousands}\d{{1,2}}$", regex=True)
+    text = text.str.replace(thousands, '', regex=False)
+    if decimal == ',':
+        text = text.str.replace(',', '.', regex=False)
+    return pd.to_numeric(text.mask(ambiguous), errors='coerce')
+
+# Aceita datas dd/mm/aaaa e ISO (aaaa-mm-dd) na mesma coluna
+def parse_csv_dates(values):
+    text = values.astype(str).str.strip()
+    dates = pd.to_datetime(text, format='%d/%m/%Y', errors='coerce')
+    iso = dates.isna() & values.notna()
+    if iso.any():
+        dates[iso] = pd.to_datetime(text[iso], format='ISO8601', errors='coerce')
+    return dates
+
+# Prefixos de meios de pagamento que antecedem o estabelecimento nos extratos ("PAG*IFOOD")
+MERCHANT_PREFIXES = r"^\s*(?:PAGSEGURO|PAG|PG|MERCADOPAGO|MP|EC|PAYPAL|IZ|SUMUP|STONE|CIELO|GETNET|PIX)\s*\*\s*"
+
+# Códigos que os bancos acrescentam ao nome: o complemento depois do "*" ("UBER *TRIP"),
+# parcelas ("PARC 01/12"), datas ("12/03") e números de cartão ou autorização (6+ dígitos).
+# Números curtos fazem parte do nome ("Loja 1234", "Padaria 2000") e ficam.
+MERCHANT_CODES = r"\s*\*.*$|\bPARC(?:ELA)?\s*\d{1,2}\s*(?:/|DE)\s*\d{1,2}\b|\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b|\b\d{6,}\b"
+
+# Estabelecimentos conhecidos: expressão sobre o nome em maiúsculas e sem acentos, nome
+# padronizado (None mantém o nome limpo do extrato) e categoria. As expressões casam só
+# palavras inteiras: "UBER" não pega "Uberlândia" nem "CLARO" pega "Montes Claros".
+MERCHANT_RULES = [
+    (r"\bUBER\s*\*?\s*EATS\b", "Uber Eats", "Restaurante"),
+    (r"\bUBER\b", "Uber", "Transporte"),
+    (r"\b(?:IFOOD|IFD)\b", "iFood", "Restaurante"),
+    (r"\bRAPPI\b", "Rappi", "Restaurante"),
+    (r"\b99\s*(?:APP|POP|TAXI|TECNOLOGIA)\b", "99", "Transporte"),
+    (r"\bCABIFY\b", "Cabify", "Transporte"),
+    (r"\bNETFLIX\b", "Netflix", "Lazer"),
+    (r"\bSPOTIFY\b", "Spotify", "Lazer"),
+    (r"\bAMAZON\s*PRIME\b|\bPRIME\s*VIDEO\b", "Amazon Prime", "Lazer"),
+    (r"\bDISNEY(?:PLUS)?\b", "Disney+", "Lazer"),
+    (r"\bMERCADO\s*LIVRE\b", "Mercado Livre", "Outros"),
+    (r"\bCARREFOUR\b", "Carrefour", "Alimentação"),
+    (r"\bASSAI\b", "Assaí", "Alimentação"),
+    (r"\bATACADAO\b", "Atacadão", "Alimentação"),
+    (r"\bPAO\s*DE\s*ACUCAR\b", "Pão de Açúcar", "Alimentação"),
+    (r"\b(?:DROGASIL|DROGA\s*RAIA)\b", "Droga Raia", "Saúde"),
+    (r"\b(?:MC\s*DONALDS|BURGER\s*KING)\b", None, "Restaurante"),
+    (r"\b(?:SUPERMERCADOS?|SUPERMERC|MERCADO|HORTIFRUTI|SACOLAO|PADARIA|PANIFICADORA|ACOUGUE)\b", None, "Alimentação"),
+    (r"\b(?:RESTAURANTE|LANCHONETE|PIZZARIA|CHURRASCARIA|HAMBURGUERIA|BAR)\b", None, "Restaurante"),
+    (r"\b(?:POSTO|SHELL|IPIRANGA|PETROBRAS|ESTACIONAMENTO|SEM\s*PARAR|CONECTCAR|VELOE|METRO)\b", None, "Transporte"),
+    (r"\b(?:DROGARIA|FARMACIA|HOSPITAL|CLINICA|LABORATORIO|ODONTO\w*|UNIMED)\b", None, "Saúde"),
+    (r"\b(?:ESCOLA|COLEGIO|FACULDADE|UNIVERSIDADE|CURSOS?|LIVRARIA)\b", None, "Educação"),
+    (r"\b(?:ALUGUEL|CONDOMINIO|ENEL|SABESP|CEMIG|COPEL|INTERNET|TELEFONICA|CLARO|VIVO)\b", None, "Custo Fixo"),
+    (r"\b(?:CINEMA|CINEMARK|INGRESSOS?|TEATRO|STEAM)\b", None, "Lazer"),
+]
+
+# Chave de comparação de nomes de estabelecimentos: maiúsculas, sem acentos e sem
+# espaços repetidos
+def merchant_keys(names):
+    ascii_names = names.str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+    return ascii_names.str.upper().str.replace(r"\s+", " ", regex=True).str.strip()
+
+# Normaliza nomes de estabelecimentos vindos dos extratos. Todas as regras ficam em uma
+# única expressão compilada (um grupo nomeado por regra, identificado por lastgroup), e o
+# resultado é guardado por texto original: cada bloco do CSV só processa os nomes distintos
+# que ainda não foram vistos, com as operações de texto do pandas.
+class MerchantNormalizer:
+    max_cached = 200_000
+
+    def __init__(self, rules=MERCHANT_RULES):
+        self.rules = rules
+        self.automaton = re.compile("|".join(f"(?P<r{number}>{pattern})" for number, (pattern, _, _) in enumerate(rules)))
+        self.lock = threading.Lock()
+        # texto original -> (nome padronizado, chave, categoria sugerida ou None)
+        self._cache = {}
+
+    # Nome limpo (sem prefixo de pagamento e códigos) e regra de cada nome distinto. As
+    # regras olham o nome antes de tirar o complemento depois do "*" ("UBER *EATS").
+    def _normalize_distinct(self, names):
+        stripped = names.str.replace(MERCHANT_PREFIXES, "", regex=True, flags=re.IGNORECASE)
+        cleaned = (
+            stripped.str.replace(MERCHANT_CODES, " ", regex=True, flags=re.IGNORECASE)
+            .str.replace(r"[_#|]+", " ", regex=True).str.replace(r"\s+", " ", regex=True).str.strip()
+        )
+        cleaned = cleaned.where(cleaned != "", names.str.strip())
+        # Nomes todos em maiúsculas (como nos extratos dos bancos) passam para "Título"
+        cleaned = cleaned.where(cleaned != cleaned.str.upper(), cleaned.str.title())
+        rule_names = merchant_keys(stripped.str.replace(r"[*_/#|]+", " ", regex=True))
+        rule_numbers = [int(match.lastgroup[1:]) if match else None for match in map(self.automaton.search, rule_names)]
+        result = {}
+        for raw, name, number in zip(names, cleaned, rule_numbers):
+            category = None
+            if number is not None:
+                _, canonical, category = self.rules[number]
+                name = canonical or name
+            result[raw] = (name, category)
+        keys = merchant_keys(pd.Series([name for name, _ in result.values()], dtype=object))
+        return {raw: (name, key, category) for (raw, (name, category)), key in zip(result.items(), keys)}
+
+    # Retorna o nome padronizado, a chave e a categoria sugerida de cada linha
+    def normalize(self, names):
+        codes, distinct = pd.factorize(names)
+        with self.lock:
+            missing = [name for name in distinct if name not in self._cache]
+        if missing:
+            computed = self._normalize_distinct(pd.Series(missing, dtype=object))
+            with self.lock:
+                if len(self._cache) + len(computed) > self.max_cached:
+                    self._cache.clear()
+                self._cache.update(computed)
+        else:
+            computed = {}
+        with self.lock:
+            entries = [self._cache.get(name) or computed[name] for name in distinct]
+        table = pd.DataFrame(entries, columns=["Estabelecimento", "Chave", "Categoria"], dtype=object)
+        merchants = table.reindex(codes).reset_index(drop=True)
+        merchants.index = names.index
+        return merchants
+
+# Normalizador compartilhado pelas sessões, com o cache de nomes já vistos
+@st.cache_resource
+def get_merchant_normalizer():
+    return MerchantNormalizer()
+
+# Lançamentos recorrentes: cada regra gera uma despesa ou entrada por período, de "Início"
+# até "Fim" (opcional). "Última" guarda a data da última ocorrência já lançada.
+RECURRING_FREQUENCIES = ["Mensal", "Semanal", "Anual"]
+RECURRING_KINDS = ["Despesa", "Entrada"]
+
+# Chave estável de uma regra em users/{uid}/recurring
+def new_rule_key():
+    return f"rule_{uuid.uuid4().hex[:12]}"
+
+# Regras como colunas (uma linha por regra), com as datas já convertidas
+def recurring_frame(rules):
+    columns = ["Tipo", "Descrição", "Categoria", "Valor", "Frequência", "Início", "Fim", "Última"]
+    rules_df = pd.DataFrame.from_dict(rules, orient="index").reindex(columns=columns)
+    for name in ("Início", "Fim", "Última"):
+        rules_df[name] = pd.to_datetime(rules_df[name], format='ISO8601')
+    return rules_df
+
+# Data da k-ésima ocorrência de cada regra. Regras mensais e anuais andam em meses a
+# partir do mês de início, mantendo o dia (ou o último dia de meses mais curtos);
+# semanais andam de 7 em 7 dias.
+def occurrence_dates(start, weekly, step, k):
+    offset = k * step
+    start_month = start.astype("datetime64[M]")
+    months = start_month + np.where(weekly, 0, offset)
+    first_day = months.astype("datetime64[D]")
+    month_length = ((months + 1).astype("datetime64[D]") - first_day).astype(np.int64)
+    day = np.minimum((start - start_month.astype("datetime64[D]")).astype(np.int64), month_length - 1)
+    return np.where(weekly, start + np.where(weekly, offset, 0), first_day + day)
+
+# Índice da última ocorrência de cada regra em ou antes de "dates" (-1 se nenhuma)
+def last_occurrence_index(start, weekly, step, dates):
+    days = (dates - start).astype(np.int64)
+    months = (dates.astype("datetime64[M]") - start.astype("datetime64[M]")).astype(np.int64)
+    k = np.where(weekly, days, months) // step
+    k = k - (occurrence_dates(start, weekly, step, k) > dates)
+    return np.maximum(k, -1)
+
+# Ocorrências vencidas de todas as regras até "through" (inclusive), calculadas de uma vez:
+# cada regra vira um intervalo de índices de ocorrência, expandido com np.repeat.
+# Retorna a posição da regra, o índice e a data de cada ocorrência, e a última data de cada
+# regra que teve ocorrências (NaT nas demais).
+def due_occurrences(rules_df, through):
+    through = np.datetime64(pd.Timestamp(through).date(), "D")
+    if rules_df.empty:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype="datetime64[D]"), np.empty(0, dtype="datetime64[D]")
+    start = rules_df["Início"].to_numpy(dtype="datetime64[D]")
+    end = np.minimum(rules_df["Fim"].to_numpy(dtype="datetime64[D]"), through)
+    end = np.where(np.isnat(end), through, end)
+    last = rules_df["Última"].to_numpy(dtype="datetime64[D]")
+    frequency = rules_df["Frequência"].to_numpy()
+    weekly = frequency == "Semanal"
+    step = np.where(frequency == "Anual", 12, np.where(weekly, 7, 1))
+
+    first_k = np.where(np.isnat(last), 0, last_occurrence_index(start, weekly, step, np.where(np.isnat(last), start, last)) + 1)
+    last_k = last_occurrence_index(start, weekly, step, end)
+    counts = np.maximum(last_k - first_k + 1, 0)
+
+    positions = np.repeat(np.arange(len(rules_df)), counts)
+    k = first_k[positions] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    dates = occurrence_dates(start[positions], weekly[positions], step[positions], k)
+    latest = np.where(counts > 0, occurrence_dates(start, weekly, step, np.maximum(last_k, 0)), np.datetime64("NaT"))
+    return positions, k, dates, latest
+
+# Orçamentos mensais por categoria (em centavos) contra os gastos dos resumos mensais.
+# A comparação é feita de uma vez na tabela meses x categorias.
+BUDGET_WARNING_RATIO = 0.8
+
+def budget_report(aggregates, budgets, months):
+    if not budgets:
+        return pd.DataFrame(columns=["Mês", "Categoria", "Orçamento", "Gasto", "Uso"])
+    limits = pd.Series(budgets, dtype=np.int64)
+    spent = pd.DataFrame.from_dict(
+        {month: aggregates.months.get(month, {}).get("by_category", {}) for month in months},
+        orient="index"
+    ).reindex(index=list(months), columns=limits.index).fillna(0)
+    report = spent.stack().rename("Gasto").reset_index()
+    report.columns = ["Mês", "Categoria", "Gasto"]
+    report["Orçamento"] = limits.reindex(report["Categoria"]).to_numpy()
+    report["Uso"] = report["Gasto"] / report["Orçamento"]
+    report["Gasto"] /= 100
+    report["Orçamento"] = report["Orçamento"] / 100
+    return report[["Mês", "Categoria", "Orçamento", "Gasto", "Uso"]]
+
+# Executa o método com o lock do FinanceManager: alterações feitas na thread do script não
+# se misturam com a gravação em segundo plano
+def synchronized(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
 class FinanceManager:
+    # Gravações no Firebase são adiadas (write-behind) e agrupadas: só são enviadas
+    # quando há muitas alterações pendentes, quando a pendência mais antiga passa
+    # do intervalo abaixo ou quando flush() é chamado explicitamente
+    max_pending_writes = 500
+    flush_interval = 5.0
+
     def __init__(self, user_id=None):
         self.user_id = user_id
-        self.expenses = []
-        self.monthly_savings = []
+        self.expenses = ColumnarLedger(EXPENSE_SCHEMA, Expense)
+        self.monthly_savings = ColumnarLedger(SAVINGS_SCHEMA, MonthlySavings)
+        self.expenses.intern("Categoria", EXPENSE_CATEGORIES)
+        self.monthly_savings.intern("Tipo Entrada", SAVINGS_TYPES)
         self.next_expense_id = 1
         self.next_savings_id = 1
+        self._dirty_expenses = set()
+        self._dirty_savings = set()
+        # Arquivos CSV já importados: hash do conteúdo -> resumo da importação
+        self.imported_files = {}
+        self._dirty_imports = set()
+        # Regras de lançamentos recorrentes: chave -> regra (users/{uid}/recurring)
+        self.recurring_rules = {}
+        self._dirty_rules = set()
+        # Mapa aprendido com as edições do usuário: chave do estabelecimento ->
+        # {"Estabelecimento": nome escolhido, "Categoria": categoria} (users/{uid}/merchants)
+        self.merchant_map = {}
+        self._dirty_merchants = set()
+        self._batch_depth = 0
+        self._pending_since = None
+        # Com um pool de gravações (no app), as gravações rodam nele, uma de cada vez;
+        # sem executor (benchmarks e scripts), gravam na hora
+        self.lock = threading.RLock()
+        self.background_executor = None
+        self._flush_future = None
+        # Erro da última gravação (None se gravou): a gravação roda fora da thread do
+        # script, então a mensagem é mostrada pelo script no rerun seguinte
+        self.save_error = None
+        # Versão do extrato: muda a cada alteração e serve de chave para os caches de análise.
+        # O token distingue extratos de sessões diferentes do mesmo usuário.
+        self.version = 0
+        self.ledger_token = uuid.uuid4().hex
+        self.aggregates = LedgerAggregates()
 
-    def add_expense(self, establishment, category, value, date):
-        expense = Expense(self.next_expense_id, establishment, category, value, date)
-        self.expenses.append(expense)
-        self.next_expense_id += 1
+    # Monta o FinanceManager a partir dos DataFrames carregados do Firebase, sem regravar nada
+    @classmethod
+    @instrumented("fm.from_frames", rows=lambda fm: len(fm.expenses) + len(fm.monthly_savings))
+    def from_frames(cls, user_id, expenses_df=None, savings_df=None, imported_files=None, merchant_map=None):
+        fm = cls(user_id)
+        fm.imported_files = dict(imported_files or {})
+        fm.merchant_map = dict(merchant_map or {})
+        if expenses_df is not None and not expenses_df.empty:
+            fm.expenses.extend({
+                "ID": expenses_df['ID'].astype(np.int64).to_numpy(),
+                "Data": pd.to_datetime(expenses_df['Data'], format='ISO8601'),
+                "Estabelecimento": expenses_df['Estabelecimento'].to_numpy(),
+                "Categoria": expenses_df['Categoria'].to_numpy(),
+                "Valor": expenses_df['Valor'].astype(float).to_numpy(),
+                "Chave": frame_keys(expenses_df)
+            })
+            fm.next_expense_id = int(expenses_df['ID'].max()) + 1
+        if savings_df is not None and not savings_df.empty:
+            fm.monthly_savings.extend({
+                "ID": savings_df['ID'].astype(np.int64).to_numpy(),
+                "Tipo Entrada": savings_df['Tipo Entrada'].to_numpy(),
+                "Data": pd.to_datetime(savings_df['Data'], format='ISO8601'),
+                "Valor": savings_df['Valor'].astype(float).to_numpy(),
+                "Chave": frame_keys(savings_df)
+            })
+            fm.next_savings_id = int(savings_df['ID'].max()) + 1
+        fm.aggregates = LedgerAggregates.from_ledgers(fm.expenses, fm.monthly_savings)
+        return fm
 
-        # Salva automaticamente no Firebase após adicionar despesa
-        self.save_expenses_to_firebase()
+    @instrumented("fm.add_expense")
+    @synchronized
+    def add_expense(self, establishment, category, value, date, id=None):
+        if id is None:
+            id = self.next_expense_id
+        position = self.expenses.append({
+            "ID": id, "Data": date, "Estabelecimento": establishment, "Categoria": category, "Valor": value,
+            "Chave": new_record_keys(1)[0]
+        })
+        expense = self.expenses.row(position)
+        self.aggregates.add_expenses(self.expenses.take([position]))
+        self.next_expense_id = max(self.next_expense_id, id + 1)
+        self._mark_dirty(self._dirty_expenses, expense.key)
 
         return f"Despesa adicionada: {expense.establishment} - R${expense.value:.2f}"
 
-    def edit_expense(self, id, establishment, category, value, date):
-        for expense in self.expenses:
-            if expense.id == id:
-                expense.establishment = establishment
-                expense.category = category
-                expense.value = float(value)
-                expense.date = date
+    @synchronized
+    def edit_expense(self, key, establishment, category, value, date):
+        position = self.expenses.find(key)
+        if position is None:
+            return "Despesa não encontrada"
 
-                # Salva automaticamente no Firebase após editar despesa
-                self.save_expenses_to_firebase()
+        expense = self.expenses.row(position)
+        before = self.expenses.take([position])
+        if self.expenses.update(position, {
+            "Data": date, "Estabelecimento": establishment, "Categoria": category, "Valor": value
+        }):
+            self.aggregates.add_expenses(before, -1)
+            self.aggregates.add_expenses(self.expenses.take([position]))
+            self._mark_dirty(self._dirty_expenses, int(key))
+
+        return f"Despesa atualizada: {expense.establishment} - R${expense.value:.2f}"
+
+    @synchronized
+    def delete_expense(self, key):
+        position = self.expenses.find(key)
+        if position is None:
+            return "Despesa não encontrada"
+
+        expense = self.expenses.row(position)
+        message = f"Despesa removida: {expense.establishment} - R${expense.value:.2f}"
+        self.aggregates.add_expenses(self.expenses.take([position]), -1)
+        self.expenses.delete_rows([position])
+        self._mark_dirty(self._dirty_expenses, int(key))
+        return message
+
+    @synchronized
+    def add_monthly_savings(self, saving_type, value, date, id=None):
+        if id is None:
+            id = self.next_savings_id
+        position = self.monthly_savings.append({
+            "ID": id, "Tipo Entrada": saving_type, "Data": date, "Valor": value, "Chave": new_record_keys(1)[0]
+        })
+        savings = self.monthly_savings.row(position)
+        self.aggregates.add_savings(self.monthly_savings.take([position]))
+        self.next_savings_id = max(self.next_savings_id, id + 1)
+        self._mark_dirty(self._dirty_savings, savings.key)
 
-                return f"Despesa atualizada: {expense.establishment} - R${expense.value:.2f}"
-        return "Despesa não encontrada"
-    
-    # Função que salva automaticamente as despesas
-    def save_expenses_to_firebase(self):
-        expenses_df = self.get_expenses_df()
-        save_expenses_to_firebase(self.user_id, expenses_df)
-
-    def add_monthly_savings(self, saving_type, value, date):
-        savings = MonthlySavings(self.next_savings_id, saving_type, value, date)
-        self.monthly_savings.append(savings)
-        self.next_savings_id += 1
-        
-        # Salva automaticamente no Firebase após adicionar entrada
-        self.save_savings_to_firebase()
-        
         return f"Economia mensal adicionada: R${savings.value:.2f} para {savings.date}"
 
-    def edit_monthly_savings(self, id, saving_type, value, date):
-        for savings in self.monthly_savings:
-            if savings.id == id:
-                savings.category = saving_type
-                savings.value = float(value)
-                savings.date = date
-                
-                # Salva automaticamente no Firebase após adicionar entrada
-                self.save_savings_to_firebase()
-                
-                return f"Economia mensal atualizada: R${savings.value:.2f} para {savings.date}"
-        return "Economia mensal não encontrada"
-    
-    # Função que salva automaticamente as despesas
-    def save_savings_to_firebase(self):
-        savings_df = self.get_savings_df()
-        save_savings_to_firebase(self.user_id, savings_df)
+    @synchronized
+    def edit_monthly_savings(self, key, saving_type, value, date):
+        position = self.monthly_savings.find(key)
+        if position is None:
+            return "Economia mensal não encontrada"
+
+        savings = self.monthly_savings.row(position)
+        before = self.monthly_savings.take([position])
+        if self.monthly_savings.update(position, {"Tipo Entrada": saving_type, "Data": date, "Valor": value}):
+            self.aggregates.add_savings(before, -1)
+            self.aggregates.add_savings(self.monthly_savings.take([position]))
+            self._mark_dirty(self._dirty_savings, int(key))
+
+        return f"Economia mensal atualizada: R${savings.value:.2f} para {savings.date}"
 
+    @synchronized
+    def delete_monthly_savings(self, key):
+        position = self.monthly_savings.find(key)
+        if position is None:
+            return "Economia mensal não encontrada"
+
+        savings = self.monthly_savings.row(position)
+        message = f"Economia mensal removida: R${savings.value:.2f} para {savings.date}"
+        self.aggregates.add_savings(self.monthly_savings.take([position]), -1)
+        self.monthly_savings.delete_rows([position])
+        self._mark_dirty(self._dirty_savings, int(key))
+        return message
+
+    @synchronized
+    def add_recurring_rule(self, kind, description, category, value, frequency, start, end=None):
+        if not description or value <= 0:
+            return "Informe a descrição e um valor maior que zero."
+        if end is not None and end < start:
+            return "A data de término deve ser depois do início."
+        rule = {"Tipo": kind, "Descrição": description, "Valor": float(value), "Frequência": frequency, "Início": str(start)}
+        if kind == "Despesa":
+            rule["Categoria"] = category
+        if end is not None:
+            rule["Fim"] = str(end)
+        rule_key = new_rule_key()
+        with self.batch():
+            self.recurring_rules[rule_key] = rule
+            self._mark_dirty(self._dirty_rules, rule_key)
+            # Ocorrências com data até hoje já entram no extrato
+            count = self.materialize_recurring(datetime.now().date())
+        return f"Regra adicionada: {description} ({frequency.lower()}). {count} lançamentos gerados."
+
+    # Remove a regra; os lançamentos já gerados continuam no extrato
+    @synchronized
+    def delete_recurring_rule(self, rule_key):
+        rule = self.recurring_rules.pop(rule_key, None)
+        if rule is None:
+            return "Regra não encontrada."
+        self._mark_dirty(self._dirty_rules, rule_key)
+        return f"Regra removida: {rule['Descrição']}"
+
+    # Gera, em um único lote, todas as ocorrências vencidas das regras até "through" e avança a
+    # "Última" de cada regra no mesmo update. A chave de cada lançamento vem da regra e do
+    # índice da ocorrência (occurrence_record_keys): ocorrências que já estão no extrato são
+    # puladas, e duas sessões que lançam a mesma ocorrência gravam o mesmo registro.
+    # Retorna a quantidade de lançamentos gerados.
+    @instrumented("fm.materialize_recurring", rows=lambda count: count)
+    @synchronized
+    def materialize_recurring(self, through):
+        rules_df = recurring_frame(self.recurring_rules)
+        positions, indices, dates, latest = due_occurrences(rules_df, through)
+        if not len(positions):
+            return 0
+        all_keys = occurrence_record_keys(rules_df.index[positions], indices)
+        is_expense = rules_df["Tipo"].to_numpy()[positions] == "Despesa"
+        new = np.array([
+            (self.expenses if expense else self.monthly_savings).find(key) is None
+            for key, expense in zip(all_keys.tolist(), is_expense)
+        ], dtype=bool)
+        positions, all_keys, is_expense = positions[new], all_keys[new], is_expense[new]
+        occurrences = rules_df.iloc[positions]
+        dates = pd.Series(dates[new].astype("datetime64[ns]"))
+        with self.batch():
+            count = int(is_expense.sum())
+            if count:
+                keys = all_keys[is_expense]
+                start = len(self.expenses)
+                self.expenses.extend({
+                    "ID": np.arange(self.next_expense_id, self.next_expense_id + count, dtype=np.int64),
+                    "Chave": keys,
+                    "Data": dates[is_expense],
+                    "Estabelecimento": occurrences["Descrição"].to_numpy()[is_expense],
+                    "Categoria": occurrences["Categoria"].to_numpy()[is_expense],
+                    "Valor": occurrences["Valor"].to_numpy(dtype=float)[is_expense]
+                })
+                self.aggregates.add_expenses(self.expenses.take(np.arange(start, len(self.expenses))))
+                self.next_expense_id += count
+                self._mark_many_dirty(self._dirty_expenses, keys)
+            count = int((~is_expense).sum())
+            if count:
+                keys = all_keys[~is_expense]
+                start = len(self.monthly_savings)
+                self.monthly_savings.extend({
+                    "ID": np.arange(self.next_savings_id, self.next_savings_id + count, dtype=np.int64),
+                    "Chave": keys,
+                    "Tipo Entrada": occurrences["Descrição"].to_numpy()[~is_expense],
+                    "Data": dates[~is_expense],
+                    "Valor": occurrences["Valor"].to_numpy(dtype=float)[~is_expense]
+                })
+                self.aggregates.add_savings(self.monthly_savings.take(np.arange(start, len(self.monthly_savings))))
+                self.next_savings_id += count
+                self._mark_many_dirty(self._dirty_savings, keys)
+            for rule_key, last in zip(rules_df.index, latest):
+                if not np.isnat(last):
+                    self.recurring_rules[rule_key]["Última"] = str(last)
+                    self._dirty_rules.add(rule_key)
+        return len(positions)
+
+    # Aplica as diferenças entre a tabela exibida e a editada no st.data_editor:
+    # linhas alteradas, incluídas e removidas são calculadas de forma vetorizada
+    # e gravadas em um único lote. Retorna a quantidade de cada tipo de alteração.
+    @instrumented("fm.apply_editor_diff", rows=lambda counts: sum(counts.values()))
+    @synchronized
+    def apply_editor_diff(self, original_df, edited_df, ledger="expenses"):
+        if ledger == "expenses":
+            entries, dirty, accumulate_rows = self.expenses, self._dirty_expenses, self.aggregates.add_expenses
+        else:
+            entries, dirty, accumulate_rows = self.monthly_savings, self._dirty_savings, self.aggregates.add_savings
+        # As linhas são identificadas pela chave (coluna oculta); o ID só numera a tabela
+        id_column, key_column = entries.id_column, entries.key_column
+        fields = [name for name in entries.schema if name not in (id_column, key_column)]
+
+        original = normalize_editor_frame(original_df, entries.schema)
+        edited = normalize_editor_frame(edited_df, entries.schema)
+        # Linhas sem data ou valor ainda estão sendo preenchidas no editor
+        complete = edited["Data"].notna() & edited["Valor"].notna()
+
+        known = edited[key_column].isin(original[key_column]) & edited[key_column].notna()
+        deleted_keys = original.loc[~original[key_column].isin(edited[key_column]), key_column]
+        added = edited[~known & complete]
+
+        merged = original.merge(edited[known & complete], on=key_column, suffixes=("", "_edited"))
+        differs = np.zeros(len(merged), dtype=bool)
+        for name in fields:
+            before, after = merged[name], merged[f"{name}_edited"]
+            differs |= ~((before == after) | (before.isna() & after.isna())).to_numpy()
+        changed = merged[differs]
+
+        with self.batch():
+            if len(changed):
+                changed_keys = changed[key_column]
+                positions = entries.find_many(changed_keys)
+                accumulate_rows(entries.take(positions), -1)
+                entries.assign(positions, {name: changed[f"{name}_edited"].to_numpy() for name in fields})
+                accumulate_rows(entries.take(positions))
+                self._mark_many_dirty(dirty, changed_keys)
+                if ledger == "expenses":
+                    self.learn_merchants(changed)
+            if len(added):
+                next_id = self.next_expense_id if ledger == "expenses" else self.next_savings_id
+                added_keys = new_record_keys(len(added))
+                columns = {name: added[name].to_numpy() for name in fields}
+                columns[id_column] = np.arange(next_id, next_id + len(added), dtype=np.int64)
+                columns[key_column] = added_keys
+                start = len(entries)
+                entries.extend(columns)
+                accumulate_rows(entries.take(np.arange(start, len(entries))))
+                if ledger == "expenses":
+                    self.next_expense_id = next_id + len(added)
+                else:
+                    self.next_savings_id = next_id + len(added)
+                self._mark_many_dirty(dirty, added_keys)
+            if len(deleted_keys):
+                positions = entries.find_many(deleted_keys)
+                accumulate_rows(entries.take(positions), -1)
+                entries.delete_rows(positions)
+                self._mark_many_dirty(dirty, deleted_keys)
+
+        return {"changed": len(changed), "added": len(added), "deleted": len(deleted_keys)}
+
+    # Aprende com as despesas editadas na tabela: quando o estabelecimento ou a categoria
+    # mudam, o nome original passa a ser importado com o nome e a categoria escolhidos
+    def learn_merchants(self, changed):
+        renamed = changed["Estabelecimento"].astype(str) != changed["Estabelecimento_edited"].astype(str)
+        recategorized = changed["Categoria"].astype(str) != changed["Categoria_edited"].astype(str)
+        learned = changed[renamed | recategorized]
+        if learned.empty:
+            return
+        keys = merchant_keys(learned["Estabelecimento"].astype(str))
+        for key, name, category in zip(keys, learned["Estabelecimento_edited"], learned["Categoria_edited"]):
+            entry = {"Estabelecimento": str(name), "Categoria": str(category)}
+            if self.merchant_map.get(key) != entry:
+                self.merchant_map[key] = entry
+                self._dirty_merchants.add(key)
+
+    # Registra a alteração como pendente e grava se algum limite foi atingido
+    def _mark_dirty(self, dirty, key):
+        dirty.add(key)
+        self.version += 1
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        self._maybe_flush()
+
+    def _mark_many_dirty(self, dirty, keys):
+        dirty.update(int(key) for key in keys)
+        self.version += 1
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if self._batch_depth or self._pending_since is None:
+            return
+        pending = (len(self._dirty_expenses) + len(self._dirty_savings) + len(self._dirty_imports)
+                   + len(self._dirty_rules) + len(self._dirty_merchants))
+        if pending >= self.max_pending_writes or time.monotonic() - self._pending_since >= self.flush_interval:
+            self.request_flush()
+
+    def has_pending_writes(self):
+        return bool(
+            self._dirty_expenses or self._dirty_savings or self._dirty_imports or self._dirty_rules
+            or self._dirty_merchants or self.aggregates.dirty_months or any(self.aggregates.deltas.values())
+        )
+
+    # Pendências retiradas a cada gravação e devolvidas se ela falhar; os incrementos dos
+    # resumos são um Counter, então devolvê-los soma aos que chegaram enquanto isso
+    def _dirty_sets(self):
+        return (self._dirty_expenses, self._dirty_savings, self._dirty_imports, self._dirty_rules,
+                self._dirty_merchants, self.aggregates.dirty_months, self.aggregates.deltas)
+
+    # Regrava todos os resumos mensais a partir do extrato (contas antigas ou resumos divergentes).
+    # Meses gravados que não existem mais no extrato são apagados.
+    @synchronized
+    def rewrite_rollups(self, stored_months=()):
+        self.aggregates.dirty_months.update(self.aggregates.months)
+        self.aggregates.dirty_months.update(stored_months)
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+
+    # Agrupa várias alterações em uma única gravação no final do bloco
+    @contextmanager
+    def batch(self):
+        with self.lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._batch_depth -= 1
+                done = not self._batch_depth
+            if done:
+                self.request_flush()
+
+    # Grava no pool de gravações, se houver, ou na hora. Há no máximo uma gravação em
+    # segundo plano por FinanceManager: ela repete até não sobrar nada pendente, então
+    # alterações feitas enquanto grava entram na volta seguinte.
+    def request_flush(self):
+        if self.background_executor is None:
+            return self.flush()
+        with self.lock:
+            if self._flush_future is None:
+                self._flush_future = self.background_executor.submit(METRICS.propagate(self._flush_pending))
+        return True
+
+    def _flush_pending(self):
+        while True:
+            with self.lock:
+                if not self.has_pending_writes():
+                    self._flush_future = None
+                    return True
+            if not self.flush():
+                with self.lock:
+                    self._flush_future = None
+                return False
+
+    # Envia apenas os registros alterados ao armazenamento em um único update multi-path.
+    # O update é montado com o lock e as pendências são retiradas junto; a escrita roda sem
+    # o lock e, se falhar, as pendências voltam para a próxima gravação. Com um executor, só a
+    # gravação em segundo plano chama flush(), então os updates chegam ao banco em ordem.
+    def flush(self):
+        with self.lock:
+            if not self.has_pending_writes():
+                return True
+            updates = self._pending_updates()
+            pending = tuple(dirty.copy() for dirty in self._dirty_sets())
+            for dirty in self._dirty_sets():
+                dirty.clear()
+            pending_since, self._pending_since = self._pending_since, None
+
+        with METRICS.span("fm.flush") as span:
+            span.rows = len(updates)
+            error = save_ledger_changes(self.user_id, updates)
+        saved = error is None
+        # Quem grava marcas de remoção também apaga as vencidas: o nó deleted fica limitado
+        if saved and any(path.startswith("deleted/") for path in updates):
+            prune_tombstones(self.user_id, updates["meta/revision"])
+
+        with self.lock:
+            self.save_error = error
+            if not saved:
+                for dirty, records in zip(self._dirty_sets(), pending):
+                    dirty.update(records)
+                if self._pending_since is None:
+                    self._pending_since = pending_since or time.monotonic()
+        return saved
+
+    def _pending_updates(self):
+        # A revisão marca o momento da gravação; o cache local busca só o que mudou depois dela
+        revision = now_ms()
+        updates = {"meta/revision": revision}
+        updates.update(changed_records('expenses', self.expenses, self._dirty_expenses, revision))
+        updates.update(changed_records('savings', self.monthly_savings, self._dirty_savings, revision))
+        for digest in self._dirty_imports:
+            updates[f"imports/{digest}"] = self.imported_files.get(digest)
+        # A "Última" de cada regra vai junto com as ocorrências geradas
+        for rule_key in self._dirty_rules:
+            updates[f"recurring/{rule_key}"] = self.recurring_rules.get(rule_key)
+        for merchant_key in self._dirty_merchants:
+            updates[f"merchants/{rollup_key(merchant_key)}"] = self.merchant_map.get(merchant_key)
+        # Os resumos mensais vão no mesmo update, então nunca divergem do extrato gravado
+        updates.update(self.aggregates.pending_updates())
+        updates["meta/rollups"] = ROLLUP_SCHEMA
+        return updates
+
+    # Leituras dos totais mantidos incrementalmente: O(1) ou O(número de grupos)
     def get_total_expenses(self):
-        return sum(expense.value for expense in self.expenses)
+        return self.aggregates.expense_total / 100
 
     def get_total_savings(self):
-        return sum(savings.value for savings in self.monthly_savings)
+        return self.aggregates.savings_total / 100
+
+    # Despesas de um período e, opcionalmente, de algumas categorias, usando o índice por data
+    def get_expenses_in_range(self, start=None, end=None, categories=None):
+        positions = self.expenses.positions_between(start, end)
+        if categories:
+            positions = self.expenses.filter_labels(positions, "Categoria", categories)
+        return self.expenses.take(positions)
+
+    # Uma página do extrato para a tabela: busca, filtro e ordenação são feitos nas colunas
+    # e só as linhas visíveis são copiadas. Retorna a página e o total de linhas encontradas.
+    @instrumented("fm.get_ledger_page", rows=lambda result: len(result[0]))
+    def get_ledger_page(self, ledger="expenses", page=1, page_size=50, sort_by=None, descending=False,
+                        search="", labels=()):
+        entries = self.expenses if ledger == "expenses" else self.monthly_savings
+        positions = np.arange(len(entries))
+        if search:
+            positions = entries.search_labels(positions, search)
+        if labels:
+            category_column = next(name for name, kind in entries.schema.items() if kind == "category")
+            positions = entries.filter_labels(positions, category_column, labels)
+        if sort_by:
+            positions = entries.sort_positions(positions, sort_by, descending)
+        first = (page - 1) * page_size
+        page_df = entries.take(positions[first:first + page_size])
+        page_df.index = pd.RangeIndex(first, first + len(page_df))
+        return page_df, len(positions)
 
+    # Primeira e última data das despesas, pelo índice ordenado por data
+    def get_expense_date_bounds(self):
+        return self.expenses.date_bounds()
+
+    # Filtros de meses inteiros são respondidos pelos resumos mensais; os demais agregam
+    # só as linhas do período
+    @instrumented("fm.by_category", rows=len)
+    def get_expenses_by_category(self, start=None, end=None, categories=None):
+        if self.aggregates.covers(start, end, categories, "Categoria"):
+            return self.aggregates.get_expenses_by_category(start, end, categories)
+        expenses_df = self.get_expenses_in_range(start, end, categories)
+        return expenses_df.groupby("Categoria", observed=True)["Valor"].sum().reset_index()
+
+    @instrumented("fm.by_establishment", rows=len)
+    def get_expenses_by_establishment(self, start=None, end=None, categories=None):
+        if self.aggregates.covers(start, end, categories, "Estabelecimento"):
+            return self.aggregates.get_expenses_by_establishment(start, end, categories)
+        expenses_df = self.get_expenses_in_range(start, end, categories)
+        data = expenses_df.groupby("Estabelecimento")["Valor"].sum().reset_index()
+        return data.sort_values("Valor", ascending=False)
+
+    @instrumented("fm.by_month", rows=len)
+    def get_expenses_by_month(self, start=None, end=None, categories=None):
+        if self.aggregates.covers(start, end, categories, "Mês"):
+            return self.aggregates.get_expenses_by_month(start, end, categories)
+        expenses_df = self.get_expenses_in_range(start, end, categories)
+        return month_frame(expenses_df.groupby(expenses_df["Data"].dt.to_period("M"))["Valor"].sum())
+
+    def get_savings_by_type(self):
+        return self.aggregates.get_savings_by_type()
+
+    # Confere os totais incrementais contra um recálculo completo do extrato
+    def aggregates_match_ledger(self):
+        return self.aggregates == LedgerAggregates.from_ledgers(self.expenses, self.monthly_savings)
+
+    # Visões do extrato colunar como DataFrame (sem cópia das colunas numéricas)
+    @instrumented("fm.get_expenses_df", rows=len)
     def get_expenses_df(self):
-        return pd.DataFrame([
-            {
-                "ID": expense.id,
-                "Data": expense.date,
-                "Estabelecimento": expense.establishment,
-                "Categoria": expense.category,
-                "Valor": expense.value
-            } for expense in self.expenses
-        ])
+        return self.expenses.to_frame()
 
     def get_savings_df(self):
-        return pd.DataFrame([
-            {
-                "ID": savings.id,
-                "Tipo Entrada": savings.saving_type,
-                "Data": savings.date,
-                "Valor": savings.value
-            } for savings in self.monthly_savings
-        ])
-    
-    def add_expenses_from_csv(self, csv_content):
+        return self.monthly_savings.to_frame()
+
+    # Percorre o extrato em blocos de linhas, sem montar a tabela completa de uma vez
+    def iter_ledger_chunks(self, ledger="expenses", chunksize=EXPORT_CHUNK_SIZE):
+        entries = self.expenses if ledger == "expenses" else self.monthly_savings
+        for first in range(0, len(entries), chunksize):
+            chunk = entries.take(np.arange(first, min(first + chunksize, len(entries))))
+            yield chunk.drop(columns=entries.key_column)
+
+    # Importa o CSV em blocos: valores e datas são convertidos por coluna, as linhas
+    # inválidas vão para o relatório de erros e as válidas entram no extrato em bloco,
+    # com uma única gravação no Firebase ao final. Arquivos já importados e linhas
+    # já existentes no extrato são ignorados.
+    @instrumented("fm.add_expenses_from_csv", rows=lambda report: report.added)
+    def add_expenses_from_csv(self, csv_file, chunksize=CSV_CHUNK_SIZE, progress=None):
+        return self.apply_csv_import(self.read_csv_import(csv_file, chunksize, progress))
+
+    # Primeira etapa da importação: lê, padroniza, valida e deduplica o arquivo sem alterar
+    # o extrato, então pode rodar em uma tarefa em segundo plano
+    @instrumented("fm.read_csv_import", rows=lambda prepared: sum(len(chunk["Valor"]) for chunk in prepared.chunks))
+    def read_csv_import(self, csv_file, chunksize=CSV_CHUNK_SIZE, progress=None):
+        prepared = CsvImport()
+        report = prepared.report
+        if isinstance(csv_file, bytes):
+            csv_file = io.BytesIO(csv_file)
+
         try:
-            df = pd.read_csv(io.StringIO(csv_content.decode('utf-8')))
-            required_columns = ["Estabelecimento", "Valor da Despesa", "Data", "Categoria"]
-            
-            if not all(col in df.columns for col in required_columns):
-                return "Erro: O arquivo CSV não contém todas as colunas necessárias."
-
-            added_count = 0
-            for _, row in df.iterrows():
-                try:
-                    establishment = row["Estabelecimento"]
-                    value = float(row["Valor da Despesa"])
-                    date = pd.to_datetime(row["Data"]).date()
-                    category = row["Categoria"]
-                    self.add_expense(establishment, category, value, date)
-                    added_count += 1
-                except Exception as e:
-                    st.error(f"Erro ao adicionar despesa: {e}")
-
-            # Salva automaticamente no Firebase após adicionar despesas do CSV
-            self.save_expenses_to_firebase()
-
-            return f"{added_count} despesas adicionadas com sucesso. Você já pode fazer outro upload"
-        
+            prepared.digest = file_digest(csv_file)
+            with self.lock:
+                if self.mark_duplicate_file(prepared):
+                    return prepared
+                deduplicator = RowDeduplicator(self.expense_fingerprints())
+                merchant_map = dict(self.merchant_map)
+
+            total_size = csv_file.seek(0, io.SEEK_END) or 1
+            csv_file.seek(0)
+            encoding, separator, decimal = sniff_csv_format(csv_file)
+            chunks = pd.read_csv(
+                csv_file, sep=separator, encoding=encoding, dtype=str,
+                skipinitialspace=True, chunksize=chunksize
+            )
+
+            first_line = 2
+            for chunk in chunks:
+                if first_line == 2 and not all(col in chunk.columns for col in CSV_REQUIRED_COLUMNS):
+                    report.failed = True
+                    report.message = "Erro: O arquivo CSV não contém todas as colunas necessárias."
+                    return prepared
+
+                prepared.chunks.append(
+                    self._read_expense_chunk(chunk, first_line, report, deduplicator, merchant_map, decimal)
+                )
+                first_line += len(chunk)
+                if progress is not None:
+                    progress(min(csv_file.tell() / total_size, 1.0))
+
         except Exception as e:
-            return f"Erro ao processar o arquivo CSV: {e}"
+            report.failed = True
+            report.message = f"Erro ao processar o arquivo CSV: {e}"
+        return prepared
 
-# Funções para salvar os dados no firebase
-def save_expenses_to_firebase(user_id, expenses_df):
-    try:
-        expenses_ref = db.reference(f'users/{user_id}/expenses')
-        expenses_df['Data'] = expenses_df['Data'].astype(str)
-        expenses_data = expenses_df.to_dict('records')
-        expenses_ref.set(expenses_data)
+    # Segunda etapa: as linhas válidas entram no extrato em um único lote. Uma importação só
+    # é aplicada uma vez, e um arquivo já importado, inclusive por outra tarefa, é ignorado.
+    @instrumented("fm.apply_csv_import", rows=lambda report: report.added)
+    @synchronized
+    def apply_csv_import(self, prepared):
+        report = prepared.report
+        if prepared.applied or report.failed or self.mark_duplicate_file(prepared):
+            return report
+        prepared.applied = True
+
+        with self.batch():
+            for columns in prepared.chunks:
+                report.added += self._append_expenses(columns)
+            self.imported_files[prepared.digest] = {
+                "Data": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                "Linhas": report.added,
+                "Duplicadas": report.deduplicated
+            }
+            self._dirty_imports.add(prepared.digest)
+        prepared.chunks = []
+
+        report.message = f"{report.added} despesas adicionadas com sucesso. Você já pode fazer outro upload"
+        if report.deduplicated:
+            report.message += f" ({report.deduplicated} linhas já existentes foram ignoradas)"
+        return report
+
+    def mark_duplicate_file(self, prepared):
+        imported = self.imported_files.get(prepared.digest)
+        if imported is None:
+            return False
+        prepared.report.duplicate_file = True
+        prepared.report.message = f"Este arquivo já foi importado em {imported['Data']}. Nenhuma despesa foi adicionada."
         return True
-    except Exception as e:
-        st.error(f"Erro ao salvar dados no Firebase: {e}")
-        return False
-    
-def save_savings_to_firebase(user_id, savings_df):
+
+    def expense_fingerprints(self):
+        return row_fingerprints(
+            self.expenses.column("Data"), self.expenses.column("Valor"), self.expenses.column("Estabelecimento")
+        )
+
+    # Nome padronizado e categoria de cada linha: primeiro o mapa aprendido do usuário,
+    # depois as regras de estabelecimentos. A categoria do CSV, quando preenchida, prevalece.
+    def categorize_merchants(self, raw_establishments, csv_categories=None, merchant_map=None):
+        if merchant_map is None:
+            merchant_map = self.merchant_map
+        merchants = get_merchant_normalizer().normalize(raw_establishments)
+        establishments, categories = merchants["Estabelecimento"], merchants["Categoria"]
+        if merchant_map:
+            learned = pd.DataFrame.from_dict(merchant_map, orient="index").reindex(merchants["Chave"])
+            establishments = pd.Series(learned["Estabelecimento"].to_numpy(), index=merchants.index).fillna(establishments)
+            categories = pd.Series(learned["Categoria"].to_numpy(), index=merchants.index).fillna(categories)
+        if csv_categories is not None:
+            categories = csv_categories.where(csv_categories.notna() & (csv_categories != ""), categories)
+        return establishments, categories.fillna("Outros")
+
+    # Colunas das linhas válidas e novas de um bloco do CSV, ainda sem IDs
+    def _read_expense_chunk(self, chunk, first_line, report, deduplicator, merchant_map, decimal=','):
+        raw_establishments = chunk["Estabelecimento"].str.strip()
+        csv_categories = chunk["Categoria"].str.strip() if "Categoria" in chunk.columns else None
+        establishments, categories = self.categorize_merchants(raw_establishments, csv_categories, merchant_map)
+        values = parse_brl_values(chunk["Valor da Despesa"], decimal)
+        dates = parse_csv_dates(chunk["Data"])
+
+        reasons = pd.Series("", index=chunk.index)
+        reasons[raw_establishments.isna() | (raw_establishments == "")] += "Estabelecimento vazio; "
+        reasons[values.isna()] += "Valor inválido; "
+        reasons[dates.isna()] += "Data inválida; "
+        valid = (reasons == "").to_numpy()
+
+        if not valid.all():
+            rejected = chunk[~valid].copy()
+            rejected.insert(0, "Linha", np.arange(first_line, first_line + len(chunk))[~valid])
+            rejected["Erro"] = reasons[~valid].str.rstrip("; ")
+            report.rejected.append(rejected)
+
+        if valid.any():
+            # O extrato guarda o nome original nas despesas importadas antes da padronização, o
+            # padronizado nas demais e o aprendido nas importadas depois de uma edição: a linha
+            # é repetida se bater com qualquer um dos três
+            duplicates = deduplicator.duplicates(row_fingerprints(
+                dates[valid], values[valid], raw_establishments[valid]
+            )) | deduplicator.duplicates(row_fingerprints(
+                dates[valid], values[valid], establishments[valid]
+            ), variant="aprendido")
+            if merchant_map:
+                standard = get_merchant_normalizer().normalize(raw_establishments[valid])["Estabelecimento"]
+                duplicates |= deduplicator.duplicates(row_fingerprints(
+                    dates[valid], values[valid], standard
+                ), variant="padronizado")
+            report.deduplicated += int(duplicates.sum())
+            valid[np.flatnonzero(valid)[duplicates]] = False
+
+        return {
+            "Data": dates[valid],
+            "Estabelecimento": establishments[valid].to_numpy(),
+            "Categoria": categories[valid].to_numpy(),
+            "Valor": values[valid].to_numpy(dtype=float)
+        }
+
+    def _append_expenses(self, columns):
+        count = len(columns["Valor"])
+        if count:
+            keys = new_record_keys(count)
+            ids = np.arange(self.next_expense_id, self.next_expense_id + count, dtype=np.int64)
+            start = len(self.expenses)
+            self.expenses.extend({"ID": ids, "Chave": keys, **columns})
+            self.aggregates.add_expenses(self.expenses.take(np.arange(start, len(self.expenses))))
+            self.next_expense_id += count
+            self._mark_many_dirty(self._dirty_expenses, keys)
+        return count
+
+# Caminho de cada registro (users/{uid}/expenses/{chave}). A chave é a coluna "Chave":
+# igual ao ID nos registros antigos e aleatória (new_record_keys) nos novos, então duas
+# sessões do mesmo usuário nunca gravam no mesmo caminho. O prefixo evita que o Firebase
+# devolva chaves numéricas como lista.
+def record_key(key):
+    return f"id_{int(key)}"
+
+def key_from_record_key(record_key):
+    return int(record_key[len("id_"):])
+
+# Chaves dos registros carregados; tabelas sem a coluna (formato antigo) usam o ID,
+# que era a chave do caminho
+def frame_keys(frame):
+    return frame['Chave' if 'Chave' in frame else 'ID'].astype(np.int64).to_numpy()
+
+# Extrato no formato das tabelas a partir de {caminho: registro}
+def keyed_records_frame(records):
+    frame = pd.DataFrame(list(records.values()))
+    if not frame.empty:
+        frame['Chave'] = np.array([key_from_record_key(key) for key in records], dtype=np.int64)
+    return frame
+
+def now_ms():
+    return int(time.time() * 1000)
+
+# Monta os caminhos do update multi-path. Cada registro leva o instante da gravação em
+# "Atualizado"; registros removidos viram None e deixam uma marca em deleted/{nó}-{chave}.
+def changed_records(node, ledger, dirty_keys, revision):
+    if not dirty_keys:
+        return {}
+    current = ledger.records(dirty_keys)
+    updates = {}
+    for dirty_key in dirty_keys:
+        key = record_key(dirty_key)
+        record = current.get(dirty_key)
+        if record is None:
+            updates[f"deleted/{node}-{key}"] = revision
+        else:
+            record["Atualizado"] = revision
+        updates[f"{node}/{key}"] = record
+    return updates
+
+# Valor gravado em um caminho: incrementos do servidor ({".sv": {"increment": n}}) somam
+# ao valor atual, como no Firebase
+def resolve_server_value(current, value):
+    if isinstance(value, dict) and ".sv" in value:
+        return (current if isinstance(current, (int, float)) else 0) + value[".sv"]["increment"]
+    return value
+
+# Grava o valor no caminho dentro do documento; None remove e documentos vazios somem
+def set_document_path(document, parts, value):
+    if not parts:
+        value = resolve_server_value(document, value)
+        return None if value == {} else value
+    document = dict(document) if isinstance(document, dict) else {}
+    child = set_document_path(document.get(parts[0]), parts[1:], value)
+    if child is None:
+        document.pop(parts[0], None)
+    else:
+        document[parts[0]] = child
+    return document or None
+
+# Interface de armazenamento dos dados de cada usuário. As alterações chegam como um
+# update multi-path relativo a users/{uid}, por exemplo
+# {"expenses/id_1": registro, "savings/id_3": None, "imports/<hash>": resumo,
+#  "rollups/m_202401/Gastos": {".sv": {"increment": 1050}}},
+# onde None significa remoção e ".sv" é um incremento feito pelo servidor.
+class LedgerStore:
+    # Extrato ("expenses" ou "savings") como DataFrame ordenado por ID, com a coluna "Chave"
+    def load_ledger(self, user_id, node):
+        raise NotImplementedError
+
+    # Demais nós (ex.: "imports") como dicionário {chave: valor}
+    def load_node(self, user_id, node):
+        raise NotImplementedError
+
+    def apply_changes(self, user_id, updates):
+        raise NotImplementedError
+
+    # Revisão da última gravação do usuário (meta/revision)
+    def load_revision(self, user_id):
+        return self.load_node(user_id, 'meta').get('revision')
+
+    # Registros do extrato gravados a partir de "since" (ms), indexados pela chave
+    def load_changes(self, user_id, node, since):
+        raise NotImplementedError
+
+    # Marcas de remoção ({"expenses-id_1": instante}) gravadas a partir de "since"
+    def load_tombstones(self, user_id, since):
+        raise NotImplementedError
+
+    # Apaga as marcas de remoção gravadas antes de "before" (ms)
+    def prune_tombstones(self, user_id, before):
+        raise NotImplementedError
+
+    # Despesas de um período (datas ISO, inclusive) e opcionalmente de algumas categorias
+    def query_expenses(self, user_id, start=None, end=None, categories=None):
+        raise NotImplementedError
+
+    # Soma das despesas agrupadas por "Categoria", "Estabelecimento" ou "Mês" (AAAA-MM)
+    def aggregate_expenses(self, user_id, by, start=None, end=None, categories=None):
+        expenses_df = self.query_expenses(user_id, start, end, categories)
+        if expenses_df.empty:
+            return pd.DataFrame({by: [], "Valor": []})
+        keys = expenses_df["Data"].str[:7].rename("Mês") if by == "Mês" else expenses_df[by]
+        cents = pd.Series(to_cents(expenses_df["Valor"]), index=expenses_df.index)
+        totals = cents.groupby(keys).sum() / 100
+        return totals.rename("Valor").reset_index()
+
+# Armazenamento no Firebase Realtime Database (users/{uid}/...)
+# A instância é única por processo (get_ledger_store), então as referências de cada usuário
+# são criadas uma vez e compartilham o cliente HTTP (com pool de conexões) do app do Firebase.
+class FirebaseLedgerStore(LedgerStore):
+    def __init__(self):
+        from firebase_admin import db
+        self.db = db
+        self.app = get_firebase_app()
+        self._references = {}
+
+    def reference(self, user_id, node=None):
+        path = f'users/{user_id}' if node is None else f'users/{user_id}/{node}'
+        ref = self._references.get(path)
+        if ref is None:
+            ref = self._references.setdefault(path, self.db.reference(path, app=self.app))
+        return ref
+
+    # Todas as chamadas ao banco passam por aqui, para as métricas de chamadas e bytes
+    def _get(self, query):
+        if not METRICS.enabled:
+            return query.get()
+        with METRICS.span("firebase.get") as span:
+            data = query.get()
+            span.rows = len(data) if isinstance(data, (dict, list)) else 0
+        METRICS.count("gestor_firebase_calls_total", "get")
+        METRICS.count("gestor_firebase_bytes_total", "read", payload_size(data))
+        return data
+
+    def _write(self, ref, operation, value):
+        if not METRICS.enabled:
+            return getattr(ref, operation)(value)
+        with METRICS.span(f"firebase.{operation}") as span:
+            span.rows = len(value)
+            getattr(ref, operation)(value)
+        METRICS.count("gestor_firebase_calls_total", operation)
+        METRICS.count("gestor_firebase_bytes_total", "written", payload_size(value))
+
+    # Migração única do formato antigo (lista posicional) para registros com chave estável
+    def migrate_ledger_layout(self, ledger_ref, records):
+        records = [record for record in records if record]
+        ids = [record.get('ID') for record in records]
+        if None in ids or len(set(ids)) != len(ids):
+            for position, record in enumerate(records, start=1):
+                record['ID'] = position
+        keyed = {record_key(record['ID']): record for record in records}
+        self._write(ledger_ref, 'set', keyed)
+        return keyed
+
+    def load_ledger(self, user_id, node):
+        ledger_ref = self.reference(user_id, node)
+        ledger_data = self._get(ledger_ref)
+        if not ledger_data:
+            return pd.DataFrame()
+        if isinstance(ledger_data, list):
+            ledger_data = self.migrate_ledger_layout(ledger_ref, ledger_data)
+        return keyed_records_frame(ledger_data).sort_values(['ID', 'Chave'], ignore_index=True)
+
+    def load_node(self, user_id, node):
+        return self._get(self.reference(user_id, node)) or {}
+
+    def apply_changes(self, user_id, updates):
+        if updates:
+            self._write(self.reference(user_id), 'update', updates)
+
+    # Requer ".indexOn": ["Atualizado"] nos extratos e ".indexOn": ".value" em deleted
+    def load_changes(self, user_id, node, since):
+        return self._get(self.reference(user_id, node).order_by_child('Atualizado').start_at(since)) or {}
+
+    def load_tombstones(self, user_id, since):
+        return self._get(self.reference(user_id, 'deleted').order_by_value().start_at(since)) or {}
+
+    # Só as marcas vencidas são baixadas (o mesmo índice por valor)
+    def prune_tombstones(self, user_id, before):
+        expired = self._get(self.reference(user_id, 'deleted').order_by_value().end_at(before - 1)) or {}
+        self.apply_changes(user_id, {f"deleted/{key}": None for key in expired})
+
+    # Requer ".indexOn": ["Data"] em users/$uid/expenses nas regras do banco
+    def query_expenses(self, user_id, start=None, end=None, categories=None):
+        query = self.reference(user_id, 'expenses').order_by_child('Data')
+        if start is not None:
+            query = query.start_at(str(start))
+        if end is not None:
+            query = query.end_at(str(end))
+        expenses_data = self._get(query) or {}
+        expenses_df = pd.DataFrame(list(expenses_data.values()))
+        if categories and not expenses_df.empty:
+            expenses_df = expenses_df[expenses_df["Categoria"].isin(categories)]
+        return expenses_df
+
+# Colunas das tabelas SQLite de cada extrato (nome no registro -> coluna)
+SQLITE_LEDGER_COLUMNS = {
+    "expenses": {
+        "ID": "id", "Data": "data", "Estabelecimento": "estabelecimento", "Categoria": "categoria",
+        "Valor": "valor", "Atualizado": "atualizado"
+    },
+    "savings": {"ID": "id", "Tipo Entrada": "tipo_entrada", "Data": "data", "Valor": "valor", "Atualizado": "atualizado"},
+}
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS expenses (
+    user_id TEXT NOT NULL, key TEXT NOT NULL, id INTEGER NOT NULL, data TEXT,
+    estabelecimento TEXT, categoria TEXT, valor REAL, atualizado INTEGER, PRIMARY KEY (user_id, key)
+);
+CREATE INDEX IF NOT EXISTS expenses_by_date ON expenses (user_id, data);
+CREATE INDEX IF NOT EXISTS expenses_by_category ON expenses (user_id, categoria, data);
+CREATE TABLE IF NOT EXISTS savings (
+    user_id TEXT NOT NULL, key TEXT NOT NULL, id INTEGER NOT NULL, tipo_entrada TEXT,
+    data TEXT, valor REAL, atualizado INTEGER, PRIMARY KEY (user_id, key)
+);
+CREATE INDEX IF NOT EXISTS savings_by_date ON savings (user_id, data);
+CREATE TABLE IF NOT EXISTS nodes (
+    user_id TEXT NOT NULL, node TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,
+    PRIMARY KEY (user_id, node, key)
+);
+"""
+
+# Armazenamento local em SQLite, para uso sem Firebase (modo auto-hospedado e testes).
+# Filtros por período/categoria e somas por grupo são resolvidos pelo próprio banco.
+class SQLiteLedgerStore(LedgerStore):
+    def __init__(self, path=":memory:"):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SQLITE_SCHEMA)
+        self._migrate()
+        # A mesma conexão é compartilhada pelas sessões do Streamlit
+        self.lock = threading.Lock()
+
+    # Bancos criados antes da coluna "atualizado" recebem a coluna e o índice
+    def _migrate(self):
+        for node in SQLITE_LEDGER_COLUMNS:
+            columns = [row[1] for row in self.connection.execute(f"PRAGMA table_info({node})")]
+            if "atualizado" not in columns:
+                self.connection.execute(f"ALTER TABLE {node} ADD COLUMN atualizado INTEGER")
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {node}_by_update ON {node} (user_id, atualizado)")
+        self.connection.commit()
+
+    def load_ledger(self, user_id, node):
+        columns = ", ".join(f'{column} AS "{name}"' for name, column in SQLITE_LEDGER_COLUMNS[node].items())
+        with self.lock:
+            ledger_df = pd.read_sql_query(
+                f"SELECT {columns}, key FROM {node} WHERE user_id = ? ORDER BY id, key", self.connection, params=(user_id,)
+            )
+        ledger_df['Chave'] = np.array([key_from_record_key(key) for key in ledger_df.pop('key')], dtype=np.int64)
+        return ledger_df
+
+    def load_node(self, user_id, node):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, value FROM nodes WHERE user_id = ? AND node = ?", (user_id, node)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def apply_changes(self, user_id, updates):
+        with self.lock, self.connection:
+            for path, value in updates.items():
+                node, _, key = path.partition("/")
+                if node in SQLITE_LEDGER_COLUMNS:
+                    self._write_record(user_id, node, key, value)
+                else:
+                    self._write_node(user_id, node, key, value)
+
+    def load_changes(self, user_id, node, since):
+        columns = ", ".join(f'{column} AS "{name}"' for name, column in SQLITE_LEDGER_COLUMNS[node].items())
+        with self.lock:
+            changes = pd.read_sql_query(
+                f"SELECT key, {columns} FROM {node} WHERE user_id = ? AND atualizado >= ?",
+                self.connection, params=(user_id, since)
+            )
+        return changes.set_index("key").to_dict("index")
+
+    def load_tombstones(self, user_id, since):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, value FROM nodes WHERE user_id = ? AND node = 'deleted' AND CAST(value AS INTEGER) >= ?",
+                (user_id, since)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def prune_tombstones(self, user_id, before):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM nodes WHERE user_id = ? AND node = 'deleted' AND CAST(value AS INTEGER) < ?", (user_id, before)
+            )
+
+    # Os demais nós guardam um documento JSON por chave; caminhos mais longos
+    # ("m_202401/Gastos") alteram só uma parte do documento
+    def _write_node(self, user_id, node, path, value):
+        key, _, subpath = path.partition("/")
+        if subpath or (isinstance(value, dict) and ".sv" in value):
+            row = self.connection.execute(
+                "SELECT value FROM nodes WHERE user_id = ? AND node = ? AND key = ?", (user_id, node, key)
+            ).fetchone()
+            value = set_document_path(json.loads(row[0]) if row else None, [part for part in subpath.split("/") if part], value)
+        if value is None:
+            self.connection.execute(
+                "DELETE FROM nodes WHERE user_id = ? AND node = ? AND key = ?", (user_id, node, key)
+            )
+        else:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO nodes (user_id, node, key, value) VALUES (?, ?, ?, ?)",
+                (user_id, node, key, json.dumps(value))
+            )
+
+    def _write_record(self, user_id, node, key, record):
+        if record is None:
+            self.connection.execute(f"DELETE FROM {node} WHERE user_id = ? AND key = ?", (user_id, key))
+            return
+        columns = SQLITE_LEDGER_COLUMNS[node]
+        names = ", ".join(["user_id", "key"] + list(columns.values()))
+        placeholders = ", ".join("?" * (len(columns) + 2))
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO {node} ({names}) VALUES ({placeholders})",
+            [user_id, key] + [record.get(name) for name in columns]
+        )
+
+    def _expense_filters(self, user_id, start, end, categories=None):
+        clauses, params = ["user_id = ?"], [user_id]
+        if start is not None:
+            clauses.append("data >= ?")
+            params.append(str(start))
+        if end is not None:
+            clauses.append("data <= ?")
+            params.append(str(end))
+        if categories:
+            clauses.append(f"categoria IN ({', '.join('?' * len(categories))})")
+            params.extend(categories)
+        return " AND ".join(clauses), params
+
+    def query_expenses(self, user_id, start=None, end=None, categories=None):
+        where, params = self._expense_filters(user_id, start, end, categories)
+        columns = ", ".join(f'{column} AS "{name}"' for name, column in SQLITE_LEDGER_COLUMNS["expenses"].items())
+        with self.lock:
+            return pd.read_sql_query(
+                f"SELECT {columns} FROM expenses WHERE {where} ORDER BY data", self.connection, params=params
+            )
+
+    def aggregate_expenses(self, user_id, by, start=None, end=None, categories=None):
+        group = {"Categoria": "categoria", "Estabelecimento": "estabelecimento", "Mês": "substr(data, 1, 7)"}[by]
+        where, params = self._expense_filters(user_id, start, end, categories)
+        with self.lock:
+            return pd.read_sql_query(
+                f'SELECT {group} AS "{by}", SUM(CAST(ROUND(valor * 100) AS INTEGER)) / 100.0 AS "Valor" '
+                f"FROM expenses WHERE {where} GROUP BY {group} ORDER BY {group}",
+                self.connection, params=params
+            )
+
+# Consultas dos gráficos resolvidas pelo armazenamento: o banco filtra o período e soma
+# os grupos, então só o resultado é trafegado. Usadas quando o filtro corta meses (os
+# resumos não respondem) e o extrato ainda não foi carregado. Os mesmos nomes do
+# FinanceManager, para o expense_chart.
+class StoredExpenseQueries:
+    def __init__(self, store, user_id):
+        self.store = store
+        self.user_id = user_id
+
+    @instrumented("store.by_category", rows=len)
+    def get_expenses_by_category(self, start=None, end=None, categories=None):
+        return self.store.aggregate_expenses(self.user_id, "Categoria", start, end, categories)
+
+    @instrumented("store.by_establishment", rows=len)
+    def get_expenses_by_establishment(self, start=None, end=None, categories=None):
+        data = self.store.aggregate_expenses(self.user_id, "Estabelecimento", start, end, categories)
+        return data.sort_values("Valor", ascending=False)
+
+    @instrumented("store.by_month", rows=len)
+    def get_expenses_by_month(self, start=None, end=None, categories=None):
+        data = self.store.aggregate_expenses(self.user_id, "Mês", start, end, categories)
+        totals = pd.Series(data["Valor"].to_numpy(dtype=float), index=pd.PeriodIndex(data["Mês"], freq="M"))
+        return month_frame(totals.sort_index())
+
+# Seção [storage] do secrets.toml; vazia quando o app roda sem secrets.toml
+# (por exemplo com SQLite e variáveis de ambiente, ou nos benchmarks)
+def storage_settings():
     try:
-        savings_ref = db.reference(f'users/{user_id}/savings')
-        savings_df['Data'] = savings_df['Data'].astype(str)
-        savings_data = savings_df.to_dict('records')
-        savings_ref.set(savings_data)
-        return True
+        return st.secrets.get("storage", {})
+    except FileNotFoundError:
+        return {}
+
+# Backend escolhido em [storage] no secrets.toml (backend = "firebase" ou "sqlite",
+# sqlite_path = "...") ou pelas variáveis LEDGER_BACKEND / LEDGER_SQLITE_PATH.
+# Uma única instância é compartilhada por todas as sessões.
+@st.cache_resource
+def get_ledger_store():
+    storage = storage_settings()
+    backend = os.environ.get("LEDGER_BACKEND", storage.get("backend", "firebase"))
+    if backend == "sqlite":
+        return SQLiteLedgerStore(os.environ.get("LEDGER_SQLITE_PATH", storage.get("sqlite_path", "gestor_financeiro.db")))
+    return FirebaseLedgerStore()
+
+STORE_LOGGER = logging.getLogger("gestor_financeiro.store")
+
+# Função para salvar os dados: só os registros alterados, em um único update. Também roda
+# nas threads de gravação, onde um st.error se perderia: o erro vai para o log e a
+# mensagem é devolvida para ser mostrada pelo script (None quando gravou).
+@instrumented("store.save_changes")
+def save_ledger_changes(user_id, updates):
+    try:
+        get_ledger_store().apply_changes(user_id, updates)
+        return None
     except Exception as e:
-        st.error(f"Erro ao salvar dados no Firebase: {e}")
-        return False
-        
-# Função para carregar os dados do Firebase
-def load_expenses_from_firebase(user_id):
+        JOBS_LOGGER.exception("Falha ao salvar dados")
+        return str(e)
+
+# Remove as marcas de remoção mais antigas que a retenção. Uma falha aqui não perde
+# dados (as marcas ficam para a próxima vez), então só é registrada no log.
+@instrumented("store.prune_tombstones")
+def prune_tombstones(user_id, revision):
     try:
-        expenses_ref = db.reference(f'users/{user_id}/expenses')
-        expenses_data = expenses_ref.get()
-        if expenses_data:
-            expenses_df = pd.DataFrame(expenses_data)
-            return expenses_df
-        else:
-            return pd.DataFrame()
+        get_ledger_store().prune_tombstones(user_id, revision - TOMBSTONE_TTL_MS)
+    except Exception:
+        JOBS_LOGGER.exception("Falha ao remover marcas de remoção antigas")
+
+# Executa as leituras ao mesmo tempo: a latência fica próxima à da leitura mais lenta
+def run_concurrently(*calls):
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        futures = [executor.submit(METRICS.propagate(call)) for call in calls]
+        return [future.result() for future in futures]
+
+LEDGER_CACHE_SCHEMA = 2
+# Margem na revalidação (ms) para tolerar diferenças de relógio entre servidores
+REVALIDATION_MARGIN_MS = 5 * 60 * 1000
+# Retenção das marcas de remoção (ms). Caches mais antigos que isso podem ter perdido
+# remoções e são descartados (busca completa), então as marcas vencidas são apagadas.
+TOMBSTONE_TTL_MS = 30 * 24 * 60 * 60 * 1000
+
+# Aplica ao extrato em cache os registros alterados e as remoções desde a última revisão
+def merge_ledger_changes(cached_df, changes, tombstones, node):
+    frames = [frame for frame in (cached_df, keyed_records_frame(changes)) if not frame.empty]
+    merged = pd.concat(frames, ignore_index=True) if frames else cached_df
+    if merged.empty:
+        return merged
+    merged = merged.drop_duplicates('Chave', keep='last')
+    deleted = pd.Series({
+        key_from_record_key(key.split('-', 1)[1]): removed_at
+        for key, removed_at in tombstones.items() if key.startswith(f"{node}-")
+    }, dtype=float)
+    if len(deleted):
+        # Um registro gravado de novo depois da remoção (caminho reaproveitado) continua valendo
+        updated = merged['Atualizado'] if 'Atualizado' in merged else pd.Series(0, index=merged.index)
+        merged = merged[~(merged['Chave'].map(deleted) >= updated.fillna(0))]
+    return merged.sort_values(['ID', 'Chave'], ignore_index=True)
+
+# Cache local (Parquet) dos extratos de cada usuário, com a revisão em que foi gravado.
+# No login só são buscados os registros alterados depois dessa revisão; se ela for
+# inválida (cache ausente, formato antigo ou revisão remota anterior) a busca é completa.
+class LedgerCache:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, user_id, name):
+        safe_id = "".join(char for char in str(user_id) if char.isalnum() or char in "-_")
+        return os.path.join(self.directory, safe_id, name)
+
+    def read(self, user_id):
+        try:
+            with open(self._path(user_id, "meta.json"), encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            if meta.get("schema") != LEDGER_CACHE_SCHEMA:
+                return None
+            return (
+                pd.read_parquet(self._path(user_id, "expenses.parquet")),
+                pd.read_parquet(self._path(user_id, "savings.parquet")),
+                meta["revision"]
+            )
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def write(self, user_id, expenses_df, savings_df, revision):
+        os.makedirs(os.path.dirname(self._path(user_id, "meta.json")), exist_ok=True)
+        # O meta.json é apagado antes e gravado por último: um cache incompleto nunca é usado
+        try:
+            os.remove(self._path(user_id, "meta.json"))
+        except FileNotFoundError:
+            pass
+        expenses_df.to_parquet(self._path(user_id, "expenses.parquet"), index=False)
+        savings_df.to_parquet(self._path(user_id, "savings.parquet"), index=False)
+        with open(self._path(user_id, "meta.json"), "w", encoding="utf-8") as meta_file:
+            json.dump({"schema": LEDGER_CACHE_SCHEMA, "revision": revision}, meta_file)
+
+    def load(self, store, user_id):
+        cached = self.read(user_id)
+        if cached is None:
+            # Sem cache não há o que revalidar: a revisão e os extratos são buscados juntos
+            revision, expenses_df, savings_df = run_concurrently(
+                lambda: store.load_revision(user_id),
+                lambda: store.load_ledger(user_id, 'expenses'),
+                lambda: store.load_ledger(user_id, 'savings')
+            )
+            if revision is not None:
+                self.write(user_id, expenses_df, savings_df, revision)
+            return expenses_df, savings_df
+
+        revision = store.load_revision(user_id)
+        if revision is not None and revision - TOMBSTONE_TTL_MS + REVALIDATION_MARGIN_MS < cached[2] <= revision:
+            expenses_df, savings_df, cached_revision = cached
+            if cached_revision == revision:
+                return expenses_df, savings_df
+            try:
+                since = cached_revision - REVALIDATION_MARGIN_MS
+                tombstones, expense_changes, savings_changes = run_concurrently(
+                    lambda: store.load_tombstones(user_id, since),
+                    lambda: store.load_changes(user_id, 'expenses', since),
+                    lambda: store.load_changes(user_id, 'savings', since)
+                )
+                expenses_df = merge_ledger_changes(expenses_df, expense_changes, tombstones, 'expenses')
+                savings_df = merge_ledger_changes(savings_df, savings_changes, tombstones, 'savings')
+                self.write(user_id, expenses_df, savings_df, revision)
+                return expenses_df, savings_df
+            except Exception:
+                pass
+
+        expenses_df, savings_df = run_concurrently(
+            lambda: store.load_ledger(user_id, 'expenses'),
+            lambda: store.load_ledger(user_id, 'savings')
+        )
+        if revision is not None:
+            self.write(user_id, expenses_df, savings_df, revision)
+        return expenses_df, savings_df
+
+# Diretório do cache em [storage] cache_dir no secrets.toml ou LEDGER_CACHE_DIR;
+# um valor vazio desativa o cache
+@st.cache_resource
+def get_ledger_cache():
+    storage = storage_settings()
+    default_directory = os.path.join(os.path.expanduser("~"), ".cache", "gestor-financeiro")
+    directory = os.environ.get("LEDGER_CACHE_DIR", storage.get("cache_dir", default_directory))
+    return LedgerCache(directory) if directory else None
+
+# Função para buscar os extratos (despesas e entradas), usando o cache local quando possível
+@instrumented("load.ledgers", rows=lambda frames: sum(len(frame) for frame in frames))
+def fetch_ledgers(store, cache, user_id):
+    if cache is None:
+        return tuple(run_concurrently(
+            lambda: store.load_ledger(user_id, 'expenses'),
+            lambda: store.load_ledger(user_id, 'savings')
+        ))
+    return cache.load(store, user_id)
+
+# Pool compartilhado pelas sessões para carregar os dados do login em segundo plano
+@st.cache_resource
+def get_loader_executor():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="carregamento")
+
+# Função para buscar o resumo do usuário: o meta (revisão e formato dos resumos), os
+# resumos mensais, as regras recorrentes e os orçamentos. É tudo o que o painel precisa;
+# o extrato fica para quando for aberto.
+@instrumented("load.summary", rows=lambda summary: len(summary[1]))
+def fetch_summary(store, user_id):
+    return tuple(run_concurrently(
+        lambda: store.load_node(user_id, 'meta'),
+        lambda: store.load_node(user_id, 'rollups'),
+        lambda: store.load_node(user_id, 'recurring'),
+        lambda: store.load_node(user_id, 'budgets')
+    ))
+
+# Função para iniciar o carregamento do resumo sem bloquear o login.
+# O backend é resolvido aqui, na thread do script; as threads só fazem as leituras.
+def start_loading_user_data(user_id):
+    store, executor = get_ledger_store(), get_loader_executor()
+    return {"summary": executor.submit(METRICS.propagate(fetch_summary), store, user_id)}
+
+# Função para aguardar o resumo. Retorna os totais e a revisão em que foram gravados, ou
+# (None, None) se a conta ainda não tem resumos: nesse caso o extrato completo é carregado.
+# Também retorna as regras recorrentes e os orçamentos (categoria -> centavos).
+def finish_loading_user_data(loading):
+    try:
+        meta, documents, rules, budgets = loading["summary"].result()
     except Exception as e:
-        st.error(f"Erro ao carregar despesas do Firebase: {e}")
-        return pd.DataFrame()
+        st.error(f"Erro ao carregar o resumo financeiro: {e}")
+        return None, None, {}, {}
+    try:
+        budgets = {rollup_label(key): int(cents) for key, cents in budgets.items()}
+        if meta.get("rollups") != ROLLUP_SCHEMA:
+            return None, None, rules, budgets
+        return LedgerAggregates.from_documents(documents), meta.get("revision"), rules, budgets
+    except Exception:
+        # Resumos ilegíveis não impedem o login: o extrato é carregado e os resumos regravados
+        STORE_LOGGER.exception("Resumo financeiro ilegível; recalculando a partir do extrato")
+        return None, None, rules if isinstance(rules, dict) else {}, {}
 
-def load_savings_from_firebase(user_id):
+# Função para carregar o extrato completo (despesas, entradas, importações e estabelecimentos
+# aprendidos) em paralelo. Não usa o Streamlit, então também roda como tarefa em segundo
+# plano; os erros voltam como mensagens junto com o FinanceManager.
+@instrumented("load.finance_manager")
+def fetch_finance_manager(store, cache, executor, user_id):
+    ledgers = executor.submit(METRICS.propagate(fetch_ledgers), store, cache, user_id)
+    imports = executor.submit(METRICS.propagate(store.load_node), user_id, 'imports')
+    merchants = executor.submit(METRICS.propagate(store.load_node), user_id, 'merchants')
+    loaded, errors = True, []
     try:
-        savings_ref = db.reference(f'users/{user_id}/savings')
-        savings_data = savings_ref.get()
-        if savings_data:
-            savings_df = pd.DataFrame(savings_data)
-            return savings_df
-        else:
-            return pd.DataFrame()
+        expenses_df, savings_df = ledgers.result()
     except Exception as e:
-        st.error(f"Erro ao carregar entradas do Firebase: {e}")
-        return pd.DataFrame()
-        
+        errors.append(f"Erro ao carregar despesas e entradas: {e}")
+        expenses_df, savings_df = pd.DataFrame(), pd.DataFrame()
+        loaded = False
+    try:
+        imported_files = imports.result()
+    except Exception as e:
+        errors.append(f"Erro ao carregar histórico de importações: {e}")
+        imported_files = {}
+    try:
+        merchant_map = {rollup_label(key): entry for key, entry in merchants.result().items()}
+    except Exception as e:
+        errors.append(f"Erro ao carregar os estabelecimentos aprendidos: {e}")
+        merchant_map = {}
+    # Monta o FinanceManager diretamente com os dados carregados (sem regravar no banco)
+    return FinanceManager.from_frames(user_id, expenses_df, savings_df, imported_files, merchant_map), loaded, errors
+
+def load_finance_manager(user_id):
+    fm, loaded, errors = fetch_finance_manager(get_ledger_store(), get_ledger_cache(), get_loader_executor(), user_id)
+    for error in errors:
+        st.error(error)
+    return fm, loaded
+
+# Tarefas em segundo plano: importações de CSV e o carregamento do extrato rodam fora da
+# thread do script, que continua respondendo. O pool é do processo; as tarefas de cada
+# sessão ficam em st.session_state.jobs, por chave, até serem concluídas.
+JOBS_LOGGER = logging.getLogger("gestor_financeiro.jobs")
+
+# Tempo máximo (s) que uma ação espera pelo carregamento do extrato antes de devolver a
+# página; o carregamento continua em segundo plano
+HYDRATE_WAIT_S = 20
+
+class Job:
+    def __init__(self, label, function, finish):
+        self.label = label
+        self.function = function
+        self.finish = finish
+        self.progress = None
+        self.status = "pendente"
+        self.result = None
+        self.error = None
+        self.future = None
+        self._claimed = threading.Lock()
+
+    def set_progress(self, fraction):
+        self.progress = fraction
+
+    def done(self):
+        return self.status in ("concluída", "falhou")
+
+    # Executa a tarefa no máximo uma vez, mesmo se for enviada ao pool de novo
+    def run(self):
+        if not self._claimed.acquire(blocking=False):
+            return
+        self.status = "executando"
+        try:
+            self.result = self.function(self)
+            self.status = "concluída"
+        except Exception as e:
+            JOBS_LOGGER.exception(f"Falha na tarefa: {self.label}")
+            self.error = e
+            self.status = "falhou"
+
+@st.cache_resource
+def get_job_executor():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="tarefas")
+
+# Pool só das gravações: importações lentas ocupando o pool de tarefas não atrasam o
+# salvamento das alterações de nenhuma sessão
+@st.cache_resource
+def get_flush_executor():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="gravacoes")
+
+# Envia a tarefa ao pool, a não ser que já exista uma com a mesma chave na sessão.
+# "function" recebe a tarefa e roda no pool; "finish" recebe a tarefa concluída e roda na
+# thread do script, em uma execução seguinte.
+def submit_job(key, label, function, finish):
+    jobs = st.session_state.setdefault('jobs', {})
+    job = jobs.get(key)
+    if job is None:
+        job = jobs[key] = Job(label, function, finish)
+        job.future = get_job_executor().submit(METRICS.propagate(job.run))
+    return job
+
+# Conclui as tarefas que terminaram. A tarefa só sai do registro depois de concluída: se o
+# script for interrompido no meio, a próxima execução conclui de novo, e cada "finish"
+# ignora o que já foi aplicado.
+def finish_jobs(*keys):
+    jobs = st.session_state.get('jobs', {})
+    for key in keys or list(jobs):
+        job = jobs.get(key)
+        if job is not None and job.done():
+            job.finish(job)
+            del jobs[key]
+
+# Progresso das tarefas em andamento, atualizado a cada segundo sem rodar o app inteiro.
+# Quando alguma termina, o app roda de novo para concluí-la.
+@st.fragment(run_every=1.0)
+def job_progress():
+    jobs = st.session_state.get('jobs', {}).values()
+    if any(job.done() for job in jobs):
+        st.rerun()
+    for job in jobs:
+        if job.progress is None:
+            st.caption(f"{job.label}...")
+        else:
+            st.progress(job.progress, text=job.label)
+
+# Começa a carregar o extrato em segundo plano, se ainda não foi carregado nem pedido
+def start_loading_finance_manager():
+    user_id = st.session_state.user_id
+    store, cache, executor = get_ledger_store(), get_ledger_cache(), get_loader_executor()
+    return submit_job(
+        f"hydrate:{user_id}", "Carregando lançamentos",
+        lambda job: fetch_finance_manager(store, cache, executor, user_id), install_finance_manager
+    )
+
+# Conclusão do carregamento: instala o FinanceManager na sessão (uma única vez), regrava os
+# resumos ausentes ou divergentes e passa as gravações para o pool de gravações
+def install_finance_manager(job):
+    if st.session_state.finance_manager is not None:
+        return
+    if job.error is not None:
+        st.error(f"Erro ao carregar despesas e entradas: {job.error}")
+        fm, loaded = FinanceManager(st.session_state.user_id), False
+    else:
+        fm, loaded, errors = job.result
+        for error in errors:
+            st.error(error)
+    rollups = st.session_state.get('rollups')
+    # Resumos ausentes ou diferentes do extrato são regravados a partir dele
+    if loaded and (rollups is None or rollups != fm.aggregates):
+        fm.rewrite_rollups(rollups.months if rollups is not None else ())
+    # As regras lidas no login passam a ser mantidas pelo FinanceManager (mesmo dict)
+    fm.recurring_rules = st.session_state.setdefault('recurring_rules', {})
+    fm.background_executor = get_flush_executor()
+    st.session_state.finance_manager = fm
+
+# Função para obter o FinanceManager, carregando o extrato na primeira vez que ele é
+# necessário (inclusões, importação ou filtros que os resumos não cobrem). Se o
+# carregamento já estiver em segundo plano, aguarda a mesma tarefa por até HYDRATE_WAIT_S;
+# depois disso a execução para e o progresso passa a ser acompanhado pela barra lateral,
+# que roda o app de novo quando o extrato chega.
+def require_finance_manager():
+    if st.session_state.finance_manager is None:
+        job = start_loading_finance_manager()
+        with st.spinner("Carregando lançamentos..."):
+            wait([job.future], timeout=HYDRATE_WAIT_S)
+        if not job.done():
+            st.info("Os lançamentos ainda estão sendo carregados. Repita a ação quando o carregamento terminar.")
+            with st.sidebar:
+                job_progress()
+            st.stop()
+        finish_jobs(f"hydrate:{st.session_state.user_id}")
+    return st.session_state.finance_manager
+
+# Lê o CSV enviado em uma tarefa em segundo plano. A chave é o arquivo do upload, então
+# reenvios do mesmo upload não criam outra tarefa.
+def start_csv_import(fm, uploaded_file):
+    data = uploaded_file.getvalue()
+    return submit_job(
+        f"import:{uploaded_file.file_id}", f"Importando {uploaded_file.name}",
+        lambda job: fm.read_csv_import(data, progress=job.set_progress), finish_csv_import
+    )
+
+# Conclusão de uma importação de CSV: as linhas entram no extrato e o resultado fica na
+# sessão para a barra lateral
+def finish_csv_import(job):
+    if job.error is not None:
+        report = ImportReport()
+        report.failed = True
+        report.message = f"Erro ao processar o arquivo CSV: {job.error}"
+    else:
+        report = require_finance_manager().apply_csv_import(job.result)
+    st.session_state.import_report = report
+    if not (report.failed or report.duplicate_file):
+        st.session_state.last_import_report = report
+
+# Totais exibidos no painel: os do FinanceManager, se o extrato já foi carregado,
+# ou os resumos mensais carregados no login
+def dashboard_summary():
+    fm = st.session_state.finance_manager
+    if fm is not None:
+        return fm.aggregates
+    if st.session_state.get('rollups') is None:
+        return require_finance_manager().aggregates
+    return st.session_state.rollups
+
+# Lançamentos recorrentes vencidos desde o último acesso: são gerados logo após o login,
+# em um único lote e uma única gravação. O extrato só é carregado se houver algo a gerar.
+def materialize_due_rules():
+    rules = st.session_state.get('recurring_rules', {})
+    today = datetime.now().date()
+    if not rules or not len(due_occurrences(recurring_frame(rules), today)[0]):
+        return
+    count = require_finance_manager().materialize_recurring(today)
+    st.toast(f"{count} lançamentos recorrentes adicionados.")
+
+# Remove a regra escolhida antes do rerun, para a lista já aparecer atualizada
+def remove_selected_rule():
+    st.session_state.rule_message = require_finance_manager().delete_recurring_rule(st.session_state.rule_selected)
+
+# Descrição de uma regra para a lista de regras cadastradas
+def rule_label(rule):
+    label = f"{rule['Descrição']} - {format_brl(rule['Valor'])} ({rule['Frequência'].lower()})"
+    if rule.get("Fim"):
+        label += f" até {pd.Timestamp(rule['Fim']):%d/%m/%Y}"
+    return label
+
+def format_brl(value):
+    return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+# Grava o orçamento mensal de uma categoria (valor zero remove). Orçamentos não dependem
+# do extrato, então são gravados direto, sem carregar o FinanceManager.
+def save_budget(category, value):
+    cents = int(round(value * 100))
+    error = save_ledger_changes(st.session_state.user_id, {f"budgets/{rollup_key(category)}": cents or None})
+    if error is not None:
+        st.error(f"Erro ao salvar dados: {error}")
+        return None
+    budgets = st.session_state.setdefault('budgets', {})
+    if cents:
+        budgets[category] = cents
+        return f"Orçamento de {category}: {format_brl(value)} por mês."
+    budgets.pop(category, None)
+    return f"Orçamento de {category} removido."
+
+# Orçamentos do mês atual contra os gastos, com alertas a partir de 80% do limite,
+# e o histórico dos últimos meses
+def budget_panel(summary, budgets):
+    periods = pd.period_range(end=datetime.now().date(), periods=12, freq="M")
+    history = list(periods.year * 100 + periods.month)
+    current = history[-1]
+    report = budget_report(summary, budgets, history)
+    month = report[report["Mês"] == current].sort_values("Uso", ascending=False)
+
+    st.header("Orçamentos do Mês")
+    for row in month.to_dict("records"):
+        if row["Uso"] > 1:
+            st.error(f"{row['Categoria']}: {format_brl(row['Gasto'])} gastos, acima do orçamento de {format_brl(row['Orçamento'])}.")
+        elif row["Uso"] >= BUDGET_WARNING_RATIO:
+            st.warning(f"{row['Categoria']}: {row['Uso']:.0%} do orçamento de {format_brl(row['Orçamento'])} já usado.")
+    columns = st.columns(min(len(month), 4))
+    for number, row in enumerate(month.to_dict("records")):
+        with columns[number % len(columns)]:
+            st.progress(min(row["Uso"], 1.0), text=f"{row['Categoria']}: {format_brl(row['Gasto'])} de {format_brl(row['Orçamento'])}")
+    with st.expander("Histórico dos orçamentos"):
+        usage = report.pivot(index="Mês", columns="Categoria", values="Uso").sort_index(ascending=False) * 100
+        usage.index = [f"{month % 100:02d}/{month // 100}" for month in usage.index]
+        st.dataframe(usage, column_config={
+            category: st.column_config.NumberColumn(format="%.0f%%") for category in usage.columns
+        })
+
+LEDGER_PAGE_SIZES = [25, 50, 100, 200]
+
+# Volta para a primeira página quando a busca, o filtro ou a ordenação mudam
+def reset_ledger_page(ledger):
+    st.session_state[f"{ledger}_page"] = 1
+
+# Tabela paginada e editável de um extrato. O estado da visão (página, ordenação, busca e
+# filtro) fica no session_state pelas chaves dos widgets; só a página visível é enviada
+# ao navegador e comparada com a edição.
+def ledger_table(fm, ledger, editor_prefix, toast_message):
+    entries = fm.expenses if ledger == "expenses" else fm.monthly_savings
+    category_column = next(name for name, kind in entries.schema.items() if kind == "category")
+    columns = [name for name in entries.schema if name not in (entries.id_column, entries.key_column)]
+
+    search_col, filter_col, sort_col, order_col = st.columns([3, 3, 2, 2])
+    search = search_col.text_input(
+        "Buscar", key=f"{ledger}_search", on_change=reset_ledger_page, args=(ledger,)
+    ).strip()
+    labels = filter_col.multiselect(
+        category_column, entries.labels(category_column), key=f"{ledger}_filter",
+        on_change=reset_ledger_page, args=(ledger,)
+    )
+    sort_by = sort_col.selectbox(
+        "Ordenar por", columns, key=f"{ledger}_sort", on_change=reset_ledger_page, args=(ledger,)
+    )
+    descending = order_col.selectbox(
+        "Ordem", ["Decrescente", "Crescente"], key=f"{ledger}_order", on_change=reset_ledger_page, args=(ledger,)
+    ) == "Decrescente"
+
+    page_size = st.session_state.get(f"{ledger}_page_size", LEDGER_PAGE_SIZES[1])
+    page = st.session_state.get(f"{ledger}_page", 1)
+    page_df, total = fm.get_ledger_page(ledger, page, page_size, sort_by, descending, search, tuple(labels))
+    pages = max(1, -(-total // page_size))
+    if page > pages:
+        page = st.session_state[f"{ledger}_page"] = pages
+        page_df, total = fm.get_ledger_page(ledger, page, page_size, sort_by, descending, search, tuple(labels))
+
+    # A chave muda com a visão: o estado de edição de uma página não vaza para outra
+    version = st.session_state[f"{editor_prefix}_version"]
+    view = (page, page_size, sort_by, descending, search, tuple(labels))
+    editor_key = f"{editor_prefix}_{version}_{abs(hash(view))}"
+    # A chave vai como texto (inteiros de 62 bits não passam exatos pelo navegador) e fica
+    # oculta; o ID só numera as linhas e não é editável
+    page_df[entries.key_column] = page_df[entries.key_column].astype(str)
+    edited_df = st.data_editor(
+        page_df, num_rows="dynamic", key=editor_key,
+        column_config={
+            "Data": st.column_config.DateColumn("Data", format="DD/MM/YYYY"),
+            entries.id_column: st.column_config.NumberColumn(entries.id_column, disabled=True),
+            entries.key_column: None,
+        }
+    )
+
+    page_col, size_col, info_col = st.columns([2, 2, 6])
+    page_col.number_input("Página", min_value=1, max_value=pages, step=1, key=f"{ledger}_page")
+    size_col.selectbox(
+        "Linhas por página", LEDGER_PAGE_SIZES, index=1, key=f"{ledger}_page_size", on_change=reset_ledger_page, args=(ledger,)
+    )
+    info_col.caption(f"Página {page} de {pages} · {total} registros")
+
+    # Verificar se houve alterações e aplicar apenas as linhas modificadas da página
+    if editor_has_changes(editor_key):
+        changes = fm.apply_editor_diff(page_df, edited_df, ledger=ledger)
+        if any(changes.values()):
+            st.toast(toast_message)
+        # Inclusões e remoções mudam as posições da tabela: o editor é recriado
+        if changes["added"] or changes["deleted"]:
+            st.session_state[f"{editor_prefix}_version"] += 1
+            st.rerun()
+
+# Tabelas de lançamentos (despesas e entradas) com as exportações
+@instrumented("ui.ledger_tables")
+def ledger_tables(fm):
+    # Exibição e edição das despesas
+    col3, col4 = st.columns(2)
+    with col3:
+        st.header("Lista de Despesas")
+        if len(fm.expenses):
+            ledger_table(fm, "expenses", "expense_editor", "Despesas atualizadas com sucesso!")
+        else:
+            st.info("Nenhuma despesa registrada ainda.")
+
+        # Exportar dados
+        if len(fm.expenses):
+            export_controls(fm, "expenses", "Exportar despesas", "despesas")
+
+    with col4:
+        # Exibição e edição das economias mensais
+        st.header("Lista de Entradas Mensais")
+        if len(fm.monthly_savings):
+            ledger_table(fm, "savings", "savings_editor", "Entradas mensais atualizadas com sucesso!")
+        else:
+            st.info("Nenhuma entrada registrada ainda.")
+
+        if len(fm.monthly_savings):
+            export_controls(fm, "savings", "Exportar entradas mensais", "entradas_mensais")
+
+# Agrupamento de cada gráfico, para saber se os resumos mensais respondem ao filtro
+CHART_GROUPS = {"Gastos por Categoria": "Categoria", "Gastos por Estabelecimento": "Estabelecimento", "Gastos Mensais": "Mês"}
+
+# Esqueleto do painel exibido enquanto os dados do login chegam
+def render_dashboard_skeleton():
+    st.title("Minha gestão financeira 💰")
+    st.header("Resumo Financeiro")
+    for column, label in zip(st.columns(3), ("Total de Gastos", "Total de Entradas", "Saldo")):
+        column.metric(label, "R$ …")
+    with st.spinner("Carregando seus dados..."), METRICS.span("load.summary_wait"):
+        st.session_state.user_data_loading["summary"].result()
+
+# Gráficos da "Análise de Gastos". Ficam em cache por (usuário, versão do extrato,
+# tipo de gráfico), compartilhado entre sessões e limitado em tamanho e tempo de vida.
+# Parâmetros iniciados com "_" não entram na chave do cache.
+@st.cache_data(max_entries=256, ttl=3600, show_spinner=False)
+def expense_chart(user_id, ledger_token, version, chart_type, start, end, categories, _fm):
+    # O plotly só é carregado quando a análise é exibida
+    with METRICS.span("chart.import_plotly"):
+        import plotly.express as px
+
+    if chart_type == "Gastos por Categoria":
+        data = _fm.get_expenses_by_category(start, end, categories)
+        #fig = px.pie(data, values='Valor', names='Categoria', title='Gastos por Categoria')
+        fig = px.bar(data, x='Valor', y='Categoria', orientation='h', text='Valor', title='Gastos por Categoria')
+        fig.update_traces(texttemplate='%{text:.2s}', textposition='outside')
+        fig.update_layout(uniformtext_minsize=8, uniformtext_mode='hide')
+
+    elif chart_type == "Gastos por Estabelecimento":
+        data = _fm.get_expenses_by_establishment(start, end, categories)
+        fig = px.bar(data, x='Estabelecimento', y='Valor', title='Gastos por Estabelecimento')
+
+    else:
+        data = _fm.get_expenses_by_month(start, end, categories)
+        fig = px.bar(data, x='Mês', y='Valor', text='Valor', title='Gastos Mensais')
+        fig.update_traces(texttemplate='%{text:.2s}', textposition='outside')
+        fig.update_layout(uniformtext_minsize=8, uniformtext_mode='hide')
+        fig.update_xaxes(dtick="M1", tickformat="%b %Y")
+
+    return fig
+
+# Gráfico de um período que corta meses (os resumos mensais não respondem) sem o extrato
+# carregado: o banco filtra e soma só as despesas do período. Se a consulta falhar (no
+# Firebase, sem ".indexOn": ["Data"] nas regras), o extrato é carregado e filtrado na memória.
+def stored_expense_chart(user_id, revision, chart_type, start, end, categories, load_finance_manager):
+    try:
+        return expense_chart(
+            user_id, "store", revision, chart_type, start, end, categories,
+            StoredExpenseQueries(get_ledger_store(), user_id)
+        )
+    except Exception:
+        STORE_LOGGER.warning("Consulta do período falhou; usando o extrato em memória", exc_info=True)
+    fm = load_finance_manager()
+    return expense_chart(fm.user_id, fm.ledger_token, fm.version, chart_type, start, end, categories, fm)
+
+# Grava os blocos do extrato no formato escolhido. Cada bloco é serializado e descartado
+# em seguida, então a memória extra fica limitada ao tamanho do arquivo gerado.
+@instrumented("export.write")
+def write_export(chunks, file_format):
+    buffer = io.BytesIO()
+    if file_format == "CSV":
+        for number, chunk in enumerate(chunks):
+            buffer.write(chunk.to_csv(index=False, header=number == 0).encode('utf-8'))
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(buffer, table.schema, compression="zstd")
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+    return buffer.getvalue()
+
+# Botões de exportação: o arquivo só é gerado após o clique em "Gerar arquivo" e o botão de
+# download só aparece nessa execução. Nada fica na sessão: o Streamlit guarda o arquivo
+# (um por botão) enquanto o botão está na tela, e o próximo rerun o libera.
+def export_controls(fm, ledger, label, file_stem):
+    format_col, button_col = st.columns(2)
+    file_format = format_col.selectbox(
+        "Formato", list(EXPORT_FORMATS), key=f"{ledger}_export_format", label_visibility="collapsed"
+    )
+    if not button_col.button("Gerar arquivo", key=f"{ledger}_export_button"):
+        return
+    with st.spinner("Gerando arquivo..."):
+        data = write_export(fm.iter_ledger_chunks(ledger), file_format)
+    extension, mime = EXPORT_FORMATS[file_format]
+    st.download_button(
+        label=f"{label} como {file_format}",
+        data=data,
+        file_name=f"{file_stem}.{extension}",
+        mime=mime,
+    )
+
+# Resume o rastro de uma execução: tempo, chamadas e linhas por span e as chamadas
+# e bytes do Firebase feitos pela thread do script
+def summarize_trace(trace, counts):
+    spans = {}
+    for entry in trace:
+        totals = spans.setdefault(entry["span"], {"calls": 0, "seconds": 0.0, "rows": 0})
+        totals["calls"] += 1
+        totals["seconds"] += entry["seconds"]
+        totals["rows"] += entry["rows"] or 0
+    firebase = {}
+    for (metric, label), total in counts.items():
+        if metric == "gestor_firebase_calls_total":
+            firebase[label] = total
+        elif metric == "gestor_firebase_bytes_total":
+            firebase[f"bytes_{label}"] = total
+    return spans, firebase
+
+# Mede uma execução completa do script (rerun). O resumo fica na sessão, para o painel
+# de desempenho, e é registrado como uma linha de log em JSON.
+@contextmanager
+def measure_rerun():
+    if not METRICS.enabled:
+        yield
+        return
+    started = time.perf_counter()
+    with METRICS.trace() as (trace, counts):
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            spans, firebase = summarize_trace(trace, counts)
+            METRICS.record("rerun", seconds)
+            last_rerun = {"event": "rerun", "user_id": st.session_state.get("user_id"),
+                          "seconds": seconds, "spans": spans, "firebase": firebase}
+            st.session_state.metrics_last_rerun = last_rerun
+            if METRICS_LOGGER.isEnabledFor(logging.INFO):
+                METRICS_LOGGER.info(json.dumps(last_rerun))
+
+# Tabela de spans para o painel de desempenho, do mais demorado para o mais rápido
+def spans_frame(spans):
+    rows = [
+        {"Trecho": name, "Chamadas": calls, "Total (ms)": seconds * 1000,
+         "Média (ms)": seconds * 1000 / calls, "Linhas": rows}
+        for name, (calls, seconds, rows) in spans.items()
+    ]
+    return pd.DataFrame(rows, columns=["Trecho", "Chamadas", "Total (ms)", "Média (ms)", "Linhas"]).sort_values(
+        "Total (ms)", ascending=False, ignore_index=True
+    )
+
+# Painel de desempenho na barra lateral, visível só para os e-mails em [metrics] admins
+def metrics_panel():
+    if not METRICS.enabled or st.session_state.get("user_email") not in METRICS.admins:
+        return
+    with st.sidebar.expander("Desempenho", expanded=False):
+        last_rerun = st.session_state.get("metrics_last_rerun")
+        if last_rerun:
+            st.caption(f"Execução anterior: {last_rerun['seconds'] * 1000:.0f} ms")
+            st.dataframe(spans_frame({
+                name: (totals["calls"], totals["seconds"], totals["rows"])
+                for name, totals in last_rerun["spans"].items()
+            }), hide_index=True)
+            if last_rerun["firebase"]:
+                st.caption("Firebase: " + ", ".join(f"{label} {total}" for label, total in sorted(last_rerun["firebase"].items())))
+        spans, counters = METRICS.snapshot()
+        st.caption("Totais do processo")
+        st.dataframe(spans_frame({name: (calls, seconds, rows) for name, (calls, seconds, _, rows) in spans.items()}),
+                     hide_index=True)
+        st.download_button(
+            label="Baixar métricas (Prometheus)",
+            data=METRICS.prometheus_text(),
+            file_name="metricas.txt",
+            mime="text/plain",
+        )
+        if st.button("Zerar métricas"):
+            METRICS.reset()
+
 # Função de login
 def login():
     st.title("Acesse agora seu Gestor Financeiro Pessoal")
@@ -296,42 +3198,12 @@ def login():
                 st.success(f"Bem-vindo, {user.display_name or user.email}! Aguarde enquanto carregamos os seus dados.")
                 st.session_state.logged_in = True
                 st.session_state.user_id = user.uid  # Atribui o user_id corretamente
+                st.session_state.user_email = user.email
 
-                # Verifique se o dataframe expenses_df já existe no session_state
-                if 'expenses_df' not in st.session_state:
-                    # Inicialize o dataframe (pode ser um vazio ou algum valor padrão)
-                    st.session_state.expenses_df = pd.DataFrame()
-                
-                # Carregar as despesas e economias do Firebase após o login
-                expenses_df = load_expenses_from_firebase(st.session_state.user_id)
-                if not expenses_df.empty:
-                    st.session_state.expenses_df = expenses_df
-                    
-                # Verifique se o dataframe savings_df já existe no session_state
-                if 'savings_df' not in st.session_state:
-                    # Inicialize o dataframe (pode ser um vazio ou algum valor padrão)
-                    st.session_state.savings_df = pd.DataFrame()
-                
-                # Carregar as despesas e economias do Firebase após o login
-                savings_df = load_savings_from_firebase(st.session_state.user_id)
-                if not savings_df.empty:
-                    st.session_state.savings_df = savings_df
-
-                # Inicializa o FinanceManager se ainda não existir
+                # Despesas, entradas e importações são carregadas em segundo plano;
+                # o painel abre com um esqueleto até os dados chegarem
                 if st.session_state.finance_manager is None:
-                    st.session_state.finance_manager = FinanceManager(st.session_state.user_id)
-
-                    # Preencher o FinanceManager com as despesas carregadas do Firebase
-                    for _, row in st.session_state.expenses_df.iterrows():
-                        st.session_state.finance_manager.add_expense(
-                            row['Estabelecimento'], row['Categoria'], row['Valor'], pd.to_datetime(row['Data']).date()
-                        )
-                        
-                    # Preencher o FinanceManager com as despesas carregadas do Firebase
-                    for _, row in st.session_state.savings_df.iterrows():
-                        st.session_state.finance_manager.add_monthly_savings(
-                            row['Tipo Entrada'], row['Valor'], pd.to_datetime(row['Data']).date()
-                        )
+                    st.session_state.user_data_loading = start_loading_user_data(st.session_state.user_id)
 
                 st.rerun()  # Recarrega a página para atualizar o estado
             else:
@@ -363,40 +3235,48 @@ def main():
         st.session_state.csv_processed = False
     if 'last_uploaded_file' not in st.session_state:
         st.session_state.last_uploaded_file = None
+    if 'expense_editor_version' not in st.session_state:
+        st.session_state.expense_editor_version = 0
+    if 'savings_editor_version' not in st.session_state:
+        st.session_state.savings_editor_version = 0
 
     if not st.session_state.logged_in:
         login()
         return 
 
-    # Certifique-se de que o FinanceManager está inicializado
-    if st.session_state.finance_manager is None:
-        st.session_state.finance_manager = FinanceManager(st.session_state.user_id)
-        
-    if st.session_state.logged_in:
-        if st.session_state.finance_manager is None:
-            st.session_state.finance_manager = FinanceManager(st.session_state.user_id)
-            if 'expenses_df' in st.session_state and not st.session_state.expenses_df.empty:
-                for _, row in st.session_state.expenses_df.iterrows():
-                    st.session_state.finance_manager.add_expense(
-                        row['Estabelecimento'], row['Categoria'], row['Valor'], pd.to_datetime(row['Data']).date()
-                    )
-    
-    fm = st.session_state.finance_manager
+    # Aguarda o resumo pedido no login, mostrando o esqueleto do painel
+    if st.session_state.finance_manager is None and 'user_data_loading' in st.session_state:
+        skeleton = st.empty()
+        with skeleton.container():
+            render_dashboard_skeleton()
+        (st.session_state.rollups, st.session_state.rollup_revision,
+         st.session_state.recurring_rules, st.session_state.budgets) = finish_loading_user_data(
+            st.session_state.pop('user_data_loading')
+        )
+        skeleton.empty()
+        materialize_due_rules()
+
+    # Tarefas em segundo plano que terminaram desde a última execução
+    finish_jobs()
 
     # Sidebar para configurações e adição de despesas
     st.sidebar.title("Cadastro financeiro")
+    jobs_container = st.sidebar.container()
 
     # Expander para "Adicionar Nova Despesa"
     with st.sidebar.expander("Adicionar Nova Despesa", expanded=False):
         st.subheader("Adicionar Nova Despesa")
         establishment = st.text_input("Estabelecimento")
-        category = st.selectbox("Categoria", ["Alimentação", "Transporte", "Custo Fixo", "Saúde", "Educação", "Lazer", "Restaurante", "Outros"])
+        category = st.selectbox("Categoria", EXPENSE_CATEGORIES)
         value = st.number_input("Valor da Despesa", min_value=0.0, step=0.1, format="%.1f")
         date = st.date_input("Data da Despesa")
 
         if st.button("Adicionar Despesa"):
-            message = fm.add_expense(establishment, category, value, date)
-            st.success(message)
+            if not establishment.strip():
+                st.error("Informe o estabelecimento.")
+            else:
+                message = require_finance_manager().add_expense(establishment.strip(), category, value, date)
+                st.success(message)
 
     # Expander para "Upload de Despesas via CSV"
     with st.sidebar.expander("Upload de Despesas via CSV", expanded=False):
@@ -407,33 +3287,112 @@ def main():
             # Verifica se o arquivo atual é diferente do último arquivo processado
             if uploaded_file != st.session_state.last_uploaded_file:
                 st.session_state.csv_processed = False  # Permite novo processamento
-                
-            # Processa o CSV
+
+            # O arquivo é lido em uma tarefa em segundo plano; as despesas entram no extrato
+            # quando ela termina, em uma execução seguinte
             if not st.session_state.csv_processed:
-                csv_content = uploaded_file.read()
-                message = fm.add_expenses_from_csv(csv_content)
-                
-                if "Erro" in message:
-                    st.error(message)
-                else:
-                    st.success(message)
-                    st.session_state.csv_processed = True
-                    st.session_state.last_uploaded_file = uploaded_file  # Armazena o último arquivo
-                    del uploaded_file  # Remove o arquivo do backend
-            
-            elif st.session_state.csv_processed:
-                st.info("O arquivo CSV já foi processado. Para adicionar novas despesas, faça um novo upload.")           
+                start_csv_import(require_finance_manager(), uploaded_file)
+                st.session_state.csv_processed = True
+                st.session_state.last_uploaded_file = uploaded_file
+
+            if f"import:{uploaded_file.file_id}" in st.session_state.get('jobs', {}):
+                st.info("Importando despesas. Você pode continuar usando o app enquanto isso.")
+            elif 'import_report' not in st.session_state:
+                st.info("O arquivo CSV já foi processado. Para adicionar novas despesas, faça um novo upload.")
+
+        # Resultado da importação concluída em segundo plano
+        report = st.session_state.pop('import_report', None)
+        if report is not None:
+            if report.failed:
+                st.error(report.message)
+            elif report.duplicate_file:
+                st.info(report.message)
+            else:
+                st.success(report.message)
+
+        # Relatório das linhas rejeitadas na última importação
+        report = st.session_state.get('last_import_report')
+        if report is not None and report.rejected:
+            st.warning(f"{report.rejected_count()} linhas do CSV foram rejeitadas.")
+            st.download_button(
+                label="Baixar relatório de erros",
+                data=report.errors_csv(),
+                file_name="erros_importacao.csv",
+                mime="text/csv",
+            )
     
     # Expander para "Adicionar Entrada Mensal"
     with st.sidebar.expander("Adicionar Entrada Mensal", expanded=False):
         st.subheader("Entrada Mensal")
-        savings_type = st.selectbox("Tipo Entrada", ["Salário", "Bônus", "Extra", "Décimo Terceiro", "FGTS"])
+        savings_type = st.selectbox("Tipo Entrada", SAVINGS_TYPES)
         savings_value = st.number_input("Valor da Entrada", min_value=0.0, step=10.0, format="%.2f")
         savings_date = st.date_input("Data da Entrada")
         if st.button("Adicionar Entrada"):
-            message = fm.add_monthly_savings(savings_type, savings_value, savings_date)
+            message = require_finance_manager().add_monthly_savings(savings_type, savings_value, savings_date)
+            st.success(message)
+
+    # Expander para "Lançamentos recorrentes" (custos fixos, salário etc.)
+    with st.sidebar.expander("Lançamentos recorrentes", expanded=False):
+        st.subheader("Nova Regra Recorrente")
+        rule_kind = st.radio("Tipo", RECURRING_KINDS, horizontal=True, key="rule_kind")
+        if rule_kind == "Despesa":
+            rule_description = st.text_input("Estabelecimento", key="rule_description")
+            rule_category = st.selectbox("Categoria", EXPENSE_CATEGORIES, index=EXPENSE_CATEGORIES.index("Custo Fixo"), key="rule_category")
+        else:
+            rule_description = st.selectbox("Tipo Entrada", SAVINGS_TYPES, key="rule_savings_type")
+            rule_category = None
+        rule_value = st.number_input("Valor", min_value=0.0, step=10.0, format="%.2f", key="rule_value")
+        rule_frequency = st.selectbox("Frequência", RECURRING_FREQUENCIES, key="rule_frequency")
+        rule_start = st.date_input("Início", key="rule_start", format="DD/MM/YYYY")
+        rule_end = st.date_input("Fim (opcional)", value=None, key="rule_end", format="DD/MM/YYYY")
+        if st.button("Adicionar Regra"):
+            message = require_finance_manager().add_recurring_rule(
+                rule_kind, rule_description, rule_category, rule_value, rule_frequency, rule_start, rule_end
+            )
             st.success(message)
 
+        rules = st.session_state.get('recurring_rules') or {}
+        if rules:
+            st.subheader("Regras Cadastradas")
+            st.selectbox(
+                "Regra", list(rules), format_func=lambda rule_key: rule_label(rules[rule_key]), key="rule_selected"
+            )
+            st.button("Remover Regra", on_click=remove_selected_rule)
+        if 'rule_message' in st.session_state:
+            st.success(st.session_state.pop('rule_message'))
+
+    # Expander para "Orçamentos mensais" por categoria
+    with st.sidebar.expander("Orçamentos mensais", expanded=False):
+        budgets = st.session_state.get('budgets') or {}
+        budget_category = st.selectbox("Categoria", EXPENSE_CATEGORIES, key="budget_category")
+        budget_value = st.number_input(
+            "Limite mensal (0 remove)", min_value=0.0, step=50.0, format="%.2f",
+            value=budgets.get(budget_category, 0) / 100, key=f"budget_value_{budget_category}"
+        )
+        if st.button("Salvar Orçamento"):
+            message = save_budget(budget_category, budget_value)
+            if message:
+                st.success(message)
+
+    # Filtros dos gráficos: período e categorias
+    summary = dashboard_summary()
+    start, end, categories = None, None, ()
+    # Com o extrato carregado o período vai da primeira à última despesa, pelo índice de
+    # datas; só com os resumos mensais, do início do primeiro mês ao fim do último
+    fm = st.session_state.finance_manager
+    first_date, last_date = fm.get_expense_date_bounds() if fm is not None else summary.date_bounds()
+    if first_date is not None:
+        with st.sidebar.expander("Filtros da análise", expanded=False):
+            date_range = st.date_input(
+                "Período", value=(first_date, last_date), min_value=first_date, max_value=last_date,
+                format="DD/MM/YYYY"
+            )
+            selected = st.multiselect("Categorias", summary.category_labels())
+            # Enquanto o usuário escolhe o período, o date_input devolve só a data inicial
+            if len(date_range) == 2 and tuple(date_range) != (first_date, last_date):
+                start, end = date_range
+            categories = tuple(sorted(selected))
+
     # Conteúdo principal
     st.title("Minha gestão financeira 💰")
 
@@ -441,89 +3400,50 @@ def main():
     st.header("Resumo Financeiro")
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Total de Gastos", f"R$ {fm.get_total_expenses():,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+        st.metric("Total de Gastos", format_brl(summary.get_total_expenses()))
     with col2:
-        st.metric("Total de Entradas", f"R$ {fm.get_total_savings():,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
-    with col3:
-        st.metric("Saldo", f"R$ {(fm.get_total_savings() - fm.get_total_expenses()):,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
-
-    # Exibição e edição das despesas
-    col3, col4 = st.columns(2)
+        st.metric("Total de Entradas", format_brl(summary.get_total_savings()))
     with col3:
-        st.header("Lista de Despesas")
-        expenses_df = fm.get_expenses_df()
-        if not expenses_df.empty:
-            edited_expenses_df = st.data_editor(expenses_df, num_rows="dynamic", key="expense_editor")            
-
-            # Verificar se houve alterações e atualizar as despesas
-            if not edited_expenses_df.equals(expenses_df):
-                for index, row in edited_expenses_df.iterrows():
-                    fm.edit_expense(row['ID'], row['Estabelecimento'], row['Categoria'], row['Valor'], row['Data'])
-                st.success("Despesas atualizadas com sucesso!")
-        else:
-            st.info("Nenhuma despesa registrada ainda.")
+        st.metric("Saldo", format_brl(summary.get_total_savings() - summary.get_total_expenses()))
 
-        # Exportar dados
-        if not expenses_df.empty:
-            st.download_button(
-                label="Exportar despesas como CSV",
-                data=expenses_df.to_csv(index=False).encode('utf-8'),
-                file_name="despesas.csv",
-                mime="text/csv",
-            )
+    # Orçamentos do mês e alertas
+    budgets = st.session_state.get('budgets')
+    if budgets:
+        budget_panel(summary, budgets)
 
-    with col4:
-        # Exibição e edição das economias mensais
-        st.header("Lista de Entradas Mensais")
-        savings_df = fm.get_savings_df()
-        if not savings_df.empty:
-            edited_savings_df = st.data_editor(savings_df, num_rows="dynamic", key="savings_editor")
-
-            # Verificar se houve alterações e atualizar as economias mensais
-            if not edited_savings_df.equals(savings_df):
-                for index, row in edited_savings_df.iterrows():
-                    fm.edit_monthly_savings(row['ID'], row['Valor'], row['Data'])
-                st.success("Entradas mensais atualizadas com sucesso!")
+    # O extrato completo só é carregado quando as tabelas de lançamentos são abertas
+    show_ledger = st.toggle("Exibir lançamentos", key="show_ledger")
+    if show_ledger:
+        if st.session_state.finance_manager is None:
+            start_loading_finance_manager()
+            st.info("Carregando lançamentos...")
         else:
-            st.info("Nenhuma entrada registrada ainda.")
-
-        if not savings_df.empty:
-            st.download_button(
-                label="Exportar entradas mensais como CSV",
-                data=savings_df.to_csv(index=False).encode('utf-8'),
-                file_name="entradas_mensais.csv",
-                mime="text/csv",
-            )           
+            ledger_tables(st.session_state.finance_manager)
 
     # Gráficos interativos
     st.header("Análise de Gastos")
 
-    if not expenses_df.empty:
-        # Preparar dados
-        expenses_df['Data'] = pd.to_datetime(expenses_df['Data'])
-        expenses_df['Ano'] = expenses_df['Data'].dt.year
-        expenses_df['Mês'] = expenses_df['Data'].dt.strftime('%B')
-
+    if summary.by_month:
         # Seleção do tipo de gráfico
         chart_type = st.selectbox("Selecione o tipo de análise:", 
                                   ["Gastos por Categoria", "Gastos por Estabelecimento", "Gastos Mensais"])
 
-        if chart_type == "Gastos por Categoria":
-            data = expenses_df.groupby('Categoria')['Valor'].sum().reset_index()
-            #fig = px.pie(data, values='Valor', names='Categoria', title='Gastos por Categoria')
-            fig = px.bar(data, x='Valor', y='Categoria', orientation='h', text='Valor', title='Gastos por Categoria')
-            fig.update_traces(texttemplate='%{text:.2s}', textposition='outside')
-            fig.update_layout(uniformtext_minsize=8, uniformtext_mode='hide')
-
-        elif chart_type == "Gastos por Estabelecimento":
-            data = expenses_df.groupby('Estabelecimento')['Valor'].sum().reset_index().sort_values('Valor', ascending=False)
-            fig = px.bar(data, x='Estabelecimento', y='Valor', title='Gastos por Estabelecimento')
+        fm = st.session_state.finance_manager
 
-        else: 
-            data = expenses_df.groupby('Mês')['Valor'].sum().reset_index()
-            fig = px.bar(data, x='Mês', y='Valor', text='Valor', title='Gastos Mensais')
-            fig.update_traces(texttemplate='%{text:.2s}', textposition='outside')
-            fig.update_layout(uniformtext_minsize=8, uniformtext_mode='hide')
+        # O gráfico só é recalculado quando o extrato ou os filtros mudam
+        with METRICS.span("chart.build"):
+            if fm is not None:
+                fig = expense_chart(fm.user_id, fm.ledger_token, fm.version, chart_type, start, end, categories, fm)
+            elif summary.covers(start, end, categories, CHART_GROUPS[chart_type]):
+                fig = expense_chart(
+                    st.session_state.user_id, "rollups", st.session_state.rollup_revision,
+                    chart_type, start, end, categories, summary
+                )
+            else:
+                fig = stored_expense_chart(
+                    st.session_state.user_id, st.session_state.rollup_revision,
+                    chart_type, start, end, categories, require_finance_manager
+                )
 
         # Ajustar o tema do gráfico
         fig.update_layout(
@@ -532,7 +3452,8 @@ def main():
             paper_bgcolor='rgba(0,0,0,0)'
         )
 
-        st.plotly_chart(fig, use_container_width=True)
+        with METRICS.span("chart.render"):
+            st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("Adicione despesas para ver os gráficos.")
     
@@ -556,6 +3477,20 @@ def main():
             </style>
         """, unsafe_allow_html=True)
         
+    # Grava em segundo plano as alterações que ainda estão pendentes nesta execução
+    fm = st.session_state.finance_manager
+    if fm is not None:
+        fm.request_flush()
+        if fm.save_error is not None:
+            st.sidebar.warning(f"Não foi possível salvar as últimas alterações ({fm.save_error}). Uma nova tentativa será feita.")
+
+    # Progresso das tarefas em andamento, no topo da barra lateral
+    if st.session_state.get('jobs'):
+        with jobs_container:
+            job_progress()
+
+    metrics_panel()
+
     # Add a logout button
     if st.sidebar.button("Logout"):
         st.session_state.logged_in = False
@@ -565,4 +3500,5 @@ def main():
         
 # Run the app
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with measure_rerun():
+        main()
\ No newline at end of file
@@ -0,0 +1,147 @@
+# Benchmark dos caminhos principais do FinanceManager e da persistência, com extratos
+# sintéticos de 1 mil a 1 milhão de linhas e o Firebase substituído pelo banco em memória
+# (benchmarks/fake_firebase.py), que conta chamadas e bytes. O resultado sai em JSON
+# para comparar execuções e encontrar regressões.
+#
+# Uso:
+#   python benchmarks/bench_ledger.py                          # 1k, 10k e 100k linhas
+#   python benchmarks/bench_ledger.py --sizes 1000,1000000 --repeat 1 --output resultado.json
+#   python benchmarks/bench_ledger.py --backend sqlite
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import fake_firebase
+from synthetic import synthetic_csv, synthetic_savings
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+# Executa a ação "repeat" vezes (com um estado novo de setup a cada vez) e guarda o
+# melhor tempo e os contadores do banco da última execução
+def measure(database, action, setup=None, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        database.reset_counters()
+        started = time.perf_counter()
+        action(state) if setup else action()
+        timings.append(time.perf_counter() - started)
+    return {"seconds": min(timings), "runs": timings, **database.counters()}
+
+
+def bench_size(app, database, store, rows, repeat):
+    user_id = f"bench-{rows}"
+    csv_bytes = synthetic_csv(rows)
+    savings = synthetic_savings(max(1, rows // 20))
+    phases = {}
+
+    # Importação do CSV, cada vez em um usuário novo e vazio
+    import_users = itertools.count()
+    def fresh_user():
+        return app.FinanceManager(f"{user_id}-import-{next(import_users)}")
+    phases["csv_import"] = measure(database, lambda fm: fm.add_expenses_from_csv(csv_bytes), fresh_user, repeat)
+    database.root.clear()
+
+    # Estado final usado pelas demais fases: despesas do CSV e entradas, gravadas
+    fm = app.FinanceManager(user_id)
+    fm.add_expenses_from_csv(csv_bytes)
+    with fm.batch():
+        for row in savings.itertuples(index=False):
+            fm.add_monthly_savings(row[1], row[3], datetime.date.fromisoformat(row[2]))
+
+    # Login: só o resumo mensal, o extrato completo e o extrato com o cache local em disco
+    phases["login_summary"] = measure(
+        database, lambda: app.LedgerAggregates.from_documents(app.fetch_summary(store, user_id)[1]), repeat=repeat
+    )
+    phases["login_hydration"] = measure(database, lambda: app.load_finance_manager(user_id), repeat=repeat)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = app.LedgerCache(directory)
+        app.fetch_ledgers(store, cache, user_id)
+        phases["login_hydration_cached"] = measure(
+            database, lambda: app.FinanceManager.from_frames(user_id, *app.fetch_ledgers(store, cache, user_id)),
+            repeat=repeat
+        )
+
+    fm, _ = app.load_finance_manager(user_id)
+    phases["get_expenses_df"] = measure(database, fm.get_expenses_df, repeat=repeat)
+    phases["ledger_page"] = measure(
+        database, lambda: fm.get_ledger_page("expenses", 2, 50, "Valor", True, "loja 1", ()), repeat=repeat
+    )
+
+    # Edição de uma página da tabela: 5 valores alterados e 1 linha removida, com a gravação
+    def edited_page():
+        page_df, _ = fm.get_ledger_page("expenses", 1, 50, "Data", True)
+        edited_df = page_df.copy()
+        edited_df.loc[edited_df.index[:5], "Valor"] += 1
+        return page_df, edited_df.drop(edited_df.index[5])
+    phases["editor_diff_apply"] = measure(
+        database, lambda frames: fm.apply_editor_diff(*frames), edited_page, repeat
+    )
+
+    # Gráficos: sem filtro e com meses inteiros (resumos) e com período que corta meses (extrato)
+    whole_months = (datetime.date(2021, 1, 1), datetime.date(2022, 12, 31))
+    partial = (datetime.date(2021, 1, 15), datetime.date(2022, 12, 15))
+    for name, period in (("all", (None, None)), ("whole_months", whole_months), ("partial_months", partial)):
+        phases[f"charts_{name}"] = measure(database, lambda period=period: (
+            fm.get_expenses_by_category(*period),
+            fm.get_expenses_by_establishment(*period),
+            fm.get_expenses_by_month(*period),
+        ), repeat=repeat)
+
+    # Gravação de 1.000 inclusões em lote e leitura do extrato de despesas
+    def add_and_flush():
+        with fm.batch():
+            for number in range(1_000):
+                fm.add_expense(f"Loja {number}", "Lazer", 10.0, datetime.date(2024, 1, 1 + number % 28))
+    phases["save_1000_records"] = measure(database, add_and_flush, repeat=repeat)
+    phases["load_expenses"] = measure(database, lambda: store.load_ledger(user_id, "expenses"), repeat=repeat)
+
+    return {"rows": rows, "phases": phases, "aggregates_match": fm.aggregates_match_ledger()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do FinanceManager e da persistência")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="tamanhos separados por vírgula")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--backend", choices=["firebase", "sqlite"], default="firebase")
+    parser.add_argument("--output", help="arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    os.environ["LEDGER_BACKEND"] = args.backend
+    os.environ["LEDGER_SQLITE_PATH"] = ":memory:"
+    os.environ["LEDGER_CACHE_DIR"] = ""
+    database = fake_firebase.install()
+    import app
+
+    store = app.get_ledger_store()
+    results = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "backend": args.backend,
+        "repeat": args.repeat,
+        "sizes": [],
+    }
+    for rows in (int(size) for size in args.sizes.split(",")):
+        print(f"{rows} linhas...", file=sys.stderr)
+        results["sizes"].append(bench_size(app, database, store, rows, args.repeat))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# Substituto em memória do firebase_admin para os benchmarks.
+#
+# A árvore do Realtime Database fica em um dict. Toda leitura e gravação passa por
+# JSON, como no cliente real, e o banco conta as chamadas e os bytes trafegados em
+# cada direção. O auth aceita os usuários cadastrados com add_user, sem senha.
+import json
+import threading
+from collections import Counter
+from types import SimpleNamespace
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.root = {}
+        self.users = {}
+        self.lock = threading.Lock()
+        self.reset_counters()
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls = Counter()
+            self.bytes_read = 0
+            self.bytes_written = 0
+
+    def counters(self):
+        return {"calls": dict(self.calls), "bytes_read": self.bytes_read, "bytes_written": self.bytes_written}
+
+    def add_user(self, email, uid=None):
+        user = SimpleNamespace(uid=uid or f"uid-{len(self.users) + 1}", email=email, display_name=None)
+        self.users[email] = user
+        return user
+
+    def _count(self, operation, payload, written):
+        size = len(payload.encode("utf-8"))
+        with self.lock:
+            self.calls[operation] += 1
+            if written:
+                self.bytes_written += size
+            else:
+                self.bytes_read += size
+
+    def get(self, parts):
+        node = self.root
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    # Grava um valor no caminho; None remove, e nós que ficam vazios somem como no Firebase
+    def put(self, parts, value):
+        if not parts:
+            self.root = value if isinstance(value, dict) else {}
+            return
+        trail, node = [], self.root
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                if value is None:
+                    return
+                child = node[part] = {}
+            trail.append((node, part))
+            node = child
+        if value is None or value == {}:
+            node.pop(parts[-1], None)
+            for parent, part in reversed(trail):
+                if parent[part]:
+                    break
+                del parent[part]
+        else:
+            # Incremento feito pelo servidor ({".sv": {"increment": n}})
+            if isinstance(value, dict) and ".sv" in value:
+                current = node.get(parts[-1])
+                value = (current if isinstance(current, (int, float)) else 0) + value[".sv"]["increment"]
+            node[parts[-1]] = value
+
+
+def split_path(path):
+    return [part for part in (path or "").split("/") if part]
+
+
+class FakeReference:
+    def __init__(self, database, path, query=None):
+        self.database = database
+        self.path = "/".join(split_path(path))
+        self._query = query or {}
+
+    @property
+    def key(self):
+        return split_path(self.path)[-1] if self.path else None
+
+    def child(self, path):
+        return FakeReference(self.database, f"{self.path}/{path}")
+
+    def _with(self, **query):
+        return FakeReference(self.database, self.path, {**self._query, **query})
+
+    def order_by_child(self, path):
+        return self._with(order=("child", path))
+
+    def order_by_key(self):
+        return self._with(order=("key", None))
+
+    def order_by_value(self):
+        return self._with(order=("value", None))
+
+    def start_at(self, value):
+        return self._with(start=value)
+
+    def end_at(self, value):
+        return self._with(end=value)
+
+    def equal_to(self, value):
+        return self._with(start=value, end=value)
+
+    def limit_to_first(self, limit):
+        return self._with(first=limit)
+
+    def limit_to_last(self, limit):
+        return self._with(last=limit)
+
+    def _apply_query(self, value):
+        if not self._query or not isinstance(value, dict):
+            return value
+        kind, child = self._query.get("order", ("key", None))
+
+        def sort_value(item):
+            key, entry = item
+            if kind == "key":
+                return key
+            if kind == "value":
+                return entry
+            return entry.get(child) if isinstance(entry, dict) else None
+
+        items = [item for item in value.items() if sort_value(item) is not None]
+        if "start" in self._query:
+            items = [item for item in items if sort_value(item) >= self._query["start"]]
+        if "end" in self._query:
+            items = [item for item in items if sort_value(item) <= self._query["end"]]
+        items.sort(key=sort_value)
+        if "first" in self._query:
+            items = items[:self._query["first"]]
+        if "last" in self._query:
+            items = items[-self._query["last"]:]
+        return dict(items)
+
+    def get(self):
+        # A serialização acontece sob o lock: o valor lido não é copiado antes
+        with self.database.lock:
+            payload = json.dumps(self._apply_query(self.database.get(split_path(self.path))))
+        self.database._count("get", payload, written=False)
+        return json.loads(payload)
+
+    def set(self, value):
+        payload = json.dumps(value)
+        self.database._count("set", payload, written=True)
+        with self.database.lock:
+            self.database.put(split_path(self.path), json.loads(payload))
+
+    def update(self, value):
+        payload = json.dumps(value)
+        self.database._count("update", payload, written=True)
+        base = split_path(self.path)
+        with self.database.lock:
+            for path, entry in json.loads(payload).items():
+                self.database.put(base + split_path(path), entry)
+
+    def delete(self):
+        self.database._count("delete", "", written=True)
+        with self.database.lock:
+            self.database.put(split_path(self.path), None)
+
+
+# Credencial vazia: deixa o initialize_app criar o app padrão sem arquivo de chave
+def _fake_credential():
+    from firebase_admin import credentials
+
+    class FakeCredential(credentials.Base):
+        def get_credential(self):
+            return None
+
+    return FakeCredential()
+
+
+# Troca o firebase_admin.db e o auth pelo banco em memória e inicializa o app padrão.
+# Deve ser chamado antes do primeiro acesso do app ao Firebase.
+def install(database=None):
+    import firebase_admin
+    from firebase_admin import auth, db
+
+    database = database or FakeDatabase()
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(_fake_credential(), {"databaseURL": "https://benchmark.firebaseio.test"})
+    db.reference = lambda path="/", app=None, url=None: FakeReference(database, path)
+
+    def get_user_by_email(email, app=None):
+        if email not in database.users:
+            raise auth.UserNotFoundError(f"No user record found for the provided email: {email}.")
+        return database.users[email]
+
+    auth.get_user_by_email = get_user_by_email
+    auth.create_user = lambda email=None, password=None, **kwargs: database.add_user(email)
+    return database
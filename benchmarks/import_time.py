@@ -0,0 +1,97 @@
+# Mede o tempo de partida do app: quanto leva o "import app" em um interpretador novo
+# (como no primeiro acesso ao dyno) e quais módulos mais pesam nesse tempo.
+#
+# Uso:
+#   python benchmarks/import_time.py              # 5 execuções, relatório em texto
+#   python benchmarks/import_time.py --runs 10 --json
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos pesados que o app só deve carregar quando forem usados
+LAZY_MODULES = ["plotly.express", "firebase_admin"]
+
+IMPORT_SCRIPT = f"""
+import sys, time, json
+sys.path.insert(0, {APP_DIR!r})
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [name for name in {LAZY_MODULES!r} if name in sys.modules]}}))
+"""
+
+# Função para rodar um "import app" em um processo novo, com -X importtime
+def run_once():
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_SCRIPT],
+        capture_output=True, text=True, cwd=APP_DIR
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    measured = json.loads(result.stdout.strip().splitlines()[-1])
+    measured["process_seconds"] = wall
+    measured["modules"] = parse_importtime(result.stderr)
+    return measured
+
+# Converte a saída do -X importtime em {módulo importado pelo app: tempo acumulado em segundos}.
+# Cada linha é "import time: próprio | acumulado | módulo", com o nome indentado pela profundidade.
+def parse_importtime(stderr):
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            modules[name.strip()] = int(cumulative) / 1_000_000
+    return modules
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo de import do app.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="imprime o resultado em JSON")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    import_seconds = [run["seconds"] for run in runs]
+    process_seconds = [run["process_seconds"] for run in runs]
+    modules = {}
+    for run in runs:
+        for name, seconds in run["modules"].items():
+            modules.setdefault(name, []).append(seconds)
+    top = sorted(
+        ((name, statistics.median(values)) for name, values in modules.items()),
+        key=lambda item: item[1], reverse=True
+    )[:args.top]
+
+    result = {
+        "runs": args.runs,
+        "import_seconds_median": statistics.median(import_seconds),
+        "import_seconds_min": min(import_seconds),
+        "process_seconds_median": statistics.median(process_seconds),
+        "lazy_modules_loaded": sorted({name for run in runs for name in run["loaded"]}),
+        "top_modules": [{"module": name, "seconds": seconds} for name, seconds in top],
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"import app (mediana de {args.runs}): {result['import_seconds_median'] * 1000:.0f} ms "
+          f"(mínimo {result['import_seconds_min'] * 1000:.0f} ms)")
+    print(f"processo completo (mediana): {result['process_seconds_median'] * 1000:.0f} ms")
+    print(f"módulos pesados carregados no import: {', '.join(result['lazy_modules_loaded']) or 'nenhum'}")
+    print("imports do app mais lentos:")
+    for entry in result["top_modules"]:
+        print(f"  {entry['seconds'] * 1000:8.1f} ms  {entry['module']}")
+
+if __name__ == "__main__":
+    main()
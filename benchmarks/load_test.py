@@ -0,0 +1,180 @@
+# Teste de carga: várias sessões simultâneas do app, cada uma dirigida pelo AppTest do
+# Streamlit contra o Firebase em memória (benchmarks/fake_firebase.py). Cada sessão faz
+# login, abre os lançamentos, troca o gráfico e adiciona uma despesa; o resultado traz os
+# percentis de tempo de cada passo e as chamadas e bytes trocados com o banco, em JSON.
+#
+# O AppTest não suporta duas execuções ao mesmo tempo no mesmo processo, então as sessões
+# simultâneas rodam em processos separados, cada um com o seu banco em memória e os mesmos
+# usuários sintéticos; os contadores do banco são somados no final.
+#
+# Uso:
+#   python benchmarks/load_test.py --sessions 8 --rows 10000
+#   python benchmarks/load_test.py --sessions 32 --users 4 --output carga.json
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_FILE = os.path.join(os.path.dirname(BENCH_DIR), "app.py")
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import fake_firebase
+from synthetic import synthetic_expenses, synthetic_savings
+
+
+# Cria os usuários com extratos sintéticos gravados pelo próprio FinanceManager
+def seed_users(app, database, users, rows):
+    emails = []
+    for number in range(users):
+        user = database.add_user(f"usuario{number}@exemplo.com")
+        fm = app.FinanceManager.from_frames(
+            user.uid, synthetic_expenses(rows, seed=number), synthetic_savings(max(1, rows // 20), seed=number)
+        )
+        fm.rewrite_rollups()
+        fm._dirty_expenses.update(int(key) for key in fm.expenses.column("Chave"))
+        fm._dirty_savings.update(int(key) for key in fm.monthly_savings.column("Chave"))
+        fm.flush()
+        emails.append(user.email)
+    return emails
+
+
+# Estado de cada processo de sessões: o banco em memória e os e-mails dos usuários
+worker = {}
+
+
+def start_worker(users, rows):
+    os.environ.setdefault("LEDGER_BACKEND", "firebase")
+    os.environ["LEDGER_CACHE_DIR"] = ""
+    database = fake_firebase.install()
+    import app
+
+    worker["database"] = database
+    worker["emails"] = seed_users(app, database, users, rows)
+
+
+# O extrato carrega em segundo plano; no navegador, o painel de tarefas roda o app de novo
+# quando ele chega, o que aqui é feito rodando o AppTest até as tabelas aparecerem
+def open_ledger(at, timeout):
+    at.toggle(key="show_ledger").set_value(True).run()
+    deadline = time.perf_counter() + timeout
+    while at.session_state["finance_manager"] is None and time.perf_counter() < deadline:
+        time.sleep(0.01)
+        at.run()
+
+
+# As gravações também rodam em segundo plano: o passo só termina quando chegam ao banco
+def wait_saved(at, timeout):
+    fm = at.session_state["finance_manager"]
+    deadline = time.perf_counter() + timeout
+    while (fm.has_pending_writes() or fm._flush_future is not None) and time.perf_counter() < deadline:
+        time.sleep(0.005)
+
+
+def timed(steps, name, action):
+    started = time.perf_counter()
+    action()
+    steps[name] = time.perf_counter() - started
+
+
+# Uma sessão completa; devolve o tempo de cada passo, as exceções do script, se houver,
+# e os contadores do banco durante a sessão
+def run_session(number, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    database = worker["database"]
+    email = worker["emails"][number % len(worker["emails"])]
+    database.reset_counters()
+    steps = {}
+    at = AppTest.from_file(APP_FILE, default_timeout=timeout)
+    timed(steps, "login_page", at.run)
+    at.text_input(key="login_email_unique").set_value(email)
+    at.text_input(key="login_password_unique").set_value("senha")
+    timed(steps, "login", lambda: at.button(key="FormSubmitter:login_form-Login").click().run())
+    timed(steps, "open_ledger", lambda: open_ledger(at, timeout))
+    chart = next(widget for widget in at.selectbox if widget.label.startswith("Selecione"))
+    timed(steps, "change_chart", lambda: chart.set_value("Gastos Mensais").run())
+    next(widget for widget in at.text_input if widget.label == "Estabelecimento").set_value("Padaria")
+    add_button = next(widget for widget in at.button if widget.label == "Adicionar Despesa")
+    timed(steps, "add_expense", lambda: (add_button.click().run(), wait_saved(at, timeout)))
+    return steps, [str(exception.value) for exception in at.exception], database.counters()
+
+
+def percentiles(values):
+    ordered = sorted(values)
+    return {
+        "p50": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        "max": ordered[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga com sessões simultâneas do AppTest")
+    parser.add_argument("--sessions", type=int, default=8, help="total de sessões")
+    parser.add_argument("--concurrency", type=int, default=None, help="sessões ao mesmo tempo (padrão: todas)")
+    parser.add_argument("--users", type=int, default=2, help="usuários distintos entre as sessões")
+    parser.add_argument("--rows", type=int, default=5_000, help="despesas por usuário")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    # O AppTest troca o módulo __main__ do processo pelo app, então as funções enviadas aos
+    # processos são as do módulo load_test importado pelo nome
+    import load_test
+
+    concurrency = args.concurrency or args.sessions
+    executor = ProcessPoolExecutor(
+        max_workers=concurrency, mp_context=get_context("spawn"),
+        initializer=load_test.start_worker, initargs=(args.users, args.rows)
+    )
+    with executor:
+        # Sobe e popula todos os processos antes de medir
+        list(executor.map(time.sleep, [0.1] * concurrency))
+        started = time.perf_counter()
+        futures = [executor.submit(load_test.run_session, number, args.timeout) for number in range(args.sessions)]
+        sessions, failures = [], []
+        calls, bytes_read, bytes_written = Counter(), 0, 0
+        for future in futures:
+            try:
+                steps, exceptions, counters = future.result()
+            except Exception:
+                failures.append(traceback.format_exc())
+                continue
+            sessions.append(steps)
+            failures.extend(exceptions)
+            calls.update(counters["calls"])
+            bytes_read += counters["bytes_read"]
+            bytes_written += counters["bytes_written"]
+        elapsed = time.perf_counter() - started
+
+    step_names = sessions[0].keys() if sessions else []
+    result = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "sessions": args.sessions,
+        "concurrency": concurrency,
+        "users": args.users,
+        "rows_per_user": args.rows,
+        "wall_seconds": elapsed,
+        "completed": len(sessions),
+        "failures": failures,
+        "steps": {name: percentiles([steps[name] for steps in sessions]) for name in step_names},
+        "database": {"calls": dict(calls), "bytes_read": bytes_read, "bytes_written": bytes_written},
+    }
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
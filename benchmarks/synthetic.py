@@ -0,0 +1,45 @@
+# Extratos sintéticos para os benchmarks: despesas, entradas e CSVs no formato dos bancos
+import numpy as np
+import pandas as pd
+
+CATEGORIES = ["Alimentação", "Transporte", "Custo Fixo", "Saúde", "Educação", "Lazer", "Restaurante", "Outros"]
+SAVINGS_TYPES = ["Salário", "Bônus", "Extra", "Décimo Terceiro", "FGTS"]
+
+
+def _dates(rng, rows, years=5):
+    offsets = rng.integers(0, 365 * years, rows)
+    return pd.Timestamp("2020-01-01") + pd.to_timedelta(offsets, unit="D")
+
+
+# Despesas com estabelecimentos e categorias repetidos, como em um extrato real
+def synthetic_expenses(rows, seed=0, establishments=2_000):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "ID": np.arange(1, rows + 1),
+        "Data": _dates(rng, rows).strftime("%Y-%m-%d"),
+        "Estabelecimento": np.char.add("Loja ", rng.integers(0, establishments, rows).astype(str)),
+        "Categoria": rng.choice(CATEGORIES, rows),
+        "Valor": rng.integers(100, 100_000, rows) / 100,
+    })
+
+
+def synthetic_savings(rows, seed=0):
+    rng = np.random.default_rng(seed + 1)
+    return pd.DataFrame({
+        "ID": np.arange(1, rows + 1),
+        "Tipo Entrada": rng.choice(SAVINGS_TYPES, rows),
+        "Data": _dates(rng, rows).strftime("%Y-%m-%d"),
+        "Valor": rng.integers(100_000, 1_000_000, rows) / 100,
+    })
+
+
+# CSV de despesas no formato brasileiro (";", "1.234,56" e "dd/mm/aaaa")
+def synthetic_csv(rows, seed=0):
+    expenses = synthetic_expenses(rows, seed)
+    csv = pd.DataFrame({
+        "Estabelecimento": expenses["Estabelecimento"],
+        "Valor da Despesa": expenses["Valor"].map(lambda value: f"{value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")),
+        "Data": pd.to_datetime(expenses["Data"]).dt.strftime("%d/%m/%Y"),
+        "Categoria": expenses["Categoria"],
+    })
+    return csv.to_csv(index=False, sep=";").encode("utf-8")
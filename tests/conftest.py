@@ -0,0 +1,22 @@
+# Os testes usam o armazenamento SQLite em memória e nenhum cache em disco; as variáveis
+# precisam estar definidas antes do primeiro import do app
+import itertools
+import os
+import sys
+
+import pytest
+
+os.environ["LEDGER_BACKEND"] = "sqlite"
+os.environ["LEDGER_SQLITE_PATH"] = ":memory:"
+os.environ["LEDGER_CACHE_DIR"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+USER_IDS = itertools.count(1)
+
+
+# FinanceManager de um usuário novo a cada teste, gravando direto no SQLite
+@pytest.fixture
+def fm():
+    return app.FinanceManager(f"teste-{next(USER_IDS)}")
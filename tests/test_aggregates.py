@@ -0,0 +1,115 @@
+# Os totais mantidos incrementalmente não podem divergir de um recálculo completo do extrato
+import datetime
+from concurrent.futures import Future
+
+import pandas as pd
+
+import app
+
+CSV = (
+    "Estabelecimento;Valor da Despesa;Data;Categoria\n"
+    "Padaria Central;12,50;05/01/2024;Alimentação\n"
+    "Posto Shell;1.234,56;20/01/2024;\n"
+    "Cinema;30,00;02/02/2024;Lazer\n"
+    "Sem valor;;03/02/2024;Lazer\n"
+).encode("utf-8")
+
+
+def test_aggregates_match_ledger_after_every_mutation(fm):
+    fm.add_expense("Mercado", "Alimentação", 100.10, datetime.date(2024, 1, 10))
+    fm.add_expense("Farmácia", "Saúde", 45.35, datetime.date(2024, 2, 1))
+    fm.add_monthly_savings("Salário", 5000.00, datetime.date(2024, 1, 5))
+    fm.add_monthly_savings("Bônus", 750.25, datetime.date(2024, 2, 5))
+    assert fm.aggregates_match_ledger()
+
+    market, pharmacy = fm.expenses
+    salary, bonus = fm.monthly_savings
+    fm.edit_expense(market.key, "Mercado", "Outros", 99.90, datetime.date(2024, 3, 10))
+    fm.edit_monthly_savings(bonus.key, "Extra", 700.00, datetime.date(2024, 3, 5))
+    assert fm.aggregates_match_ledger()
+
+    fm.delete_expense(pharmacy.key)
+    fm.delete_monthly_savings(salary.key)
+    assert fm.aggregates_match_ledger()
+
+    report = fm.add_expenses_from_csv(CSV)
+    assert report.added == 3
+    assert fm.aggregates_match_ledger()
+
+    page_df, _ = fm.get_ledger_page("expenses", 1, 50, "Data")
+    # Como na tabela do app, a chave vai para o editor como texto
+    page_df["Chave"] = page_df["Chave"].astype(str)
+    edited_df = page_df.copy()
+    edited_df.loc[edited_df.index[0], "Valor"] += 10
+    edited_df.loc[edited_df.index[1], "Categoria"] = "Lazer"
+    edited_df = edited_df.drop(edited_df.index[2])
+    new_row = pd.DataFrame({"Data": [datetime.date(2024, 4, 1)], "Estabelecimento": ["Nova"], "Categoria": ["Lazer"], "Valor": [8.0]})
+    edited_df = pd.concat([edited_df, new_row], ignore_index=True)
+    changes = fm.apply_editor_diff(page_df, edited_df)
+    assert changes == {"changed": 2, "added": 1, "deleted": 1}
+    assert fm.aggregates_match_ledger()
+
+    savings_df, _ = fm.get_ledger_page("savings")
+    edited_savings = savings_df.copy()
+    edited_savings.loc[edited_savings.index[0], "Valor"] = 1.0
+    fm.apply_editor_diff(savings_df, edited_savings, ledger="savings")
+    assert fm.aggregates_match_ledger()
+
+
+def test_aggregates_survive_a_reload(fm):
+    fm.add_expenses_from_csv(CSV)
+    fm.add_monthly_savings("Salário", 5000.00, datetime.date(2024, 1, 5))
+    assert fm.flush()
+    reloaded, loaded = app.load_finance_manager(fm.user_id)
+    assert loaded
+    assert reloaded.aggregates == fm.aggregates
+    assert reloaded.aggregates_match_ledger()
+
+
+def test_rows_without_labels_keep_their_month(fm):
+    page_df, _ = fm.get_ledger_page("expenses")
+    new_row = pd.DataFrame({"Data": [datetime.date(2024, 5, 3)], "Valor": [25.0]})
+    fm.apply_editor_diff(page_df, pd.concat([page_df, new_row], ignore_index=True))
+    assert fm.get_total_expenses() == 25.0
+    assert fm.aggregates.month_document(202405)["Gastos"] == 2500
+    assert fm.aggregates_match_ledger()
+
+    # O resumo gravado tem o mês, então o login seguinte não precisa regravá-lo
+    assert fm.flush()
+    stored = app.LedgerAggregates.from_documents(app.get_ledger_store().load_node(fm.user_id, 'rollups'))
+    assert stored == fm.aggregates
+
+    fm.rewrite_rollups()
+    assert fm.flush()
+    stored = app.LedgerAggregates.from_documents(app.get_ledger_store().load_node(fm.user_id, 'rollups'))
+    assert stored.by_month == {202405: 2500}
+
+
+def test_blank_labels_do_not_break_the_stored_rollups(fm):
+    fm.add_expense("", "Outros", 10.0, datetime.date(2024, 6, 1))
+    fm.add_expense("  ", "Outros", 5.0, datetime.date(2024, 6, 2))
+    fm.add_expense("_vazio", "Outros", 2.0, datetime.date(2024, 6, 3))
+    assert fm.flush()
+
+    documents = app.get_ledger_store().load_node(fm.user_id, 'rollups')
+    assert isinstance(documents["m_202406"]["Estabelecimentos"], dict)
+    stored = app.LedgerAggregates.from_documents(documents)
+    assert stored == fm.aggregates
+    assert stored.by_establishment == {"": 1000, "  ": 500, "_vazio": 200}
+
+    reloaded, loaded = app.load_finance_manager(fm.user_id)
+    assert loaded and reloaded.aggregates == fm.aggregates
+
+
+def test_malformed_rollup_fields_are_ignored():
+    documents = {"m_202406": {"Gastos": 1000, "Estabelecimentos": 1000, "Categorias": {"Outros": 1000}}}
+    aggregates = app.LedgerAggregates.from_documents(documents)
+    assert aggregates.by_month == {202406: 1000}
+    assert aggregates.by_category == {"Outros": 1000}
+    assert aggregates.by_establishment == {}
+
+
+def test_unreadable_rollups_do_not_block_login():
+    summary = Future()
+    summary.set_result(({"rollups": app.ROLLUP_SCHEMA}, {"m_quebrado": {"Gastos": 1}}, {}, {}))
+    assert app.finish_loading_user_data({"summary": summary}) == (None, None, {}, {})
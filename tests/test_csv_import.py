@@ -0,0 +1,68 @@
+# Importação de CSV: o separador decimal é decidido uma vez por arquivo
+import io
+
+import pandas as pd
+
+import app
+
+
+def imported_values(fm, csv_text):
+    report = fm.add_expenses_from_csv(csv_text.encode("utf-8"))
+    assert not report.failed, report.message
+    return sorted(fm.expenses.column("Valor").tolist())
+
+
+def test_semicolon_file_uses_comma_decimals(fm):
+    csv_text = (
+        "Estabelecimento;Valor da Despesa;Data;Categoria\n"
+        "Loja A;1.234;05/01/2024;Outros\n"
+        "Loja B;1.234,56;06/01/2024;Outros\n"
+        "Loja C;R$ 10,5;07/01/2024;Outros\n"
+    )
+    assert imported_values(fm, csv_text) == [10.5, 1234.0, 1234.56]
+
+
+def test_comma_file_uses_dot_decimals(fm):
+    csv_text = (
+        "Estabelecimento,Valor da Despesa,Data,Categoria\n"
+        "Loja A,10.5,05/01/2024,Outros\n"
+        'Loja B,"1,234.56",06/01/2024,Outros\n'
+    )
+    assert imported_values(fm, csv_text) == [10.5, 1234.56]
+
+
+def test_comma_file_with_quoted_brazilian_values(fm):
+    csv_text = (
+        "Estabelecimento,Valor da Despesa,Data,Categoria\n"
+        'Loja A,"1.234,56",05/01/2024,Outros\n'
+        "Loja B,12,06/01/2024,Outros\n"
+    )
+    assert imported_values(fm, csv_text) == [12.0, 1234.56]
+
+
+def test_sniff_csv_format():
+    assert app.sniff_csv_format(io.BytesIO(b"a;b\n1,5;2\n")) == ("utf-8-sig", ";", ",")
+    assert app.sniff_csv_format(io.BytesIO(b"a,b\n1.5,2\n")) == ("utf-8-sig", ",", ".")
+    assert app.parse_brl_values(pd.Series(["1.234", "2,5"]), ",").tolist() == [1234.0, 2.5]
+
+
+def test_semicolon_file_with_dot_decimals(fm):
+    csv_text = (
+        "Estabelecimento;Valor da Despesa;Data;Categoria\n"
+        "Loja A;25.90;05/01/2024;Outros\n"
+        "Loja B;1234.5;06/01/2024;Outros\n"
+    )
+    assert imported_values(fm, csv_text) == [25.9, 1234.5]
+
+
+def test_values_contradicting_the_file_are_rejected(fm):
+    csv_text = (
+        "Estabelecimento;Valor da Despesa;Data;Categoria\n"
+        "Loja A;10,50;05/01/2024;Outros\n"
+        "Loja B;20,00;06/01/2024;Outros\n"
+        "Loja C;25.90;07/01/2024;Outros\n"
+    )
+    report = fm.add_expenses_from_csv(csv_text.encode("utf-8"))
+    assert report.added == 2
+    assert report.rejected_count() == 1
+    assert sorted(fm.expenses.column("Valor").tolist()) == [10.5, 20.0]
@@ -0,0 +1,48 @@
+# Cache local dos extratos: revalidação pelas marcas de remoção e a retenção delas
+import datetime
+
+import app
+
+
+def expense_names(expenses_df):
+    return sorted(expenses_df["Estabelecimento"])
+
+
+def test_old_tombstones_are_pruned_on_delete(fm):
+    store = app.get_ledger_store()
+    store.apply_changes(fm.user_id, {"deleted/expenses-id_99": app.now_ms() - app.TOMBSTONE_TTL_MS - 1})
+    fm.add_expense("Mercado", "Alimentação", 50.0, datetime.date(2024, 1, 10))
+    deleted = fm.expenses.row(0).key
+    fm.delete_expense(deleted)
+    assert fm.flush()
+    tombstones = store.load_tombstones(fm.user_id, 0)
+    assert list(tombstones) == [f"expenses-{app.record_key(deleted)}"]
+    assert store.load_node(fm.user_id, 'deleted') == tombstones
+
+
+def test_cache_revalidates_deletions(fm, tmp_path):
+    store, cache = app.get_ledger_store(), app.LedgerCache(str(tmp_path))
+    fm.add_expense("Mercado", "Alimentação", 50.0, datetime.date(2024, 1, 10))
+    fm.add_expense("Farmácia", "Saúde", 20.0, datetime.date(2024, 1, 11))
+    assert fm.flush()
+    cache.load(store, fm.user_id)
+    fm.delete_expense(fm.expenses.row(1).key)
+    assert fm.flush()
+    expenses_df, _ = cache.load(store, fm.user_id)
+    assert expense_names(expenses_df) == ["Mercado"]
+
+
+def test_cache_older_than_tombstone_retention_is_reloaded(fm, tmp_path, monkeypatch):
+    store, cache = app.get_ledger_store(), app.LedgerCache(str(tmp_path))
+    fm.add_expense("Mercado", "Alimentação", 50.0, datetime.date(2024, 1, 10))
+    fm.add_expense("Farmácia", "Saúde", 20.0, datetime.date(2024, 1, 11))
+    assert fm.flush()
+    cache.load(store, fm.user_id)
+    fm.delete_expense(fm.expenses.row(1).key)
+    assert fm.flush()
+    # A marca venceu e foi apagada: só a busca completa ainda vê a remoção
+    monkeypatch.setattr(app, "TOMBSTONE_TTL_MS", 0)
+    store.prune_tombstones(fm.user_id, app.now_ms() + 1)
+    assert store.load_node(fm.user_id, 'deleted') == {}
+    expenses_df, _ = cache.load(store, fm.user_id)
+    assert expense_names(expenses_df) == ["Mercado"]
@@ -0,0 +1,38 @@
+# Linhas do extrato são só leitura e seguem o registro, não a posição
+import datetime
+
+import pytest
+
+import app
+
+
+def test_rows_follow_their_record_after_deletes(fm):
+    fm.add_expense("Mercado", "Alimentação", 50.0, datetime.date(2024, 1, 10))
+    fm.add_expense("Farmácia", "Saúde", 20.0, datetime.date(2024, 1, 11))
+    market, pharmacy = fm.expenses
+    fm.delete_expense(market.key)
+    assert pharmacy.establishment == "Farmácia"
+    with pytest.raises(LookupError):
+        market.establishment
+
+
+def test_rows_are_read_only(fm):
+    fm.add_expense("Mercado", "Alimentação", 50.0, datetime.date(2024, 1, 10))
+    expense = fm.expenses.row(0)
+    with pytest.raises(AttributeError):
+        expense.value = 10.0
+    # Alterações passam pelo FinanceManager, que atualiza totais e gravações pendentes
+    fm.edit_expense(expense.key, "Mercado", "Alimentação", 10.0, datetime.date(2024, 1, 10))
+    assert expense.value == 10.0
+    assert fm.get_total_expenses() == 10.0
+    assert fm.aggregates_match_ledger()
+    assert fm.has_pending_writes()
+    assert isinstance(expense, app.Expense)
+
+
+def test_expense_date_bounds(fm):
+    assert fm.get_expense_date_bounds() == (None, None)
+    fm.add_expense("Mercado", "Alimentação", 50.0, datetime.date(2024, 3, 10))
+    fm.add_expense("Farmácia", "Saúde", 20.0, datetime.date(2023, 12, 24))
+    fm.add_expense("Cinema", "Lazer", 30.0, datetime.date(2024, 1, 5))
+    assert fm.get_expense_date_bounds() == (datetime.date(2023, 12, 24), datetime.date(2024, 3, 10))
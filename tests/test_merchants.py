@@ -0,0 +1,76 @@
+# Padronização dos estabelecimentos importados e deduplicação contra importações antigas
+import datetime
+
+import pandas as pd
+
+import app
+
+
+def normalized(*names):
+    merchants = app.MerchantNormalizer().normalize(pd.Series(names, dtype=object))
+    return list(zip(merchants["Estabelecimento"], merchants["Categoria"]))
+
+
+def test_known_merchants_and_codes():
+    assert normalized("UBER *TRIP 1234", "PAG*IFOOD", "UBER *EATS", "NETFLIX.COM 12345678") == [
+        ("Uber", "Transporte"), ("iFood", "Restaurante"), ("Uber Eats", "Restaurante"), ("Netflix", "Lazer")
+    ]
+    assert normalized("LOJA X PARC 01/12", "MP *LOJA Y 12/03") == [("Loja X", None), ("Loja Y", None)]
+
+
+def test_rules_match_whole_words():
+    assert normalized("SUPERMERCADO UBERLANDIA", "FARMACIA MONTES CLAROS", "RECURSO HUMANO LTDA") == [
+        ("Supermercado Uberlandia", "Alimentação"), ("Farmacia Montes Claros", "Saúde"), ("Recurso Humano Ltda", None)
+    ]
+
+
+def test_short_numbers_stay_in_the_name():
+    assert normalized("LOJA 1234", "PADARIA 2000", "PADARIA") == [
+        ("Loja 1234", None), ("Padaria 2000", "Alimentação"), ("Padaria", "Alimentação")
+    ]
+
+
+def test_rows_imported_before_normalization_are_deduplicated(fm):
+    # Despesa importada antes da padronização: o extrato guarda o nome original
+    fm.add_expense("PADARIA CENTRAL", "Alimentação", 12.5, datetime.date(2024, 1, 5))
+    csv_text = (
+        "Estabelecimento;Valor da Despesa;Data;Categoria\n"
+        "PADARIA CENTRAL;12,50;05/01/2024;Alimentação\n"
+        "CINEMA CENTRO;30,00;06/01/2024;Lazer\n"
+    )
+    report = fm.add_expenses_from_csv(csv_text.encode("utf-8"))
+    assert (report.added, report.deduplicated) == (1, 1)
+
+    # Um extrato sobreposto depois da padronização também não duplica
+    overlapping = csv_text + "MERCADO BOM;8,00;07/01/2024;Alimentação\n"
+    report = fm.add_expenses_from_csv(overlapping.encode("utf-8"))
+    assert (report.added, report.deduplicated) == (1, 2)
+    assert sorted(expense.establishment for expense in fm.expenses) == [
+        "Cinema Centro", "Mercado Bom", "PADARIA CENTRAL"
+    ]
+
+
+def test_edited_rows_are_deduplicated_on_reimport(fm):
+    csv_text = (
+        "Estabelecimento;Valor da Despesa;Data;Categoria\n"
+        "PADARIA X;10,00;05/01/2024;\n"
+        "PADARIA X;12,00;06/01/2024;\n"
+        "PADARIA X;14,00;07/01/2024;\n"
+    )
+    assert fm.add_expenses_from_csv(csv_text.encode("utf-8")).added == 3
+    # Uma linha muda de categoria e outra de nome: o mapa aprendido passa a valer nas importações
+    page_df, _ = fm.get_ledger_page("expenses")
+    page_df["Chave"] = page_df["Chave"].astype(str)
+    edited_df = page_df.copy()
+    edited_df.loc[edited_df.index[0], "Categoria"] = "Lazer"
+    fm.apply_editor_diff(page_df, edited_df)
+    page_df, _ = fm.get_ledger_page("expenses")
+    page_df["Chave"] = page_df["Chave"].astype(str)
+    edited_df = page_df.copy()
+    edited_df.loc[edited_df.index[1], "Estabelecimento"] = "Padaria do Zé"
+    fm.apply_editor_diff(page_df, edited_df)
+
+    overlapping = csv_text + "PADARIA X;16,00;08/01/2024;\n"
+    report = fm.add_expenses_from_csv(overlapping.encode("utf-8"))
+    assert (report.added, report.deduplicated) == (1, 3)
+    assert len(fm.expenses) == 4
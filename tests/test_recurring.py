@@ -0,0 +1,105 @@
+# Lançamentos recorrentes: datas das ocorrências, ocorrências vencidas e orçamentos
+import copy
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import app
+
+
+def dates(*values):
+    return np.array(values, dtype="datetime64[D]")
+
+
+def occurrences(start, frequency, count):
+    weekly = np.array([frequency == "Semanal"] * count)
+    step = np.array([{"Mensal": 1, "Semanal": 7, "Anual": 12}[frequency]] * count)
+    return app.occurrence_dates(dates(*[start] * count), weekly, step, np.arange(count)).tolist()
+
+
+def test_monthly_rule_keeps_the_start_day():
+    assert occurrences("2024-01-31", "Mensal", 4) == [
+        datetime.date(2024, 1, 31), datetime.date(2024, 2, 29), datetime.date(2024, 3, 31), datetime.date(2024, 4, 30)
+    ]
+
+
+def test_yearly_leap_day_rule():
+    assert occurrences("2024-02-29", "Anual", 5) == [
+        datetime.date(2024, 2, 29), datetime.date(2025, 2, 28), datetime.date(2026, 2, 28),
+        datetime.date(2027, 2, 28), datetime.date(2028, 2, 29)
+    ]
+
+
+def test_weekly_rule():
+    assert occurrences("2024-02-26", "Semanal", 3) == [
+        datetime.date(2024, 2, 26), datetime.date(2024, 3, 4), datetime.date(2024, 3, 11)
+    ]
+
+
+def test_last_occurrence_index():
+    start = dates("2024-01-31", "2024-01-31", "2024-01-31", "2024-01-31")
+    weekly = np.zeros(4, dtype=bool)
+    step = np.ones(4, dtype=np.int64)
+    at = dates("2024-01-30", "2024-02-28", "2024-02-29", "2024-03-30")
+    assert app.last_occurrence_index(start, weekly, step, at).tolist() == [-1, 0, 1, 1]
+
+
+def test_due_occurrences_continue_after_the_last_one():
+    rules = {
+        "rule_a": {"Tipo": "Despesa", "Descrição": "Aluguel", "Categoria": "Custo Fixo", "Valor": 1000.0,
+                   "Frequência": "Mensal", "Início": "2024-01-31", "Última": "2024-02-29"},
+        "rule_b": {"Tipo": "Entrada", "Descrição": "Salário", "Valor": 5000.0,
+                   "Frequência": "Anual", "Início": "2024-02-29", "Fim": "2025-12-31"},
+    }
+    positions, indices, due, latest = app.due_occurrences(app.recurring_frame(rules), datetime.date(2025, 3, 1))
+    assert positions.tolist() == [0] * 12 + [1, 1]
+    assert indices.tolist() == list(range(2, 14)) + [0, 1]
+    assert due[0] == np.datetime64("2024-03-31") and due[12] == np.datetime64("2024-02-29")
+    assert latest.tolist() == [datetime.date(2025, 2, 28), datetime.date(2025, 2, 28)]
+
+
+RULE = {"Tipo": "Despesa", "Descrição": "Aluguel", "Categoria": "Custo Fixo", "Valor": 1000.0,
+        "Frequência": "Mensal", "Início": "2024-01-31", "Fim": "2024-12-31"}
+
+
+def test_materializing_twice_does_not_duplicate(fm):
+    fm.recurring_rules = {"rule_a": dict(RULE)}
+    assert fm.materialize_recurring(datetime.date(2024, 6, 30)) == 6
+    # Outra cópia das regras, ainda sem a "Última" (rerun com o estado antigo)
+    fm.recurring_rules = {"rule_a": dict(RULE)}
+    assert fm.materialize_recurring(datetime.date(2024, 12, 31)) == 6
+    assert len(fm.expenses) == 12
+    assert fm.recurring_rules["rule_a"]["Última"] == "2024-12-31"
+    assert fm.aggregates_match_ledger()
+
+
+def test_two_sessions_materializing_the_same_rule(fm):
+    store = app.get_ledger_store()
+    store.apply_changes(fm.user_id, {"recurring/rule_a": RULE})
+    # As duas sessões carregam as regras antes de qualquer uma gravar
+    sessions = [app.load_finance_manager(fm.user_id)[0] for _ in range(2)]
+    rules = store.load_node(fm.user_id, 'recurring')
+    for session in sessions:
+        session.recurring_rules = copy.deepcopy(rules)
+    for session in sessions:
+        assert session.materialize_recurring(datetime.date(2024, 12, 31)) == 12
+        assert session.flush()
+
+    expenses_df = store.load_ledger(fm.user_id, 'expenses')
+    assert len(expenses_df) == 12
+    assert sorted(expenses_df["Data"])[:3] == ["2024-01-31", "2024-02-29", "2024-03-31"]
+    assert store.load_node(fm.user_id, 'recurring')["rule_a"]["Última"] == "2024-12-31"
+
+
+def test_budget_report(fm):
+    fm.add_expense("Mercado", "Alimentação", 450.0, datetime.date(2024, 1, 10))
+    fm.add_expense("Cinema", "Lazer", 30.0, datetime.date(2024, 1, 12))
+    report = app.budget_report(fm.aggregates, {"Alimentação": 50000, "Saúde": 10000}, [202401, 202402])
+    usage = report.set_index(["Mês", "Categoria"])["Uso"]
+    assert usage[(202401, "Alimentação")] == 0.9
+    assert usage[(202401, "Saúde")] == 0.0
+    assert usage[(202402, "Alimentação")] == 0.0
+    assert report["Orçamento"].tolist() == [500.0, 100.0, 500.0, 100.0]
+    assert app.budget_report(fm.aggregates, {}, [202401]).empty
+    assert isinstance(report, pd.DataFrame)
@@ -0,0 +1,67 @@
+# Filtros que cortam meses são respondidos pelo armazenamento (filtro e soma no banco)
+# e precisam dar o mesmo resultado do extrato carregado
+import datetime
+import os
+import sys
+
+import pytest
+
+import app
+
+START, END = datetime.date(2024, 1, 15), datetime.date(2024, 2, 10)
+
+
+def add_expenses(fm):
+    fm.add_expense("Mercado", "Alimentação", 100.10, datetime.date(2024, 1, 10))
+    fm.add_expense("Padaria", "Alimentação", 12.50, datetime.date(2024, 1, 15))
+    fm.add_expense("Cinema", "Lazer", 30.00, datetime.date(2024, 1, 31))
+    fm.add_expense("Farmácia", "Saúde", 45.35, datetime.date(2024, 2, 10))
+    fm.add_expense("Mercado", "Alimentação", 80.00, datetime.date(2024, 2, 11))
+    assert fm.flush()
+
+
+def assert_same_charts(fm, queries):
+    for categories in (None, ["Alimentação", "Saúde"]):
+        for method in ("get_expenses_by_category", "get_expenses_by_establishment", "get_expenses_by_month"):
+            expected = getattr(fm, method)(START, END, categories)
+            result = getattr(queries, method)(START, END, categories)
+            assert dict(zip(result.iloc[:, 0], result["Valor"])) == pytest.approx(dict(zip(expected.iloc[:, 0], expected["Valor"]))), method
+
+
+def test_sqlite_queries_match_loaded_ledger(fm):
+    add_expenses(fm)
+    assert not fm.aggregates.covers(START, END, None, "Categoria")
+    assert_same_charts(fm, app.StoredExpenseQueries(app.get_ledger_store(), fm.user_id))
+
+
+def test_firebase_queries_match_loaded_ledger():
+    pytest.importorskip("firebase_admin")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+    import fake_firebase
+
+    fm = app.FinanceManager("teste-firebase")
+    add_expenses(fm)
+    fake_firebase.install()
+    store = app.FirebaseLedgerStore()
+    # Mesmos registros, gravados no Firebase (em memória) como o app grava
+    store.apply_changes(fm.user_id, {
+        f"expenses/{app.record_key(key)}": record for key, record in fm.expenses.records(fm.expenses.column("Chave").tolist()).items()
+    })
+    assert_same_charts(fm, app.StoredExpenseQueries(store, fm.user_id))
+
+
+def test_failed_store_query_falls_back_to_loaded_ledger(fm, monkeypatch):
+    add_expenses(fm)
+
+    def missing_index(*args, **kwargs):
+        raise ValueError('Index not defined, add ".indexOn": "Data"')
+
+    monkeypatch.setattr(app.get_ledger_store(), "aggregate_expenses", missing_index)
+    loads = []
+    fig = app.stored_expense_chart(
+        fm.user_id, 0, "Gastos por Categoria", START, END, (), lambda: loads.append(fm) or fm
+    )
+    assert loads == [fm]
+    totals = dict(zip(fig.data[0].y, fig.data[0].x))
+    expected = fm.get_expenses_by_category(START, END)
+    assert totals == pytest.approx(dict(zip(expected["Categoria"], expected["Valor"])))
@@ -0,0 +1,94 @@
+# Duas sessões do mesmo usuário gravando ao mesmo tempo não podem apagar o trabalho uma da outra
+import datetime
+import threading
+import time
+
+import app
+
+
+def stored_rollups(user_id):
+    return app.LedgerAggregates.from_documents(app.get_ledger_store().load_node(user_id, 'rollups'))
+
+
+def test_two_sessions_adding_expenses_keep_both(fm):
+    fm.add_expense("Mercado", "Alimentação", 50.0, datetime.date(2024, 1, 10))
+    assert fm.flush()
+
+    first, _ = app.load_finance_manager(fm.user_id)
+    second, _ = app.load_finance_manager(fm.user_id)
+    first.add_expense("Cinema", "Lazer", 30.0, datetime.date(2024, 1, 12))
+    second.add_expense("Padaria", "Alimentação", 12.5, datetime.date(2024, 1, 15))
+    assert first.flush() and second.flush()
+
+    reloaded, _ = app.load_finance_manager(fm.user_id)
+    assert sorted(expense.establishment for expense in reloaded.expenses) == ["Cinema", "Mercado", "Padaria"]
+    assert reloaded.get_total_expenses() == 92.5
+    # Os resumos mensais somam as alterações das duas sessões
+    assert stored_rollups(fm.user_id) == reloaded.aggregates
+
+
+def test_deleted_record_key_is_not_reused(fm):
+    fm.add_expense("Mercado", "Alimentação", 50.0, datetime.date(2024, 1, 10))
+    fm.add_expense("Farmácia", "Saúde", 20.0, datetime.date(2024, 1, 11))
+    deleted = fm.expenses.row(1).key
+    fm.delete_expense(deleted)
+    fm.add_expense("Cinema", "Lazer", 30.0, datetime.date(2024, 1, 12))
+    assert fm.expenses.find(deleted) is None
+    assert fm.flush()
+
+    reloaded, _ = app.load_finance_manager(fm.user_id)
+    assert sorted(expense.establishment for expense in reloaded.expenses) == ["Cinema", "Mercado"]
+    assert stored_rollups(fm.user_id) == reloaded.aggregates
+
+
+def test_legacy_records_keep_their_paths(fm):
+    store = app.get_ledger_store()
+    store.apply_changes(fm.user_id, {
+        "expenses/id_1": {"ID": 1, "Data": "2024-01-10", "Estabelecimento": "Mercado", "Categoria": "Alimentação", "Valor": 50.0},
+        "expenses/id_2": {"ID": 2, "Data": "2024-01-11", "Estabelecimento": "Cinema", "Categoria": "Lazer", "Valor": 30.0},
+    })
+    legacy, _ = app.load_finance_manager(fm.user_id)
+    legacy.delete_expense(2)
+    legacy.edit_expense(1, "Mercado", "Alimentação", 55.0, datetime.date(2024, 1, 10))
+    assert legacy.flush()
+
+    expenses_df = store.load_ledger(fm.user_id, 'expenses')
+    assert expenses_df["Chave"].tolist() == [1]
+    assert expenses_df["Valor"].tolist() == [55.0]
+
+
+def test_failed_background_save_keeps_the_error(fm, monkeypatch, caplog):
+    def unavailable(user_id, updates):
+        raise ConnectionError("banco indisponível")
+
+    fm.add_expense("Mercado", "Alimentação", 50.0, datetime.date(2024, 1, 10))
+    monkeypatch.setattr(app.get_ledger_store(), "apply_changes", unavailable)
+    with caplog.at_level("ERROR", logger="gestor_financeiro.jobs"):
+        assert not fm.flush()
+    # A mensagem fica no FinanceManager para o script mostrar, e o erro vai para o log
+    assert fm.save_error == "banco indisponível"
+    assert "Falha ao salvar dados" in caplog.text
+    assert fm.has_pending_writes()
+
+    monkeypatch.undo()
+    assert fm.flush()
+    assert fm.save_error is None
+
+
+def test_background_save_does_not_wait_for_busy_jobs(fm):
+    # Tarefas longas (importações) ocupam todo o pool de tarefas
+    release = threading.Event()
+    busy = [app.get_job_executor().submit(release.wait) for _ in range(4)]
+    try:
+        fm.background_executor = app.get_flush_executor()
+        fm.add_expense("Mercado", "Alimentação", 50.0, datetime.date(2024, 1, 10))
+        assert fm.request_flush()
+        deadline = time.monotonic() + 5
+        while fm.has_pending_writes() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not fm.has_pending_writes()
+        assert len(app.get_ledger_store().load_ledger(fm.user_id, 'expenses')) == 1
+    finally:
+        release.set()
+        for future in busy:
+            future.result()